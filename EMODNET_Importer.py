@@ -16,6 +16,14 @@ import pylab
 from easygui import *
 from osgeo import ogr
 
+# Local imports
+import EMODNET_grid
+import EMODNET_loader
+import EMODNET_cache
+from EMODNET_cache import StatisticsCache
+from EMODNET_grid import get_grid_extent, XYZ_COLUMNS
+from EMODNET_loader import ParallelLoader, Checkpoint, read_grid_batches, grid_insert_statement, QUEUE_SIZE, COMMIT_NONE, COMMIT_AT_END, COMMIT_PER_BATCH, IMPORT_TABLE, PROGRESS_TABLE
+
 # Module name
 MODULE_NAME = "DTM Import"
 
@@ -140,6 +148,16 @@ TILE_SIZE  = "Tile size (degrees)"
 # File column product order to store file
 FILE_COL = "SYS012"
 
+# Number of points inserted into database per executemany
+INSERT_BATCH_SIZE = 100000
+
+# File with rejected lines of imported files ( line number, reason and line )
+QUARANTINE_FILE = 'c:/emodnet/skipped_rows.txt'
+
+# Number of writer sessions and commit mode ( None: commit by user for single writer, at end for more writers )
+INSERT_NR_WRITERS  = 1
+INSERT_COMMIT_MODE = None
+
 #########################################
 # GUI functions
 #########################################
@@ -258,47 +276,48 @@ def gui_import_dtm ( DbConnection ) :
         #logger.info("SD file path: " + str(sd_file_path))   
         #logger.info("SD file name: " + str(sd_file_name))   
 
-        # Select XYZ file
-        #msg      = "Select XYZ file of DTM"
-        #title    = "File selection"
-        #xyz_file = fileopenbox(msg, title, default='*', filetypes=[".xyz"])
-        #msg         = "Give column separator"
-        #title       = "File definition"
-        #if len(str(enterbox(msg, title, default='', strip=True, image=None, root=None))) == 0 :
-            #separator = ' ';
-        #logger.info("XYZ file: " + str(xyz_file))  
-        #logger.info("Separator: " + str(separator) )          
+        # Select XYZ file; its dimensions are used as default of the dimension fields
+        msg      = "Select XYZ file of DTM (cancel to type dimensions)"
+        title    = "File selection"
+        xyz_file = fileopenbox(msg, title, default='*', filetypes=[".xyz"])
+        logger.info("XYZ file: " + str(xyz_file))  
+        defaults = {}
+        if xyz_file :
+            msg       = "Give column separator (empty for space)"
+            title     = "File definition"
+            separator = enterbox(msg, title, default='', strip=False, image=None, root=None)
+            if not separator :
+                separator = ' '
+            logger.info("Separator: '" + str(separator) + "'" )          
+            defaults = get_dimensions ( xyz_file, separator )
+            logger.info(str(defaults))
 
         # Now extract the hull from the shapefile
         hull_wkt = extract_hull_from_shapefile ( logger, shape_file ) 
         
         # The dimensions we need 
-        #dimensions = get_dimensions ( xyz_file,separator )
-        #logger.info(str(dimensions))
-        # Date selection
-        
         dimensions = {}
         msg       = "Minimum X"
         title     = "Dimensions"
-        dimensions[MINX]      = float(enterbox(msg, title))
+        dimensions[MINX]      = float(enterbox(msg, title, default=str(defaults.get(MINX, ''))))
         msg       = "Maximum X"
         title     = "Dimensions"
-        dimensions[MAXX]      = float(enterbox(msg, title))
+        dimensions[MAXX]      = float(enterbox(msg, title, default=str(defaults.get(MAXX, ''))))
         msg       = "Minimum Y"
         title     = "Dimensions"
-        dimensions[MINY]      = float(enterbox(msg, title))
+        dimensions[MINY]      = float(enterbox(msg, title, default=str(defaults.get(MINY, ''))))
         msg       = "Maximum Y"
         title     = "Dimensions"
-        dimensions[MAXY]      = float(enterbox(msg, title))
+        dimensions[MAXY]      = float(enterbox(msg, title, default=str(defaults.get(MAXY, ''))))
         msg       = "Minimum Z"
         title     = "Dimensions"
-        dimensions[MINZ]      = float(enterbox(msg, title))
+        dimensions[MINZ]      = float(enterbox(msg, title, default=str(defaults.get(MINZ, ''))))
         msg       = "Maximum Z"
         title     = "Dimensions"
-        dimensions[MAXZ]      = float(enterbox(msg, title))        
+        dimensions[MAXZ]      = float(enterbox(msg, title, default=str(defaults.get(MAXZ, ''))))
         msg       = "Number of points"
         title     = "Dimensions"
-        dimensions[NOPS]      = int(integerbox(msg, title, default=1, lowerbound=1, upperbound=1000000000))        
+        dimensions[NOPS]      = int(integerbox(msg, title, default=max(int(defaults.get(NOPS, 1)), 1), lowerbound=1, upperbound=1000000000))        
         
         # Let's store the metadata
         attribute_list = {}
@@ -844,43 +863,24 @@ def extract_hull_from_shapefile ( logger, shape_file ) :
         logger.critical("Extract hull from shapefile failed: ERROR: %s\n" % str(err))
         raise
 
-def get_dimensions ( file_in, separator ) :
+def get_dimensions ( file_in, separator, nr_processes = None, use_cache = True ) :
     """Function to extract dimensions from xyz file"""
     try :
         logger.info ( "Extract dimensions from xyz file " + str(file_in) ) 
+        cache = None
+        if use_cache :
+            cache = StatisticsCache()
+        extent = get_grid_extent ( file_in, len(XYZ_COLUMNS), separator, XYZ_COLUMNS, nr_processes, cache )
+        logger.info ( str(extent[ EMODNET_grid.EXTENT_REJECTED ]) + " lines skipped" )
         d = {}
-        first_row = True
-        d[NOPS] = 0
-        file = open(file_in, 'r')
-        for line in file :
-            d[NOPS] = d[NOPS] + 1
-            l = line.rstrip().split(separator)
-            x = float(l[0])
-            y = float(l[1])
-            z = float(l[2])
-            if first_row :
-                d[MINX] = x
-                d[MAXX] = x
-                d[MINY] = y
-                d[MAXY] = y
-                d[MINZ] = z
-                d[MAXZ] = z
-                first_row = False
-            else :
-                if x < d[MINX] :
-                    d[MINX] = x
-                if x > d[MAXX] :
-                    d[MAXX] = x                    
-                if y < d[MINY] :
-                    d[MINY] = y
-                if y > d[MAXY] :
-                    d[MAXY] = y              
-                if z < d[MINZ] :
-                    d[MINZ] = z
-                if z > d[MAXZ] :
-                    d[MAXZ] = z              
-        file.close() 
-        logger.info ('Now return')
+        d[NOPS] = extent[ EMODNET_grid.EXTENT_POINTS ]
+        if d[NOPS] > 0 :
+            d[MINX] = extent[ EMODNET_grid.EXTENT_MINX ]
+            d[MAXX] = extent[ EMODNET_grid.EXTENT_MAXX ]
+            d[MINY] = extent[ EMODNET_grid.EXTENT_MINY ]
+            d[MAXY] = extent[ EMODNET_grid.EXTENT_MAXY ]
+            d[MINZ] = extent[ EMODNET_grid.EXTENT_MINZ ]
+            d[MAXZ] = extent[ EMODNET_grid.EXTENT_MAXZ ]
         return d
     except Exception, err:
         logger.critical("Extract dimensions from xyz file failed: ERROR: %s\n" % str(err))
@@ -938,6 +938,9 @@ class DbConnection:
         try :
             self.logger = logging.getLogger( MODULE_NAME +'.DbConnection' )
             self.logger.info("Setup database connection")
+            self.DbUser    = DbUser
+            self.DbPass    = DbPass
+            self.DbConnect = DbConnect
             self.oracle_connection = cx_Oracle.connect(DbUser, DbPass, DbConnect)
             self.oracle_cursor = self.oracle_connection.cursor()
             self.oracle_cursor.execute("select 'established' from dual")
@@ -1044,99 +1047,70 @@ class DbConnection:
             raise
 
 
-    def write_points_to_db ( self, import_file, nr_columns, separator ) :
+    def write_points_to_db ( self, import_file, nr_columns, separator, batch_size = INSERT_BATCH_SIZE, nr_writers = INSERT_NR_WRITERS, commit_mode = INSERT_COMMIT_MODE, checkpoint = False, resume = False, quarantine_file = QUARANTINE_FILE, restart = False ) :
         """Function write points to database"""
         try :
             self.logger.info( "Write points to database")
             
-            # Determine insert statement based on number of columns (3 of 12)
-            self.logger.info ( "Build insert statememt" )            
-            if int(nr_columns) == int(3) :
-                insert_stmt = 'insert into sdb_im_import_temp ( x, y, z ) values ( :1, :2, :3 )'    
-            if int(nr_columns) == int(12) :
-                insert_stmt = 'insert into sdb_im_import_temp ( x, y, z, '
-                insert_stmt = insert_stmt + ' customattribute0, customattribute1, customattribute2, customattribute3, customattribute4, '
-                insert_stmt = insert_stmt + ' customattribute5, customattribute6, customattribute7, customattribute8 ) '                
-                insert_stmt = insert_stmt + ' values ( :1, :2, :3, :4, :5, :6, :7, :8, :9, :10, :11, :12 )'
-          
-            # Count number of points
-            self.logger.info ( "Count number of points in grid" )
-            file = open(import_file,'r')
-            nr_of_lines = 0
-            for line in file :
-                nr_of_lines = nr_of_lines + 1
-                if nr_of_lines % 10000000 == 0 :
-                    self.logger.info(str(nr_of_lines) + " counted")
-            file.close()
-            self.logger.info("Total number of points in grid: " + str(nr_of_lines))               
-            
-            # Now read points from file and insert into array
+            # File is parsed in this thread and batches are inserted by writer threads
             self.logger.info ( "Start inserting points into database" )
-            skipped_file = 'c:/emodnet/skipped_rows.txt'
-            depths = []
-            i = 0
-            j = 0
-            fIn = open(import_file,'r')  
-            fOut = open(skipped_file,'w')  
-            
-            # Loop through file
-            for line in fIn : 
-
-                # Split line into columns
-                c = line.rstrip().split(separator)
 
-                # Write columns to array type(i) is float
-                try :
-                    if nr_columns == 3 :
-                        depths.append( ( float(c[0]), float(c[1]), float(c[2]) ) )
-                        i = i + 1
-                    if nr_columns == 4 :
-                        depths.append( ( float(c[0]), float(c[1]), float(c[2]), str(c[3]) ) )
-                        i = i + 1
-                    if nr_columns == 5 :
-                        depths.append( ( float(c[0]), float(c[1]), float(c[2]), str(c[3]), str(c[4]) ) )
-                        i = i + 1
-                    if nr_columns == 6 :
-                        depths.append( ( float(c[0]), float(c[1]), float(c[2]), str(c[3]), str(c[4]), str(c[5]) ) )
-                        i = i + 1
-                    if nr_columns == 7 :
-                        depths.append( ( float(c[0]), float(c[1]), float(c[2]), str(c[3]), str(c[4]), str(c[5]), str(c[6]) ) )
-                        i = i + 1
-                    if nr_columns == 8 :
-                        depths.append( ( float(c[0]), float(c[1]), float(c[2]), str(c[3]), str(c[4]), str(c[5]), str(c[6]), str(c[7]) ) )
-                        i = i + 1
-                    if nr_columns == 9 :
-                        depths.append( ( float(c[0]), float(c[1]), float(c[2]), str(c[3]), str(c[4]), str(c[5]), str(c[6]), str(c[7]), str(c[8]) ) )
-                        i = i + 1
-                    if nr_columns == 10 :
-                        depths.append( ( float(c[0]), float(c[1]), float(c[2]), str(c[3]), str(c[4]), str(c[5]), str(c[6]), str(c[7]), str(c[8]), str(c[9]) ) )
-                        i = i + 1
-                    if nr_columns == 11 :
-                        depths.append( ( float(c[0]), float(c[1]), float(c[2]), str(c[3]), str(c[4]), str(c[5]), str(c[6]), str(c[7]), str(c[8]), str(c[9]), str(c[10]) ) )
-                        i = i + 1
-                    if nr_columns == 12 :
-                        depths.append( ( float(c[0]), float(c[1]), float(c[4]), str(c[3]), str(c[2]), str(c[5]), str(c[6]), str(c[7]), str(c[8]), str(c[9]), str(c[10]), str(c[11]) ) )
-                        i = i + 1
-                    if nr_columns == 13 :
-                        depths.append( ( float(c[0]), float(c[1]), float(c[2]), str(c[3]), str(c[4]), str(c[5]), str(c[6]), str(c[7]), str(c[8]), str(c[9]), str(c[10]), str(c[11]), str(c[12]) ) )
-                        i = i + 1
-                except Exception, err :
-                    fOut.write(line + '\n')
-                    j = j + 1
-                
-                if i % 1000000 == 0 or i == int(nr_of_lines):
-                    self.oracle_cursor.prepare( insert_stmt )
-                    self.oracle_cursor.executemany(None, depths)                    
-                    self.logger.info(str(i) + " points written to database")
-                    depths = []
-            self.logger.info(str(j) + " points skipped")
-                
-            # Close file when all points are inserted and create spatial index on database
-            fIn.close()
-            fOut.close()
+            # With checkpoints every committed batch is registered in sidecar file; resume skips committed parts of file
+            # With restart an outdated checkpoint (file has changed) is discarded together with the points it committed
+            import_checkpoint = None
+            ranges            = None
+            pool              = None
+            if checkpoint or resume :
+                if commit_mode is None :
+                    commit_mode = COMMIT_PER_BATCH
+                import_checkpoint = Checkpoint ( import_file )
+                if resume and import_checkpoint.read( restart ) :
+                    import_checkpoint.recover( self.oracle_cursor )
+                    ranges = import_checkpoint.pending_ranges()
+                    self.logger.info( "Resume import at line " + str(import_checkpoint.line) + " (byte offset " + str(import_checkpoint.offset) + ", " + str(import_checkpoint.rows) + " points committed)" )
+                else :
+                    if import_checkpoint.discarded_load_id is not None :
+                        self.logger.info( "Remove points and progress of discarded load" )
+                        self.oracle_cursor.execute( "delete from " + IMPORT_TABLE + " where load_id = :1", ( import_checkpoint.discarded_load_id, ) )
+                        self.oracle_cursor.execute( "delete from " + PROGRESS_TABLE + " where load_id = :1", ( import_checkpoint.discarded_load_id, ) )
+                        self.oracle_connection.commit()
+                    import_checkpoint.write()
+
+            # Determine insert statement based on number of columns (3 of 12); points of a checkpointed load get its load id
+            self.logger.info ( "Build insert statememt" )            
+            if import_checkpoint is not None :
+                insert_stmt = grid_insert_statement ( nr_columns, IMPORT_TABLE, import_checkpoint.load_id )
+            else :
+                insert_stmt = grid_insert_statement ( nr_columns )
+            batches = read_grid_batches ( import_file, nr_columns, separator, batch_size, quarantine_file, ranges )
+            if int(nr_writers) == 1 :
+                # Single writer uses connection of this session; by default commit is left to the user
+                if commit_mode is None :
+                    commit_mode = COMMIT_NONE
+                loader = ParallelLoader ( lambda : self.oracle_connection, lambda connection : None, insert_stmt, 1, QUEUE_SIZE, commit_mode, import_checkpoint )
+            else :
+                # Every writer gets own session from pool; points must be committed before they are visible to this session
+                if commit_mode is None :
+                    commit_mode = COMMIT_AT_END
+                if commit_mode == COMMIT_NONE :
+                    raise ValueError( "Commit mode " + str(commit_mode) + " is only possible with a single writer" )
+                pool = cx_Oracle.SessionPool ( self.DbUser, self.DbPass, self.DbConnect, int(nr_writers), int(nr_writers), 0, threaded = True )
+                loader = ParallelLoader ( pool.acquire, pool.release, insert_stmt, nr_writers, QUEUE_SIZE, commit_mode, import_checkpoint )
+            try :
+                i = loader.load( batches )
+            finally :
+                if pool is not None :
+                    pool.close()
+            if import_checkpoint is not None :
+                i = import_checkpoint.rows
             
             self.logger.info("Generate HH codes and spatial index on database")
             self.oracle_cursor.callproc("sdb_load_data_pck.load_emodnetgrid", [ 0 ]) 
+
+            # Import is finished, so there is nothing left to resume
+            if import_checkpoint is not None :
+                import_checkpoint.clear_progress( self.oracle_cursor )
+                import_checkpoint.remove()
            
             return i
             
@@ -1428,6 +1402,12 @@ if __name__ == "__main__":
     formatter   = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
     stream_hdlr.setFormatter(formatter)
     logger.addHandler(stream_hdlr)
+    logging.getLogger( EMODNET_grid.MODULE_NAME ).setLevel( level )
+    logging.getLogger( EMODNET_grid.MODULE_NAME ).addHandler( stream_hdlr )
+    logging.getLogger( EMODNET_loader.MODULE_NAME ).setLevel( level )
+    logging.getLogger( EMODNET_loader.MODULE_NAME ).addHandler( stream_hdlr )
+    logging.getLogger( EMODNET_cache.MODULE_NAME ).setLevel( level )
+    logging.getLogger( EMODNET_cache.MODULE_NAME ).addHandler( stream_hdlr )
 
     ############################
     # Database connection
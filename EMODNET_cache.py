@@ -0,0 +1,122 @@
+#! /usr/bin/python
+
+""" On disk cache of statistics of grid and XYZ files keyed by file fingerprint
+"""
+
+# Standard library imports
+import os
+import json
+import logging
+import hashlib
+
+# Module name
+MODULE_NAME = "EMODNET cache"
+
+# Default cache directory and maximum size of all cache files together
+CACHE_DIR       = os.path.join( os.path.expanduser("~"), ".emodnet_cache" )
+CACHE_MAX_BYTES = 4 * 1024 * 1024
+
+# Extension of cache files
+CACHE_EXTENSION = ".json"
+
+# Number and size of samples of file which are hashed for the fingerprint
+SAMPLE_COUNT = 16
+SAMPLE_BYTES = 64 * 1024
+
+# Logger
+logger = logging.getLogger( MODULE_NAME )
+
+#########################################
+#  Fingerprint functions
+#########################################
+
+def file_fingerprint ( file_in ) :
+    """Function to get path, size, modification time and hash of samples spread over file"""
+    status = os.stat( file_in )
+    size   = int(status.st_size)
+    sample_hash = hashlib.md5()
+    fIn = open( file_in, 'rb' )
+    try :
+        for k in range(SAMPLE_COUNT) :
+            fIn.seek( max( size - SAMPLE_BYTES, 0 ) * k / max( SAMPLE_COUNT - 1, 1 ) )
+            sample_hash.update( fIn.read( SAMPLE_BYTES ) )
+    finally :
+        fIn.close()
+    return { 'path'  : os.path.abspath( file_in ),
+             'size'  : size,
+             'mtime' : status.st_mtime,
+             'hash'  : sample_hash.hexdigest() }
+
+#########################################
+#  Cache class
+#########################################
+
+class StatisticsCache:
+    """Directory with one file of statistics per input file and read parameters; least recently used files are evicted"""
+
+    def __init__ ( self, cache_dir = CACHE_DIR, max_bytes = CACHE_MAX_BYTES ) :
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_bytes)
+
+    def cache_file ( self, fingerprint, parameters ) :
+        """Function to get name of cache file for fingerprint and read parameters"""
+        key = hashlib.md5( json.dumps( [ fingerprint, parameters ], sort_keys = True ) ).hexdigest()
+        return os.path.join( self.cache_dir, key + CACHE_EXTENSION )
+
+    def get ( self, file_in, parameters ) :
+        """Function to get cached statistics of file; returns None when file is not in cache or has changed"""
+        cache_file = self.cache_file( file_fingerprint( file_in ), parameters )
+        if not os.path.exists( cache_file ) :
+            return None
+        try :
+            fIn = open( cache_file, 'r' )
+            try :
+                statistics = json.load( fIn )
+            finally :
+                fIn.close()
+            # Last access time for eviction is kept in modification time of cache file
+            os.utime( cache_file, None )
+        except Exception, err:
+            logger.warning( "Reading cache file " + str(cache_file) + " failed: ERROR: " + str(err) )
+            return None
+        logger.info( "Statistics of " + str(file_in) + " found in cache" )
+        return statistics
+
+    def put ( self, file_in, parameters, statistics ) :
+        """Function to store statistics of file in cache"""
+        if not os.path.isdir( self.cache_dir ) :
+            os.makedirs( self.cache_dir )
+        cache_file = self.cache_file( file_fingerprint( file_in ), parameters )
+        temp_file  = cache_file + '.tmp'
+        fOut = open( temp_file, 'w' )
+        try :
+            json.dump( statistics, fOut )
+        finally :
+            fOut.close()
+        # On Windows rename does not overwrite existing files
+        if os.name == 'nt' and os.path.exists( cache_file ) :
+            os.remove( cache_file )
+        os.rename( temp_file, cache_file )
+        self.evict()
+
+    def evict ( self ) :
+        """Function to remove least recently used cache files until cache fits in maximum size"""
+        entries = []
+        for name in os.listdir( self.cache_dir ) :
+            if name.endswith( CACHE_EXTENSION ) :
+                status = os.stat( os.path.join( self.cache_dir, name ) )
+                entries.append( ( status.st_mtime, status.st_size, name ) )
+        entries.sort()
+        total_bytes = sum( [ size for mtime, size, name in entries ] )
+        while entries and total_bytes > self.max_bytes :
+            mtime, size, name = entries.pop(0)
+            os.remove( os.path.join( self.cache_dir, name ) )
+            total_bytes = total_bytes - size
+            logger.debug( "Cache file " + name + " evicted" )
+
+    def clear ( self ) :
+        """Function to remove all cache files"""
+        if os.path.isdir( self.cache_dir ) :
+            for name in os.listdir( self.cache_dir ) :
+                if name.endswith( CACHE_EXTENSION ) :
+                    os.remove( os.path.join( self.cache_dir, name ) )
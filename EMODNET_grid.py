@@ -0,0 +1,507 @@
+#! /usr/bin/python
+
+""" Functions to read EMODNET grid and XYZ files into column arrays
+"""
+
+# Standard library imports
+import os
+import mmap
+import logging
+import multiprocessing
+
+# Related third party imports
+import numpy
+
+# Module name
+MODULE_NAME = "EMODNET grid"
+
+# Defines for EMODNET grid files
+EMODNET_SEPARATOR   = ";"
+EMODNET_NR_COLUMNS  = 12
+EMODNET_XYZ_COLUMNS = ( 0, 1, 4 ) # x, y and average depth
+
+# Defines for XYZ files
+XYZ_COLUMNS = ( 0, 1, 2 )
+
+# Number of bytes read from file per chunk (chunks are cut at line boundaries)
+CHUNK_BYTES = 4 * 1024 * 1024
+
+# Byte values
+NEWLINE = ord("\n")
+
+# Characters allowed in numbers (zero is padding of fixed width strings)
+NUMBER_CHARACTERS = numpy.zeros( 256, bool )
+NUMBER_CHARACTERS[ [ ord(c) for c in "0123456789+-.eE \t\0" ] ] = True
+DIGITS = numpy.zeros( 256, bool )
+DIGITS[ [ ord(c) for c in "0123456789" ] ] = True
+
+# Reasons for rejecting lines
+REJECT_FIELDS = "too few fields"
+REJECT_NUMBER = "no number in column "
+
+# Number of ranges per process when file is reduced in parallel (more ranges give better load balance)
+RANGES_PER_PROCESS = 4
+
+# Keys of extent of grid file
+EXTENT_MINX     = "minx"
+EXTENT_MAXX     = "maxx"
+EXTENT_MINY     = "miny"
+EXTENT_MAXY     = "maxy"
+EXTENT_MINZ     = "minz"
+EXTENT_MAXZ     = "maxz"
+EXTENT_POINTS   = "nrofpoints"
+EXTENT_REJECTED = "nrofrejected"
+EXTENT_COLUMNS  = "columns"     # per column [ min, max ], None without values or TEXT_COLUMN
+EXTENT_NR_COLS  = "nrofcolumns"
+TEXT_COLUMN     = "text"
+
+# Buffer size of quarantine file
+QUARANTINE_BUFFER = 1024 * 1024
+
+# Logger
+logger = logging.getLogger( MODULE_NAME )
+
+#########################################
+#  Chunk class
+#########################################
+
+class GridChunk:
+    """Column arrays of a block of lines of a grid file"""
+
+    def __init__ ( self, xyz, values, starts, ends, line_numbers, rejected, nr_lines, start_offset, end_offset ) :
+        self.x            = xyz[0]       # float64 array with x coordinates
+        self.y            = xyz[1]       # float64 array with y coordinates
+        self.z            = xyz[2]       # float64 array with depths
+        self.values       = values       # bytes of block with separators and newlines set to zero
+        self.starts       = starts       # start of each field in values (rows x columns)
+        self.ends         = ends         # end of each field in values (rows x columns)
+        self.line_numbers = line_numbers # line number in file (1-based) of each row
+        self.rejected     = rejected     # list of ( line number, reason, line ) tuples
+        self.nr_lines     = nr_lines     # number of lines in chunk (rows and rejected lines)
+        self.start_offset = start_offset # byte offset of first line in file
+        self.end_offset   = end_offset   # byte offset directly after last line in file
+        self.fields       = {}
+
+    def __len__ ( self ) :
+        return len(self.line_numbers)
+
+    def field ( self, column ) :
+        """Function to get column as fixed width string array"""
+        if column not in self.fields :
+            self.fields[ column ] = extract_column( self.values, self.starts[:, column], self.ends[:, column] )
+        return self.fields[ column ]
+
+    def column_as_float ( self, column, missing_value ) :
+        """Function to convert string column to float64 array; empty values get missing value"""
+        values = self.field( column )
+        empty  = values == ""
+        values = numpy.where( empty, "nan", values ).astype(numpy.float64)
+        values[ empty ] = missing_value
+        return values
+
+#########################################
+#  Parse functions
+#########################################
+
+def gather_fields ( values, starts, ends ) :
+    """Function to gather byte ranges of buffer into byte matrix padded with zeros"""
+
+    # Separators are zero bytes, so reading up to the end of the field pads with zeros
+    width = 1
+    if len(starts) > 0 :
+        width = max( int( ( ends - starts ).max() ), 1 )
+    index  = starts[:, None] + numpy.arange( width, dtype = starts.dtype )
+    index  = numpy.minimum( index, ends[:, None], out = index )
+    return values.take( index )
+
+def extract_column ( values, starts, ends ) :
+    """Function to gather byte ranges of buffer into fixed width string array"""
+    matrix = gather_fields( values, starts, ends )
+    return matrix.view( "S" + str(matrix.shape[1]) ).ravel()
+
+def find_bad_numbers ( matrix ) :
+    """Function to find fields of byte matrix which are not a number, for all rows at once"""
+    bad = ~NUMBER_CHARACTERS[ matrix ].all( axis = 1 )
+    bad = numpy.logical_or( bad, ~DIGITS[ matrix ].any( axis = 1 ), out = bad )
+    return bad
+
+def find_bad_floats ( column ) :
+    """Function to find values in string column which can not be converted to float"""
+    bad = numpy.zeros( len(column), bool )
+    for i in range(len(column)) :
+        try :
+            float(column[i])
+        except ValueError :
+            bad[i] = True
+    return bad
+
+def convert_column ( matrix ) :
+    """Function to convert byte matrix to float64 array; returns array and mask of fields which are not a finite number"""
+    column = matrix.view( "S" + str(matrix.shape[1]) ).ravel()
+    try :
+        values = column.astype(numpy.float64)
+        return values, ~numpy.isfinite( values )
+    except ValueError :
+        pass
+    # Reject fields with characters which do not belong in numbers in bulk
+    bad = find_bad_numbers( matrix )
+    try :
+        values = numpy.where( bad, "nan", column ).astype(numpy.float64)
+    except ValueError :
+        # Fields with only number characters which are still malformed (like 1.2.3) are checked one by one
+        remaining = numpy.flatnonzero( ~bad )
+        bad[ remaining[ find_bad_floats( column[ remaining ] ) ] ] = True
+        values = numpy.where( bad, "nan", column ).astype(numpy.float64)
+    return values, bad | ~numpy.isfinite( values )
+
+def find_field_boundaries ( newlines, delimiters, nr_columns ) :
+    """Function to find start and end of the fields of each line; lines with too few fields are rejected"""
+    nr_lines = len(newlines)
+
+    # Fast path: every line has exactly the expected number of fields
+    if len(delimiters) == nr_lines * nr_columns :
+        ends = delimiters
+        if numpy.array_equal( ends[ nr_columns - 1::nr_columns ], newlines ) :
+            starts     = numpy.empty_like(ends)
+            starts[0]  = 0
+            starts[1:] = ends[:-1] + 1
+            return starts.reshape( nr_lines, nr_columns ), ends.reshape( nr_lines, nr_columns ), numpy.arange( nr_lines )
+
+    # General path: per line the first nr_columns fields are used
+    nr_fields       = numpy.bincount( numpy.searchsorted( newlines, delimiters ), minlength = nr_lines )
+    first_delimiter = numpy.cumsum( nr_fields ) - nr_fields
+    valid           = numpy.flatnonzero( nr_fields >= nr_columns )
+    ends            = delimiters[ first_delimiter[ valid ][:, None] + numpy.arange( nr_columns ) ]
+    starts          = numpy.empty_like(ends)
+    starts[:, 0]    = numpy.concatenate( ( [0], newlines[:-1] + 1 ) )[ valid ]
+    starts[:, 1:]   = ends[:, :-1] + 1
+    return starts, ends, valid
+
+def parse_grid_block ( block, nr_columns, separator, xyz_columns, first_line, start_offset ) :
+    """Function to split block of complete lines into column arrays"""
+
+    # Block must end with newline
+    end_offset = start_offset + len(block)
+    if len(block) > 0 and not block.endswith("\n") :
+        block = block + "\n"
+    if block.find("\r") >= 0 :
+        block = block.replace("\r", "")
+    data = numpy.frombuffer( block, numpy.uint8 )
+
+    # Find line ends and separators and split lines into fields
+    is_newline   = data == NEWLINE
+    is_delimiter = data == ord(separator)
+    is_delimiter = numpy.logical_or( is_delimiter, is_newline, out = is_delimiter )
+    newlines     = numpy.flatnonzero( is_newline )
+    delimiters   = numpy.flatnonzero( is_delimiter )
+    nr_lines     = len(newlines)
+    starts, ends, valid = find_field_boundaries( newlines, delimiters, nr_columns )
+    values = data.copy()
+    values[ delimiters ] = 0
+
+    # Convert x, y and z; reject rows of which x, y or z is not a number
+    reasons = {}
+    bad     = numpy.zeros( len(valid), bool )
+    xyz     = []
+    for k in xyz_columns :
+        column, bad_k = convert_column( gather_fields( values, starts[:, k], ends[:, k] ) )
+        xyz.append( column )
+        if bad_k.any() :
+            for line in valid[ bad_k & ~bad ] :
+                reasons[ int(line) ] = REJECT_NUMBER + str(k + 1)
+            bad = bad | bad_k
+    if bad.any() :
+        starts = starts[ ~bad ]
+        ends   = ends[ ~bad ]
+        valid  = valid[ ~bad ]
+        xyz    = [ column[ ~bad ] for column in xyz ]
+
+    # Administration of rejected lines
+    rejected = []
+    if len(valid) < nr_lines :
+        line_start = numpy.concatenate( ( [0], newlines[:-1] + 1 ) )
+        for line in numpy.setdiff1d( numpy.arange(nr_lines), valid ) :
+            rejected.append( ( first_line + int(line), reasons.get( int(line), REJECT_FIELDS ), block[ line_start[line]:newlines[line] ] ) )
+
+    return GridChunk( xyz, values, starts, ends, valid + first_line, rejected, nr_lines, start_offset, end_offset )
+
+#########################################
+#  Quarantine class
+#########################################
+
+class Quarantine:
+    """Buffered file with rejected lines; each line has line number, reason and original line"""
+
+    def __init__ ( self, quarantine_file, append = False, separator = ";" ) :
+        self.quarantine_file = quarantine_file
+        self.separator       = separator
+        self.nr_rejected     = 0
+        self.reasons         = {}   # number of rejected lines per reason
+        self.fOut            = None
+        if quarantine_file :
+            if append and os.path.exists( quarantine_file ) :
+                self.fOut = open( quarantine_file, 'a', QUARANTINE_BUFFER )
+            else :
+                self.fOut = open( quarantine_file, 'w', QUARANTINE_BUFFER )
+                self.fOut.write( "line" + separator + "reason" + separator + "text\n" )
+
+    def discard ( self, line_ranges ) :
+        """Function to remove lines within ranges ( first line, end line or None ) from quarantine file, so lines read again are not duplicated"""
+        if not self.quarantine_file or not os.path.exists( self.quarantine_file ) :
+            return
+        if self.fOut :
+            self.fOut.close()
+        fIn = open( self.quarantine_file, 'r' )
+        try :
+            lines = fIn.readlines()
+        finally :
+            fIn.close()
+        kept = lines[:1]
+        for line in lines[1:] :
+            line_number = int( line.split( self.separator, 1 )[0] )
+            inside = False
+            for first_line, end_line in line_ranges :
+                if line_number >= first_line and ( end_line is None or line_number < end_line ) :
+                    inside = True
+                    break
+            if not inside :
+                kept.append( line )
+        self.fOut = open( self.quarantine_file, 'w', QUARANTINE_BUFFER )
+        self.fOut.write( "".join( kept ) )
+        logger.info( str(len(lines) - len(kept)) + " lines to read again removed from quarantine file" )
+
+    def write ( self, rejected ) :
+        """Function to write rejected lines of chunk; returns number of rejected lines per reason"""
+        reasons = {}
+        for line_number, reason, line in rejected :
+            reasons[ reason ] = reasons.get( reason, 0 ) + 1
+            self.reasons[ reason ] = self.reasons.get( reason, 0 ) + 1
+        self.nr_rejected = self.nr_rejected + len(rejected)
+        if self.fOut and rejected :
+            self.fOut.write( "".join( [ str(line_number) + self.separator + reason + self.separator + line + "\n" for line_number, reason, line in rejected ] ) )
+        return reasons
+
+    def flush ( self ) :
+        """Function to flush quarantine file"""
+        if self.fOut :
+            self.fOut.flush()
+
+    def close ( self ) :
+        """Function to flush and close quarantine file"""
+        if self.fOut :
+            self.fOut.close()
+            self.fOut = None
+
+#########################################
+#  Mapped file class
+#########################################
+
+class MappedFile:
+    """Sequential reader of file through memory mapped windows, so also large files fit in address space"""
+
+    def __init__ ( self, file_in ) :
+        self.fIn      = open( file_in, 'rb' )
+        self.size     = os.fstat( self.fIn.fileno() ).st_size
+        self.position = 0
+
+    def seek ( self, offset ) :
+        self.position = int(offset)
+
+    def read ( self, size ) :
+        """Function to read bytes at current position through memory map of window"""
+        size = min( int(size), self.size - self.position )
+        if size <= 0 :
+            return ""
+        # Offset of map must be multiple of allocation granularity
+        start = self.position - self.position % mmap.ALLOCATIONGRANULARITY
+        mm = mmap.mmap( self.fIn.fileno(), self.position + size - start, access = mmap.ACCESS_READ, offset = start )
+        try :
+            data = mm[ self.position - start: ]
+        finally :
+            mm.close()
+        self.position = self.position + size
+        return data
+
+    def find ( self, sub, offset, size ) :
+        """Function to find first position of string after offset within size bytes; returns -1 if not found"""
+        self.seek( offset )
+        position = self.read( size ).find( sub )
+        if position < 0 :
+            return -1
+        return offset + position
+
+    def close ( self ) :
+        self.fIn.close()
+
+#########################################
+#  Read functions
+#########################################
+
+def read_grid_chunks ( file_in, nr_columns, separator, xyz_columns = XYZ_COLUMNS, chunk_bytes = CHUNK_BYTES, start_offset = 0, end_offset = None, first_line = 1, use_mmap = False ) :
+    """Generator to read grid file in chunks of column arrays; optionally only the lines between two byte offsets"""
+    logger.debug( "Read grid file " + str(file_in) + " in chunks of " + str(chunk_bytes) + " bytes from offset " + str(start_offset) )
+    if len(separator) <> 1 :
+        raise ValueError( "Separator must be a single character: '" + str(separator) + "'" )
+    offset     = int(start_offset)
+    remainder  = ""
+    if use_mmap :
+        fIn = MappedFile( file_in )
+    else :
+        fIn = open( file_in, 'rb' )
+    try :
+        fIn.seek( offset )
+        while True :
+            # Do not read beyond end offset
+            size = int(chunk_bytes)
+            if end_offset is not None :
+                size = min( size, int(end_offset) - offset - len(remainder) )
+                if size <= 0 :
+                    break
+            data = fIn.read( size )
+            if not data :
+                break
+            # Cut chunk at last newline and keep remainder for next chunk
+            block = remainder + data
+            last  = block.rfind("\n")
+            if last < 0 :
+                remainder = block
+                continue
+            remainder = block[ last + 1: ]
+            chunk = parse_grid_block( block[ :last + 1 ], nr_columns, separator, xyz_columns, first_line, offset )
+            first_line = first_line + chunk.nr_lines
+            offset     = chunk.end_offset
+            yield chunk
+        # Last line without newline
+        if len(remainder) > 0 :
+            yield parse_grid_block( remainder, nr_columns, separator, xyz_columns, first_line, offset )
+    finally :
+        fIn.close()
+
+def split_file_ranges ( file_in, nr_ranges ) :
+    """Function to split file in byte ranges ( start offset, end offset ) of about equal size on line boundaries"""
+    fIn = MappedFile( file_in )
+    try :
+        size       = fIn.size
+        boundaries = [ 0 ]
+        for k in range( 1, int(nr_ranges) ) :
+            offset = max( size * k / int(nr_ranges), boundaries[-1] )
+            # Search newline in growing windows, long lines are rare
+            window   = 65536
+            position = -1
+            while position < 0 and offset < size :
+                position = fIn.find( "\n", offset, window )
+                if position < 0 :
+                    offset = offset + window
+                    window = window * 2
+            if position < 0 :
+                break
+            if position + 1 > boundaries[-1] and position + 1 < size :
+                boundaries.append( position + 1 )
+        boundaries.append( size )
+    finally :
+        fIn.close()
+    return [ ( boundaries[k], boundaries[k + 1] ) for k in range(len(boundaries) - 1) if boundaries[k + 1] > boundaries[k] ]
+
+#########################################
+#  Extent functions
+#########################################
+
+def merge_column_extents ( column_extent, other ) :
+    """Function to merge [ min, max ] of column of other part of file into column extent"""
+    if column_extent == TEXT_COLUMN or other == TEXT_COLUMN :
+        return TEXT_COLUMN
+    if column_extent is None :
+        return other
+    if other is None :
+        return column_extent
+    return [ min( column_extent[0], other[0] ), max( column_extent[1], other[1] ) ]
+
+def merge_extents ( extent, other ) :
+    """Function to merge extent of other part of file into extent"""
+    if other[ EXTENT_POINTS ] > 0 :
+        if extent[ EXTENT_POINTS ] == 0 :
+            for key in ( EXTENT_MINX, EXTENT_MAXX, EXTENT_MINY, EXTENT_MAXY, EXTENT_MINZ, EXTENT_MAXZ ) :
+                extent[ key ] = other[ key ]
+        else :
+            for key in ( EXTENT_MINX, EXTENT_MINY, EXTENT_MINZ ) :
+                extent[ key ] = min( extent[ key ], other[ key ] )
+            for key in ( EXTENT_MAXX, EXTENT_MAXY, EXTENT_MAXZ ) :
+                extent[ key ] = max( extent[ key ], other[ key ] )
+    extent[ EXTENT_POINTS ]   = extent[ EXTENT_POINTS ]   + other[ EXTENT_POINTS ]
+    extent[ EXTENT_REJECTED ] = extent[ EXTENT_REJECTED ] + other[ EXTENT_REJECTED ]
+    extent[ EXTENT_COLUMNS ]  = map( merge_column_extents, extent[ EXTENT_COLUMNS ], other[ EXTENT_COLUMNS ] )
+    return extent
+
+def empty_extent ( nr_columns ) :
+    """Function to get extent of file without points"""
+    return { EXTENT_POINTS : 0, EXTENT_REJECTED : 0, EXTENT_NR_COLS : int(nr_columns), EXTENT_COLUMNS : [ None ] * int(nr_columns) }
+
+def reduce_grid_range ( args ) :
+    """Function to get extent of byte range of grid file; runs in worker process of pool"""
+    file_in, nr_columns, separator, xyz_columns, start_offset, end_offset = args
+    extent = empty_extent( nr_columns )
+    for chunk in read_grid_chunks ( file_in, nr_columns, separator, xyz_columns, start_offset = start_offset, end_offset = end_offset, use_mmap = True ) :
+        chunk_extent = empty_extent( nr_columns )
+        chunk_extent[ EXTENT_POINTS ]   = len(chunk)
+        chunk_extent[ EXTENT_REJECTED ] = len(chunk.rejected)
+        if len(chunk) > 0 :
+            chunk_extent[ EXTENT_MINX ] = float(chunk.x.min())
+            chunk_extent[ EXTENT_MAXX ] = float(chunk.x.max())
+            chunk_extent[ EXTENT_MINY ] = float(chunk.y.min())
+            chunk_extent[ EXTENT_MAXY ] = float(chunk.y.max())
+            chunk_extent[ EXTENT_MINZ ] = float(chunk.z.min())
+            chunk_extent[ EXTENT_MAXZ ] = float(chunk.z.max())
+
+            # Minimum and maximum of other columns; empty values are ignored and columns with text are not numeric
+            for k in range(int(nr_columns)) :
+                if extent[ EXTENT_COLUMNS ][k] == TEXT_COLUMN :
+                    continue
+                if k in xyz_columns :
+                    values = ( chunk.x, chunk.y, chunk.z )[ list(xyz_columns).index(k) ]
+                else :
+                    try :
+                        values = chunk.column_as_float( k, numpy.nan )
+                    except ValueError :
+                        chunk_extent[ EXTENT_COLUMNS ][k] = TEXT_COLUMN
+                        continue
+                    values = values[ ~numpy.isnan( values ) ]
+                if len(values) > 0 :
+                    chunk_extent[ EXTENT_COLUMNS ][k] = [ float(values.min()), float(values.max()) ]
+        merge_extents( extent, chunk_extent )
+    return extent
+
+def get_grid_extent ( file_in, nr_columns, separator, xyz_columns = XYZ_COLUMNS, nr_processes = None, cache = None ) :
+    """Function to get extent, number of points and per column minimum and maximum of grid file; ranges of the file are reduced by a pool of processes"""
+
+    # Statistics of file which did not change since the last scan are taken from cache
+    parameters = [ int(nr_columns), separator, list(xyz_columns) ]
+    if cache is not None :
+        extent = cache.get( file_in, parameters )
+        if extent is not None :
+            return extent
+
+    if nr_processes is None :
+        nr_processes = multiprocessing.cpu_count()
+    size = os.path.getsize( file_in )
+    if int(nr_processes) > 1 and size > CHUNK_BYTES :
+        ranges = split_file_ranges( file_in, int(nr_processes) * RANGES_PER_PROCESS )
+    else :
+        ranges = [ ( 0, size ) ]
+    logger.info( "Get extent of " + str(file_in) + " in " + str(len(ranges)) + " ranges with " + str(nr_processes) + " processes" )
+    args = [ ( file_in, nr_columns, separator, xyz_columns, start_offset, end_offset ) for start_offset, end_offset in ranges ]
+    if len(args) > 1 :
+        pool = multiprocessing.Pool( int(nr_processes) )
+        try :
+            partial_extents = pool.map( reduce_grid_range, args )
+        finally :
+            pool.close()
+            pool.join()
+    else :
+        partial_extents = map( reduce_grid_range, args )
+    extent = empty_extent( nr_columns )
+    for partial_extent in partial_extents :
+        merge_extents( extent, partial_extent )
+
+    if cache is not None :
+        cache.put( file_in, parameters, extent )
+    return extent
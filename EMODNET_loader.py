@@ -0,0 +1,525 @@
+#! /usr/bin/python
+
+""" Pipelined loader of EMODNET grid and XYZ files into sdb_im_import_temp
+"""
+
+# Standard library imports
+import os
+import re
+import sys
+import time
+import json
+import uuid
+import Queue
+import logging
+import tempfile
+import threading
+
+# Local imports
+from EMODNET_grid import Quarantine, read_grid_chunks, XYZ_COLUMNS, EMODNET_XYZ_COLUMNS, EMODNET_NR_COLUMNS, EMODNET_SEPARATOR
+
+# Module name
+MODULE_NAME = "EMODNET loader"
+
+# Table to load points into; points of loads with a checkpoint get the load id of the checkpoint in column load_id
+IMPORT_TABLE = "sdb_im_import_temp"
+
+# Default pipeline settings
+NR_WRITERS = 4      # number of writer threads, each with its own connection
+QUEUE_SIZE = 4      # number of batches parsed ahead of the writers
+BATCH_SIZE = 100000 # number of points per executemany
+
+# Commit modes
+COMMIT_PER_BATCH = "batch" # every writer commits after each batch
+COMMIT_AT_END    = "end"   # every writer commits once when the queue is drained
+COMMIT_NONE      = "none"  # caller commits; only for a single writer on the callers connection
+COMMIT_MODES     = [ COMMIT_PER_BATCH, COMMIT_AT_END, COMMIT_NONE ]
+
+# Extension of checkpoint file next to import file
+CHECKPOINT_EXTENSION = ".checkpoint"
+
+# Table with a progress row per committed batch; the row is inserted in the transaction of the batch
+# Columns: load_id, start_offset, end_offset, first_line, next_line, nr_rows, nr_skipped
+PROGRESS_TABLE   = "sdb_im_import_progress"
+PROGRESS_COLUMNS = [ 'load_id', 'start_offset', 'end_offset', 'first_line', 'next_line', 'nr_rows', 'nr_skipped' ]
+
+# Marker put on queue to stop writers
+END_OF_QUEUE = None
+
+# Logger
+logger = logging.getLogger( MODULE_NAME )
+
+#########################################
+#  Batch functions
+#########################################
+
+def grid_insert_columns ( nr_columns ) :
+    """Function to get x, y, z and string columns of file to insert (3 or 12 columns)"""
+    # For EMODNET grids (12 columns) z is the average depth and min and max depth are swapped
+    if int(nr_columns) == int(EMODNET_NR_COLUMNS) :
+        return EMODNET_XYZ_COLUMNS, [ 3, 2, 5, 6, 7, 8, 9, 10, 11 ]
+    else :
+        return XYZ_COLUMNS, range( 3, int(nr_columns) )
+
+def progress_insert_statement ( table = PROGRESS_TABLE ) :
+    """Function to build insert statement of progress row of committed batch"""
+    return 'insert into ' + str(table) + ' ( ' + ', '.join(PROGRESS_COLUMNS) + ' ) values ( ' + ', '.join( [ ':' + str(k + 1) for k in range(len(PROGRESS_COLUMNS)) ] ) + ' )'
+
+def grid_insert_statement ( nr_columns, table = IMPORT_TABLE, load_id = None ) :
+    """Function to build insert statement for file with given number of columns; with load id every point gets it in column load_id"""
+    xyz_columns, string_columns = grid_insert_columns ( nr_columns )
+    insert_columns = [ 'x', 'y', 'z' ] + [ 'customattribute' + str(k) for k in range(len(string_columns)) ]
+    insert_values  = [ ':' + str(k + 1) for k in range(len(insert_columns)) ]
+    if load_id is not None :
+        # Load id is the same for all rows of the batch, so it is a literal; it is read from the checkpoint file and must be hex
+        if not re.match( r"^[0-9a-f]+$", str(load_id) ) :
+            raise ValueError( "Load id " + str(load_id) + " is not hexadecimal" )
+        insert_columns = insert_columns + [ 'load_id' ]
+        insert_values  = insert_values + [ "'" + str(load_id) + "'" ]
+    insert_stmt = 'insert into ' + str(table) + ' ( ' + ', '.join(insert_columns) + ' ) '
+    insert_stmt = insert_stmt + ' values ( ' + ', '.join(insert_values) + ' )'
+    return insert_stmt
+
+def read_grid_batches ( import_file, nr_columns, separator, batch_size = BATCH_SIZE, quarantine_file = None, ranges = None ) :
+    """Generator to read file or byte ranges ( start offset, end offset, first line, end line ) of file in batches of whole chunks"""
+    xyz_columns, string_columns = grid_insert_columns ( nr_columns )
+    resume = ranges is not None
+    if ranges is None :
+        ranges = [ ( 0, None, 1, None ) ]
+    # Checkpoint of complete load has no pending ranges; there is nothing to read and the quarantine is kept as is
+    if not ranges :
+        logger.info( "All lines of " + str(import_file) + " are committed; nothing to read" )
+        return
+    # When only ranges of the file are read, lines skipped before are kept; lines of ranges read again are removed
+    quarantine = Quarantine ( quarantine_file, resume )
+    if resume :
+        quarantine.discard( [ ( first_line, end_line ) for start_offset, end_offset, first_line, end_line in ranges ] )
+    try :
+        for start_offset, end_offset, first_line, end_line in ranges :
+            batch = None
+            for chunk in read_grid_chunks ( import_file, int(nr_columns), separator, xyz_columns, start_offset = start_offset, end_offset = end_offset, first_line = first_line ) :
+                if batch is None :
+                    batch = GridBatch ( len(string_columns), chunk.start_offset, first_line )
+
+                # Write lines which could not be parsed to quarantine file
+                batch.add_rejected( quarantine.write( chunk.rejected ) )
+                batch.add_chunk( chunk, string_columns )
+
+                # Hand over batch when it is full; batches always end at a line boundary
+                # Rejected lines are flushed first, so they are on disk when the batch is committed
+                if len(batch.rows) >= int(batch_size) :
+                    batch.report()
+                    quarantine.flush()
+                    yield batch
+                    first_line = batch.next_line
+                    batch = None
+
+            # Last (partial) batch of range
+            if batch is not None and batch.nr_lines > 0 :
+                batch.report()
+                quarantine.flush()
+                yield batch
+        logger.info( str(quarantine.nr_rejected) + " points skipped" )
+        for reason in sorted(quarantine.reasons) :
+            logger.info( "   " + str(quarantine.reasons[ reason ]) + " x " + reason )
+    finally :
+        quarantine.close()
+
+#########################################
+#  Batch class
+#########################################
+
+class GridBatch:
+    """Rows to insert of one or more consecutive chunks of file"""
+
+    def __init__ ( self, nr_string_columns, start_offset, first_line ) :
+        self.rows         = []                        # tuples of x, y, z and string columns
+        self.string_sizes = [ 1 ] * nr_string_columns # maximum width of string columns
+        self.start_offset = start_offset              # byte offset of first line in file
+        self.end_offset   = start_offset              # byte offset directly after last line in file
+        self.first_line   = first_line                # line number of first line
+        self.next_line    = first_line                # line number directly after last line
+        self.nr_lines     = 0                         # number of lines in batch
+        self.nr_skipped   = 0                         # number of rejected lines in batch
+        self.reasons      = {}                        # number of rejected lines per reason
+
+    def add_chunk ( self, chunk, string_columns ) :
+        """Function to add rows of chunk to batch"""
+        # Column arrays are bound as rows; floats for x, y and z and fixed width strings for the other columns
+        columns = [ chunk.x.tolist(), chunk.y.tolist(), chunk.z.tolist() ]
+        for k in range(len(string_columns)) :
+            field = chunk.field( string_columns[k] )
+            self.string_sizes[k] = max( self.string_sizes[k], field.dtype.itemsize )
+            columns.append( field.tolist() )
+        self.rows.extend( zip( *columns ) )
+        self.end_offset = chunk.end_offset
+        self.nr_lines   = self.nr_lines + chunk.nr_lines
+        self.next_line  = self.first_line + self.nr_lines
+
+    def add_rejected ( self, reasons ) :
+        """Function to add number of rejected lines per reason to batch"""
+        for reason in reasons :
+            self.reasons[ reason ] = self.reasons.get( reason, 0 ) + reasons[ reason ]
+            self.nr_skipped = self.nr_skipped + reasons[ reason ]
+
+    def report ( self ) :
+        """Function to log number of points and rejected lines of batch"""
+        msg = "Batch lines " + str(self.first_line) + " - " + str(self.next_line - 1) + ": " + str(len(self.rows)) + " points, " + str(self.nr_skipped) + " rejected"
+        if self.nr_skipped > 0 :
+            msg = msg + " (" + ", ".join( [ str(self.reasons[ reason ]) + " x " + reason for reason in sorted(self.reasons) ] ) + ")"
+        logger.info( msg )
+
+#########################################
+#  Checkpoint class
+#########################################
+
+class Checkpoint:
+    """Sidecar file with byte offset, line, row and skipped counts of committed batches of import file"""
+
+    def __init__ ( self, import_file, checkpoint_file = None ) :
+        self.import_file     = import_file
+        self.checkpoint_file = checkpoint_file
+        if not self.checkpoint_file :
+            self.checkpoint_file = str(import_file) + CHECKPOINT_EXTENSION
+        self.lock = threading.Lock()
+        self.discarded_load_id = None # load id of outdated checkpoint discarded by read with restart
+        self.reset()
+
+    def reset ( self ) :
+        """Function to start checkpoint at begin of file"""
+        self.load_id   = uuid.uuid4().hex # identifies progress rows of this load in database
+        self.offset    = 0     # all lines before this byte offset are committed
+        self.line      = 1     # line number at offset
+        self.rows      = 0     # number of committed rows before offset
+        self.skipped   = 0     # number of skipped lines before offset
+        self.committed = []    # committed batches after offset: [ start, end, first line, next line, rows, skipped ]
+        self.complete  = False # True when whole file is committed
+
+    def fingerprint ( self ) :
+        """Function to get size and modification time of import file"""
+        status = os.stat( self.import_file )
+        return [ int(status.st_size), int(status.st_mtime) ]
+
+    def read ( self, restart = False ) :
+        """Function to read checkpoint file; returns False when there is no checkpoint or an outdated checkpoint is discarded with restart"""
+        if not os.path.exists( self.checkpoint_file ) :
+            return False
+        fIn = open( self.checkpoint_file, 'r' )
+        try :
+            state = json.load( fIn )
+        finally :
+            fIn.close()
+        if state[ 'file' ] <> os.path.abspath( self.import_file ) or state[ 'fingerprint' ] <> self.fingerprint() :
+            if not restart :
+                raise ValueError( "Checkpoint " + str(self.checkpoint_file) + " does not belong to " + str(self.import_file) + " or file has changed; restart the import to discard it" )
+            # Outdated checkpoint is discarded and load starts at begin of file
+            logger.warning( "Checkpoint " + str(self.checkpoint_file) + " is outdated and discarded; import restarts at begin of file" )
+            self.discarded_load_id = state.get( 'load_id' )
+            self.remove()
+            self.reset()
+            return False
+        self.load_id   = str(state[ 'load_id' ])
+        self.offset    = int(state[ 'offset' ])
+        self.line      = int(state[ 'line' ])
+        self.rows      = int(state[ 'rows' ])
+        self.skipped   = int(state[ 'skipped' ])
+        self.committed = state[ 'committed' ]
+        self.complete  = bool(state[ 'complete' ])
+        return True
+
+    def write ( self ) :
+        """Function to write checkpoint file; file is replaced only when completely written"""
+        state = { 'file'        : os.path.abspath( self.import_file ),
+                  'load_id'     : self.load_id,
+                  'fingerprint' : self.fingerprint(),
+                  'offset'      : self.offset,
+                  'line'        : self.line,
+                  'rows'        : self.rows,
+                  'skipped'     : self.skipped,
+                  'committed'   : self.committed,
+                  'complete'    : self.complete }
+        temp_file = self.checkpoint_file + '.tmp'
+        fOut = open( temp_file, 'w' )
+        try :
+            json.dump( state, fOut )
+            fOut.flush()
+            os.fsync( fOut.fileno() )
+        finally :
+            fOut.close()
+        # On Windows rename does not overwrite existing files
+        if os.name == 'nt' and os.path.exists( self.checkpoint_file ) :
+            os.remove( self.checkpoint_file )
+        os.rename( temp_file, self.checkpoint_file )
+
+    def remove ( self ) :
+        """Function to remove checkpoint file"""
+        if os.path.exists( self.checkpoint_file ) :
+            os.remove( self.checkpoint_file )
+
+    def progress_row ( self, batch ) :
+        """Function to get progress row of batch to insert in transaction of batch"""
+        return ( self.load_id, batch.start_offset, batch.end_offset, batch.first_line, batch.next_line, len(batch.rows), batch.nr_skipped )
+
+    def register ( self, start, end, first_line, next_line, rows, skipped ) :
+        """Function to add committed range to checkpoint; ranges already registered are ignored"""
+        if end <= self.offset or [ start, end, first_line, next_line, rows, skipped ] in self.committed :
+            return
+        self.committed.append( [ start, end, first_line, next_line, rows, skipped ] )
+        self.committed.sort()
+        # Move offset over batches directly following it
+        while self.committed and self.committed[0][0] == self.offset :
+            start, end, first_line, next_line, rows, skipped = self.committed.pop(0)
+            self.offset  = end
+            self.line    = next_line
+            self.rows    = self.rows + rows
+            self.skipped = self.skipped + skipped
+
+    def commit_batch ( self, batch ) :
+        """Function to register committed batch; batches of parallel writers may be committed out of order"""
+        self.lock.acquire()
+        try :
+            self.register( batch.start_offset, batch.end_offset, batch.first_line, batch.next_line, len(batch.rows), batch.nr_skipped )
+            self.write()
+        finally :
+            self.lock.release()
+
+    def recover ( self, cursor, table = PROGRESS_TABLE ) :
+        """Function to register batches committed in database but missing in checkpoint file, e.g. after a crash between commit and write"""
+        cursor.execute( "select start_offset, end_offset, first_line, next_line, nr_rows, nr_skipped from " + str(table) + " where load_id = :1", ( self.load_id, ) )
+        nr_recovered = 0
+        self.lock.acquire()
+        try :
+            for row in cursor.fetchall() :
+                row = [ int(value) for value in row ]
+                if row[1] > self.offset and row not in self.committed :
+                    self.register( *row )
+                    nr_recovered = nr_recovered + 1
+            if nr_recovered > 0 :
+                self.write()
+        finally :
+            self.lock.release()
+        logger.info( str(nr_recovered) + " committed batches recovered from " + str(table) )
+        return nr_recovered
+
+    def clear_progress ( self, cursor, table = PROGRESS_TABLE ) :
+        """Function to delete progress rows of this load from database"""
+        cursor.execute( "delete from " + str(table) + " where load_id = :1", ( self.load_id, ) )
+
+    def complete_load ( self ) :
+        """Function to register that whole file is committed"""
+        self.lock.acquire()
+        try :
+            self.complete = True
+            self.write()
+        finally :
+            self.lock.release()
+
+    def pending_ranges ( self ) :
+        """Function to get byte ranges ( start offset, end offset, first line, end line ) of file which are not committed yet"""
+        if self.complete :
+            return []
+        ranges = []
+        offset = self.offset
+        line   = self.line
+        for start, end, first_line, next_line, rows, skipped in self.committed :
+            if start > offset :
+                ranges.append( ( offset, start, line, first_line ) )
+            offset = end
+            line   = next_line
+        ranges.append( ( offset, None, line, None ) )
+        return ranges
+
+#########################################
+#  Loader class
+#########################################
+
+class ParallelLoader:
+    """Loader in which a parser feeds a bounded queue of batches which is drained by writer threads"""
+
+    def __init__ ( self, acquire_connection, release_connection, insert_stmt, nr_writers = NR_WRITERS, queue_size = QUEUE_SIZE, commit_mode = COMMIT_PER_BATCH, checkpoint = None, progress_table = PROGRESS_TABLE ) :
+        if commit_mode not in COMMIT_MODES :
+            raise ValueError( "Unknown commit mode: " + str(commit_mode) )
+        if checkpoint is not None and commit_mode <> COMMIT_PER_BATCH :
+            raise ValueError( "Checkpoints are only possible with commit mode " + str(COMMIT_PER_BATCH) )
+        if int(nr_writers) < 1 :
+            raise ValueError( "Number of writers must be at least 1: " + str(nr_writers) )
+        self.acquire_connection = acquire_connection # function returning connection; called in writer thread
+        self.release_connection = release_connection # function to give connection back
+        self.insert_stmt        = insert_stmt
+        self.nr_writers         = int(nr_writers)
+        self.queue_size         = int(queue_size)
+        self.commit_mode        = commit_mode
+        self.checkpoint         = checkpoint         # Checkpoint object to register committed batches or None
+        self.progress_stmt      = progress_insert_statement( progress_table )
+        self.errors             = []
+        self.nr_rows            = [ 0 ] * self.nr_writers
+        self.lock               = threading.Lock()
+
+    def writer ( self, writer_id, batch_queue ) :
+        """Function to drain queue into database over own connection"""
+        connection = None
+        finished   = False
+        try :
+            try :
+                connection = self.acquire_connection()
+                cursor = connection.cursor()
+                # Progress rows get own cursor, so the prepared insert statement is kept
+                progress_cursor = connection.cursor()
+                # Statement is prepared once for cx_Oracle; other databases get statement per executemany
+                prepared = hasattr( cursor, 'prepare' )
+                if prepared :
+                    cursor.prepare( self.insert_stmt )
+                while True :
+                    batch = batch_queue.get()
+                    if batch is END_OF_QUEUE :
+                        finished = True
+                        break
+                    # After a failure the queue is still drained, so the parser never blocks
+                    if self.errors :
+                        continue
+                    if prepared :
+                        cursor.setinputsizes( None, None, None, *batch.string_sizes )
+                        cursor.executemany( None, batch.rows )
+                    else :
+                        cursor.executemany( self.insert_stmt, batch.rows )
+                    if self.commit_mode == COMMIT_PER_BATCH :
+                        # Progress row is committed together with batch, so a crash before the checkpoint file is written can be recovered
+                        if self.checkpoint is not None :
+                            progress_cursor.execute( self.progress_stmt, self.checkpoint.progress_row( batch ) )
+                        connection.commit()
+                        if self.checkpoint is not None :
+                            self.checkpoint.commit_batch( batch )
+                    self.nr_rows[ writer_id ] = self.nr_rows[ writer_id ] + len(batch.rows)
+                if not self.errors and self.commit_mode == COMMIT_AT_END :
+                    connection.commit()
+            except Exception, err:
+                logger.critical( "Writer " + str(writer_id) + " failed: ERROR: %s\n" % str(err))
+                self.lock.acquire()
+                self.errors.append( err )
+                self.lock.release()
+                # Drain queue until end marker
+                while not finished :
+                    finished = batch_queue.get() is END_OF_QUEUE
+        finally :
+            if connection is not None :
+                if self.errors and self.commit_mode <> COMMIT_NONE :
+                    try :
+                        connection.rollback()
+                    except Exception :
+                        pass
+                self.release_connection( connection )
+
+    def load ( self, batches ) :
+        """Function to insert batches with writer threads; returns number of inserted rows"""
+        logger.info( "Start loading with " + str(self.nr_writers) + " writers, queue size " + str(self.queue_size) + " and commit mode " + str(self.commit_mode) )
+        start_time  = time.time()
+        batch_queue = Queue.Queue( self.queue_size )
+        writers = []
+        for writer_id in range(self.nr_writers) :
+            writer = threading.Thread( target = self.writer, args = ( writer_id, batch_queue ) )
+            writer.start()
+            writers.append( writer )
+
+        # Parse in this thread and hand over batches; put blocks when queue is full
+        # A parse error is registered before the end markers go out, so the writers roll back
+        try :
+            try :
+                for batch in batches :
+                    if self.errors :
+                        break
+                    batch_queue.put( batch )
+                    logger.debug( str(sum(self.nr_rows)) + " points written to database" )
+            except Exception, err:
+                logger.critical( "Parser failed: ERROR: %s\n" % str(err))
+                self.lock.acquire()
+                self.errors.append( err )
+                self.lock.release()
+        finally :
+            for writer in writers :
+                batch_queue.put( END_OF_QUEUE )
+            for writer in writers :
+                writer.join()
+
+        if self.errors :
+            raise self.errors[0]
+        if self.checkpoint is not None :
+            self.checkpoint.complete_load()
+        nr_rows  = sum(self.nr_rows)
+        duration = max( time.time() - start_time, 0.001 )
+        logger.info( str(nr_rows) + " points written to database in " + str(round(duration, 1)) + " s (" + str(int(nr_rows / duration)) + " points/s)" )
+        return nr_rows
+
+#########################################
+#  Benchmark functions
+#########################################
+
+def generate_emodnet_file ( file_out, nr_points ) :
+    """Function to write EMODNET grid file with random depths for benchmarks"""
+    import numpy
+    depths = numpy.random.uniform( -5000.0, 0.0, nr_points )
+    fOut = open( file_out, 'w' )
+    for i in xrange(nr_points) :
+        depth = depths[i]
+        fOut.write( "%.6f;%.6f;%.2f;%.2f;%.2f;%.2f;%d;%d;%.2f;%.2f;%s;%s\n" % ( ( i % 2400 ) * 0.00416667, ( i / 2400 ) * 0.00416667, depth - 1, depth + 1, depth, 0.5, i % 3, 1, depth, 0.0, "CDI" + str(i % 7), "S" ) )
+    fOut.close()
+
+def sqlite_connection_factory ( database_file ) :
+    """Function to get acquire and release functions of connections to a SQLite stand-in database"""
+    import sqlite3
+    def acquire_connection () :
+        return sqlite3.connect( database_file, timeout = 600 )
+    def release_connection ( connection ) :
+        connection.close()
+    return acquire_connection, release_connection
+
+def create_sqlite_import_table ( database_file ) :
+    """Function to create stand-in of sdb_im_import_temp in SQLite database"""
+    import sqlite3
+    connection = sqlite3.connect( database_file )
+    connection.execute( "drop table if exists " + IMPORT_TABLE )
+    connection.execute( "create table " + IMPORT_TABLE + " ( x real, y real, z real, " + ", ".join( [ "customattribute" + str(k) + " text" for k in range(9) ] ) + ", load_id text )" )
+    connection.execute( "drop table if exists " + PROGRESS_TABLE )
+    connection.execute( "create table " + PROGRESS_TABLE + " ( load_id text, " + ", ".join( [ column + " integer" for column in PROGRESS_COLUMNS[1:] ] ) + " )" )
+    connection.commit()
+    connection.close()
+
+def benchmark ( nr_points, writer_counts, commit_mode = COMMIT_PER_BATCH, batch_size = BATCH_SIZE ) :
+    """Function to measure throughput of loader against SQLite stand-in database"""
+    work_dir      = tempfile.mkdtemp()
+    grid_file     = os.path.join( work_dir, "benchmark.emo" )
+    database_file = os.path.join( work_dir, "benchmark.db" )
+    logger.info( "Generate benchmark file with " + str(nr_points) + " points in " + work_dir )
+    generate_emodnet_file( grid_file, nr_points )
+    insert_stmt = grid_insert_statement( EMODNET_NR_COLUMNS )
+    results = {}
+    for nr_writers in writer_counts :
+        create_sqlite_import_table( database_file )
+        acquire_connection, release_connection = sqlite_connection_factory( database_file )
+        loader = ParallelLoader( acquire_connection, release_connection, insert_stmt, nr_writers, QUEUE_SIZE, commit_mode )
+        start_time = time.time()
+        nr_rows = loader.load( read_grid_batches( grid_file, EMODNET_NR_COLUMNS, EMODNET_SEPARATOR, batch_size ) )
+        results[ nr_writers ] = ( nr_rows, time.time() - start_time )
+        logger.info( "Writers: " + str(nr_writers) + ", points: " + str(nr_rows) + ", time: " + str(round(results[ nr_writers ][1], 2)) + " s" )
+    return results
+
+####################################
+# Start main program
+####################################
+
+if __name__ == "__main__":
+
+    # Initialize logger
+    logger.setLevel( logging.INFO )
+    stream_hdlr = logging.StreamHandler()
+    formatter   = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    stream_hdlr.setFormatter(formatter)
+    logger.addHandler(stream_hdlr)
+
+    # Benchmark: EMODNET_loader.py [number of points] [commit mode]
+    nr_points   = 1000000
+    commit_mode = COMMIT_PER_BATCH
+    if len(sys.argv) > 1 :
+        nr_points = int(sys.argv[1])
+    if len(sys.argv) > 2 :
+        commit_mode = sys.argv[2]
+    benchmark( nr_points, [ 1, 2, 4 ], commit_mode )
@@ -0,0 +1,68 @@
+#! /usr/bin/python
+
+""" Functions to color rasters with a lookup table of a color ramp
+"""
+
+# Standard library imports
+import logging
+
+# Related third party imports
+import numpy
+
+# Module name
+MODULE_NAME = "IM colormap"
+
+# Number of colors in lookup table (the nodata color is added after the colors)
+COLORMAP_ENTRIES = 1024
+
+# Number of raster rows colored at once
+COLORMAP_ROW_BLOCK = 256
+
+# Color of nodata cells: transparent
+NODATA_RGBA = ( 0, 0, 0, 0 )
+
+# Logger
+logger = logging.getLogger( MODULE_NAME )
+
+#########################################
+#  Colormap functions
+#########################################
+
+def build_lut ( ramp, nr_entries = COLORMAP_ENTRIES, nodata_rgba = NODATA_RGBA ) :
+    """Function to build lookup table of bands (red, green, blue, alpha) x ( entries + nodata ) from ramp( mag, cmin, cmax ) with floats from 0 to 1"""
+    lut = numpy.zeros( ( 4, int(nr_entries) + 1 ), numpy.uint8 )
+    for k in range(int(nr_entries)) :
+        red, green, blue = ramp( k, 0, int(nr_entries) - 1 )
+        lut[ :, k ] = ( int(red*255), int(green*255), int(blue*255), 255 )
+    lut[ :, int(nr_entries) ] = nodata_rgba
+    return lut
+
+def apply_lut ( raster, lut, cmin, cmax, nodata_value = None, block_rows = COLORMAP_ROW_BLOCK, progress = None ) :
+    """Function to color raster with lookup table; returns array of bands x rows x cols and reports progress( fraction ) per block of rows"""
+    nr_entries = lut.shape[1] - 1
+    nr_rows    = raster.shape[0]
+    bands      = numpy.empty( ( lut.shape[0], ) + raster.shape, numpy.uint8 )
+    if float(cmax) <> float(cmin) :
+        scale = ( nr_entries - 1 ) / ( float(cmax) - float(cmin) )
+    else :
+        scale = 0.0
+    for row in range( 0, nr_rows, int(block_rows) ) :
+        block = numpy.asarray( raster[ row:row + int(block_rows) ], numpy.float64 )
+
+        # Index in lookup table; values out of range get the first or last color and equal cmin and cmax the middle color
+        if scale > 0.0 :
+            index = numpy.floor( ( block - float(cmin) ) * scale )
+        else :
+            index = numpy.empty( block.shape )
+            index.fill( ( nr_entries - 1 ) / 2 )
+        index = numpy.clip( index, 0, nr_entries - 1 )
+
+        # Nodata cells get the last entry of the lookup table
+        nodata = numpy.isnan( block )
+        if nodata_value is not None :
+            nodata = nodata | ( block == float(nodata_value) )
+        index[ nodata ] = nr_entries
+        bands[ :, row:row + int(block_rows) ] = numpy.take( lut, index.astype( numpy.intp ), axis = 1 )
+        if progress is not None :
+            progress( min( float( row + int(block_rows) ) / nr_rows, 1.0 ) )
+    return bands
@@ -0,0 +1,209 @@
+#! /usr/bin/python
+
+""" Functions to aggregate points of individual models into cells of a regular grid
+"""
+
+# Standard library imports
+import os
+import sys
+import logging
+import tempfile
+
+# Related third party imports
+import numpy
+
+# Module name
+MODULE_NAME = "IM grid"
+
+# Aggregations of points in a cell
+GRID_COUNT = "count"
+GRID_SUM   = "sum"
+GRID_MEAN  = "mean"
+GRID_MIN   = "min"
+GRID_MAX   = "max"
+GRID_STD   = "std"
+GRID_STATISTICS = [ GRID_COUNT, GRID_SUM, GRID_MEAN, GRID_MIN, GRID_MAX, GRID_STD ]
+
+# Logger
+logger = logging.getLogger( MODULE_NAME )
+
+#########################################
+#  Grid class
+#########################################
+
+class GridAccumulator:
+    """Accumulators per cell of grid; points are added in chunks of arrays and row 0 is the top (maximum y) of the grid"""
+
+    def __init__ ( self, x_min, y_min, gridsize, nr_rows, nr_cols, statistics = ( GRID_MEAN, ), memory_map_dir = None ) :
+        for statistic in statistics :
+            if statistic not in GRID_STATISTICS :
+                raise ValueError( "Unknown statistic: " + str(statistic) )
+        self.x_min      = float(x_min)
+        self.y_min      = float(y_min)
+        self.gridsize   = float(gridsize)
+        self.nr_rows    = int(nr_rows)
+        self.nr_cols    = int(nr_cols)
+        self.nr_cells   = self.nr_rows * self.nr_cols
+        self.statistics = statistics
+        self.nr_points  = 0 # number of points added to grid
+        self.nr_outside = 0 # number of points outside grid
+
+        # Accumulators of large grids are memory mapped files in this directory
+        self.memory_map_dir   = memory_map_dir
+        self.memory_map_files = []
+
+        # Counts are 64 bits and sums are double precision, so cells with many points do not overflow
+        self.count = self.create_accumulator( numpy.int64, 0 )
+        self.sum   = None
+        self.sum2  = None
+        self.min   = None
+        self.max   = None
+        self.shift = None # values are shifted for sum of squares to avoid loss of precision
+        if GRID_SUM in statistics or GRID_MEAN in statistics or GRID_STD in statistics :
+            self.sum = self.create_accumulator( numpy.float64, 0.0 )
+        if GRID_STD in statistics :
+            self.sum2 = self.create_accumulator( numpy.float64, 0.0 )
+        if GRID_MIN in statistics :
+            self.min = self.create_accumulator( numpy.float64, numpy.inf )
+        if GRID_MAX in statistics :
+            self.max = self.create_accumulator( numpy.float64, -numpy.inf )
+
+    def create_accumulator ( self, dtype, value ) :
+        """Function to create accumulator for all cells; in memory or memory mapped"""
+        if self.memory_map_dir :
+            handle, memory_map_file = tempfile.mkstemp( suffix = '.grid', dir = self.memory_map_dir )
+            os.close( handle )
+            self.memory_map_files.append( memory_map_file )
+            accumulator = numpy.memmap( memory_map_file, dtype = dtype, mode = 'w+', shape = ( self.nr_cells, ) )
+        else :
+            accumulator = numpy.empty( self.nr_cells, dtype )
+        accumulator.fill( value )
+        return accumulator
+
+    def close ( self ) :
+        """Function to release accumulators and remove memory mapped files"""
+        self.count = self.sum = self.sum2 = self.min = self.max = None
+        for memory_map_file in self.memory_map_files :
+            os.remove( memory_map_file )
+        self.memory_map_files = []
+
+    def cells ( self, x, y ) :
+        """Function to get flat index of cell for points; returns indices and mask of points inside grid"""
+        rows = numpy.floor( ( y - self.y_min ) / self.gridsize + 0.5 ).astype( numpy.intp )
+        cols = numpy.floor( ( x - self.x_min ) / self.gridsize + 0.5 ).astype( numpy.intp )
+
+        # Start counting rows from top
+        rows   = self.nr_rows - rows - 1
+        inside = ( rows >= 0 ) & ( rows < self.nr_rows ) & ( cols >= 0 ) & ( cols < self.nr_cols )
+        return rows * self.nr_cols + cols, inside
+
+    def add ( self, x, y, z ) :
+        """Function to add chunk of points to accumulators"""
+        x = numpy.asarray( x, numpy.float64 )
+        y = numpy.asarray( y, numpy.float64 )
+        z = numpy.asarray( z, numpy.float64 )
+        cells, inside = self.cells( x, y )
+        if not inside.all() :
+            self.nr_outside = self.nr_outside + int( len(inside) - inside.sum() )
+            cells = cells[ inside ]
+            z     = z[ inside ]
+        self.nr_points = self.nr_points + len(z)
+        if len(z) == 0 :
+            return
+
+        # Reduce runs of points sorted on cell; only cells with points are updated, so small chunks are cheap on large grids
+        order        = numpy.argsort( cells, kind = 'mergesort' )
+        sorted_cells = cells[ order ]
+        sorted_z     = z[ order ]
+        starts       = numpy.flatnonzero( numpy.concatenate( ( [ True ], sorted_cells[1:] <> sorted_cells[:-1] ) ) )
+        unique_cells = sorted_cells[ starts ]
+
+        # Count, sum and sum of squares per cell
+        self.count[ unique_cells ] += numpy.diff( numpy.concatenate( ( starts, [ len(sorted_z) ] ) ) )
+        if self.sum is not None :
+            self.sum[ unique_cells ] += numpy.add.reduceat( sorted_z, starts )
+        if self.sum2 is not None :
+            if self.shift is None :
+                self.shift = float( z.mean() )
+            self.sum2[ unique_cells ] += numpy.add.reduceat( ( sorted_z - self.shift ) ** 2, starts )
+
+        # Minimum and maximum per cell
+        if self.min is not None :
+            self.min[ unique_cells ] = numpy.minimum( self.min[ unique_cells ], numpy.minimum.reduceat( sorted_z, starts ) )
+        if self.max is not None :
+            self.max[ unique_cells ] = numpy.maximum( self.max[ unique_cells ], numpy.maximum.reduceat( sorted_z, starts ) )
+
+    def result ( self, statistic, nodata_value, dtype = numpy.float32 ) :
+        """Function to get statistic as array of rows and columns; cells without points get nodata value"""
+        return self.result_rows( statistic, nodata_value, 0, self.nr_rows, dtype )
+
+    def result_rows ( self, statistic, nodata_value, row_start, row_end, dtype = numpy.float32 ) :
+        """Function to get statistic for block of rows; cells without points get nodata value"""
+        if statistic not in self.statistics and statistic <> GRID_COUNT :
+            raise ValueError( "Statistic " + str(statistic) + " is not accumulated" )
+        row_end = min( int(row_end), self.nr_rows )
+        cells   = slice( int(row_start) * self.nr_cols, row_end * self.nr_cols )
+        empty   = self.count[ cells ] == 0
+        count   = numpy.maximum( self.count[ cells ], 1 )
+        if statistic == GRID_COUNT :
+            values = self.count[ cells ].astype( numpy.float64 )
+        elif statistic == GRID_SUM :
+            values = numpy.array( self.sum[ cells ] )
+        elif statistic == GRID_MEAN :
+            values = self.sum[ cells ] / count
+        elif statistic == GRID_MIN :
+            values = numpy.array( self.min[ cells ] )
+        elif statistic == GRID_MAX :
+            values = numpy.array( self.max[ cells ] )
+        elif statistic == GRID_STD :
+            # Population standard deviation from shifted sums; shift is only set once points are added
+            shift        = self.shift if self.shift is not None else 0.0
+            mean_shifted = self.sum[ cells ] / count - shift
+            variance     = self.sum2[ cells ] / count - mean_shifted ** 2
+            values       = numpy.sqrt( numpy.maximum( variance, 0.0 ) )
+        values[ empty ] = nodata_value
+        return values.astype( dtype ).reshape( row_end - int(row_start), self.nr_cols )
+
+#########################################
+#  Check functions
+#########################################
+
+def check_grid ( nr_points ) :
+    """Function to check statistics of grid without points and of grid with points against NumPy"""
+    nodata_value = -999.0
+
+    # Grid without points, e.g. of empty extent or filtered query, has nodata in all cells
+    grid = GridAccumulator( 0.0, 0.0, 1.0, 2, 2, GRID_STATISTICS )
+    for statistic in GRID_STATISTICS :
+        if not ( grid.result_rows( statistic, nodata_value, 0, 2 ) == nodata_value ).all() :
+            raise ValueError( "Statistic " + statistic + " of grid without points is not nodata" )
+
+    # Grid with points in lower left cell; x_min and y_min are the centre of that cell
+    z    = numpy.random.uniform( -5000.0, -4000.0, nr_points )
+    grid = GridAccumulator( 0.0, 0.0, 1.0, 2, 2, GRID_STATISTICS )
+    grid.add( numpy.zeros( nr_points ), numpy.zeros( nr_points ), z )
+    reference = { GRID_COUNT : nr_points, GRID_SUM : z.sum(), GRID_MEAN : z.mean(), GRID_MIN : z.min(), GRID_MAX : z.max(), GRID_STD : z.std() }
+    for statistic in GRID_STATISTICS :
+        values = grid.result( statistic, nodata_value, numpy.float64 )
+        if not numpy.isclose( values[ 1, 0 ], reference[ statistic ] ) or ( values == nodata_value ).sum() <> 3 :
+            raise ValueError( "Statistic " + statistic + " differs from reference" )
+    logger.info( "Statistics of grids equal to reference" )
+
+####################################
+# Start main program
+####################################
+
+if __name__ == "__main__":
+
+    # Initialize logger
+    logger.setLevel( logging.INFO )
+    stream_hdlr = logging.StreamHandler()
+    formatter   = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    stream_hdlr.setFormatter(formatter)
+    logger.addHandler(stream_hdlr)
+
+    # Check: IM_grid.py [number of points]
+    nr_points = 100000
+    if len(sys.argv) > 1 :
+        nr_points = int(sys.argv[1])
+    check_grid( nr_points )
@@ -0,0 +1,310 @@
+#! /usr/bin/python
+
+""" Functions to generate the hull of points of individual models as alpha shape of a Delaunay triangulation
+"""
+
+# Standard library imports
+import math
+import struct
+import logging
+import collections
+import multiprocessing
+
+# Related third party imports
+import numpy
+import matplotlib.tri
+
+# GDAL/OGR imports
+from osgeo import ogr
+
+# Local imports
+from IM_simplify import wkb_points, WKB_NDR, WKB_POLYGON, WKB_MULTIPOLYGON
+
+# Module name
+MODULE_NAME = "IM hull"
+
+# Tile size of tiled hull generation in link distances; tiles overlap one link distance
+HULL_TILE_LINKS = 500
+
+# Minimum number of points to generate hull in tiles
+HULL_TILE_MIN_POINTS = 1000000
+
+# Number of tiles per process queued to pool; limits points of tiles held in memory
+HULL_TILES_PER_PROCESS = 2
+
+# Logger
+logger = logging.getLogger( MODULE_NAME )
+
+#########################################
+#  Triangulation functions
+#########################################
+
+def unique_points ( x, y ) :
+    """Function to get ascending indices of points without duplicates; of equal points the first is kept"""
+    order = numpy.lexsort( ( y, x ) )
+    first = numpy.ones( len(order), bool )
+    first[1:] = ( x[ order[1:] ] <> x[ order[:-1] ] ) | ( y[ order[1:] ] <> y[ order[:-1] ] )
+    return numpy.sort( order[ first ] )
+
+def delaunay_triangles ( x, y ) :
+    """Function to get Delaunay triangulation of points as array of triangles x 3 vertex indices"""
+    return matplotlib.tri.Triangulation( x, y ).triangles
+
+def circumcircles ( x, y, triangles ) :
+    """Function to get centres and squared radii of circumcircles of triangles; degenerate triangles get infinite radius"""
+    ax, ay = x[ triangles[:,0] ], y[ triangles[:,0] ]
+    bx, by = x[ triangles[:,1] ] - ax, y[ triangles[:,1] ] - ay
+    cx, cy = x[ triangles[:,2] ] - ax, y[ triangles[:,2] ] - ay
+
+    # Centre relative to first vertex
+    d = 2.0 * ( bx * cy - by * cx )
+    with numpy.errstate( divide = 'ignore', invalid = 'ignore' ) :
+        ux = ( cy * ( bx**2 + by**2 ) - by * ( cx**2 + cy**2 ) ) / d
+        uy = ( bx * ( cx**2 + cy**2 ) - cx * ( bx**2 + by**2 ) ) / d
+        radius2 = ux**2 + uy**2
+    radius2[ ~numpy.isfinite( radius2 ) ] = numpy.inf
+    return ax + ux, ay + uy, radius2
+
+def alpha_triangles ( x, y, triangles, alpha ) :
+    """Function to get triangles of alpha shape; alpha is the squared radius of the carving spoon like in CGAL"""
+    centre_x, centre_y, radius2 = circumcircles( x, y, triangles )
+    return triangles[ radius2 <= alpha ]
+
+def single_edges ( starts, ends ) :
+    """Function to get directed edges which occur once, in either direction"""
+    keys = numpy.minimum( starts, ends ).astype( numpy.int64 ) * ( int( max( starts.max(), ends.max() ) ) + 1 ) + numpy.maximum( starts, ends )
+    unique_keys, inverse, counts = numpy.unique( keys, return_inverse = True, return_counts = True )
+    single = counts[ inverse ] == 1
+    return starts[ single ], ends[ single ]
+
+def boundary_edges ( x, y, triangles ) :
+    """Function to get directed edges on boundary of triangles with the triangles on their left; returns arrays of start and end vertices"""
+    # Orient triangles counter clockwise
+    area = ( x[ triangles[:,1] ] - x[ triangles[:,0] ] ) * ( y[ triangles[:,2] ] - y[ triangles[:,0] ] ) \
+         - ( x[ triangles[:,2] ] - x[ triangles[:,0] ] ) * ( y[ triangles[:,1] ] - y[ triangles[:,0] ] )
+    triangles = triangles.copy()
+    clockwise = area < 0.0
+    triangles[ clockwise ] = triangles[ clockwise ][ :, ::-1 ]
+
+    # Edges of one triangle only are on the boundary
+    starts = numpy.concatenate( ( triangles[:,0], triangles[:,1], triangles[:,2] ) )
+    ends   = numpy.concatenate( ( triangles[:,1], triangles[:,2], triangles[:,0] ) )
+    return single_edges( starts, ends )
+
+#########################################
+#  Polygonize functions
+#########################################
+
+def split_ring ( ring ) :
+    """Function to split closed ring of vertex indices at repeated vertices into simple closed rings"""
+    rings    = []
+    path     = []
+    position = {}
+    for vertex in ring[:-1] :
+        if vertex in position :
+            # Loop from earlier visit of vertex back to vertex is a ring of its own
+            loop = path[ position[ vertex ]: ]
+            del path[ position[ vertex ]: ]
+            for looped in loop :
+                del position[ looped ]
+            rings.append( loop + [ vertex ] )
+        position[ vertex ] = len(path)
+        path.append( vertex )
+    rings.append( path + [ path[0] ] )
+    return [ loop for loop in rings if len(loop) >= 4 ]
+
+def polygonize_edges ( x, y, starts, ends ) :
+    """Function to link directed boundary edges into closed rings of vertex indices
+
+    Where rings touch in one vertex, the outgoing edge is the first one clockwise from the incoming edge,
+    so each ring bounds one fan of triangles and rings do not cross. Rings that still touch themselves are split at the
+    touching vertices into simple rings; touching holes then become clockwise rings of their own."""
+    order  = numpy.argsort( starts, kind = 'mergesort' )
+    first  = numpy.searchsorted( starts[ order ], numpy.arange( len(x) + 1 ) )
+    used   = numpy.zeros( len(starts), bool )
+    angles = numpy.arctan2( y[ ends ] - y[ starts ], x[ ends ] - x[ starts ] )
+    rings  = []
+    for edge in range( len(starts) ) :
+        if used[ edge ] :
+            continue
+        ring    = [ starts[ edge ] ]
+        current = edge
+        while True :
+            used[ current ] = True
+            vertex = ends[ current ]
+            ring.append( vertex )
+            candidates = [ e for e in order[ first[ vertex ]:first[ vertex + 1 ] ] if not used[ e ] or e == edge ]
+            if not candidates :
+                break
+            if len(candidates) == 1 :
+                current = candidates[0]
+            else :
+                # Clockwise angle from reversed incoming direction to outgoing direction
+                backwards = angles[ current ] + math.pi
+                current   = min( candidates, key = lambda e : ( backwards - angles[ e ] ) % ( 2.0 * math.pi ) or 2.0 * math.pi )
+            if current == edge :
+                break
+        if ring[0] == ring[-1] and len(ring) >= 4 :
+            rings.extend( [ numpy.array( loop ) for loop in split_ring( ring ) ] )
+        else :
+            logger.warning( "Open boundary of " + str(len(ring)) + " vertices skipped" )
+    return rings
+
+def ring_area ( x, y ) :
+    """Function to get signed area of closed ring; positive for counter clockwise rings"""
+    return 0.5 * float( numpy.sum( x[:-1] * y[1:] - x[1:] * y[:-1] ) )
+
+def point_in_ring ( px, py, x, y ) :
+    """Function to check if point is inside closed ring by counting crossings of ray to the right"""
+    crosses = ( y[:-1] > py ) <> ( y[1:] > py )
+    with numpy.errstate( divide = 'ignore', invalid = 'ignore' ) :
+        x_cross = x[:-1] + ( py - y[:-1] ) * ( x[1:] - x[:-1] ) / ( y[1:] - y[:-1] )
+        return bool( numpy.sum( crosses & ( px < x_cross ) ) % 2 )
+
+def rings_to_polygons ( x, y, rings ) :
+    """Function to group rings into polygons; counter clockwise rings are exteriors and clockwise rings holes of smallest exterior around them"""
+    exteriors = []
+    holes     = []
+    for ring in rings :
+        area = ring_area( x[ ring ], y[ ring ] )
+        if area > 0.0 :
+            exteriors.append( ( area, ring ) )
+        elif area < 0.0 :
+            holes.append( ring )
+    exteriors.sort( key = lambda exterior : exterior[0] )
+    polygons = [ [ ring ] for area, ring in exteriors ]
+    for hole in holes :
+        for k, ( area, ring ) in enumerate( exteriors ) :
+            if point_in_ring( x[ hole[0] ], y[ hole[0] ], x[ ring ], y[ ring ] ) or point_in_ring( x[ hole[1] ], y[ hole[1] ], x[ ring ], y[ ring ] ) :
+                polygons[k].append( hole )
+                break
+        else :
+            logger.warning( "Hole of " + str(len(hole)) + " vertices outside all exteriors skipped" )
+    return polygons
+
+#########################################
+#  Tile functions
+#########################################
+
+def tile_boundary_edges ( args ) :
+    """Function to get boundary edges of alpha triangles with circumcentre in core of tile; runs in worker process of pool"""
+    x, y, indices, core, alpha = args
+
+    # Indices are ascending, so of points duplicated in several tiles each tile keeps the same one
+    unique  = unique_points( x, y )
+    x, y    = x[ unique ], y[ unique ]
+    indices = indices[ unique ]
+    if len(x) < 3 :
+        return numpy.empty( 0, numpy.int64 ), numpy.empty( 0, numpy.int64 )
+    triangles = alpha_triangles( x, y, delaunay_triangles( x, y ), alpha )
+
+    # Each triangle belongs to the one tile whose core has its circumcentre; overlap makes it the same triangle as without tiles
+    centre_x, centre_y, radius2 = circumcircles( x, y, triangles )
+    in_core   = ( centre_x >= core[0] ) & ( centre_x < core[1] ) & ( centre_y >= core[2] ) & ( centre_y < core[3] )
+    triangles = triangles[ in_core ]
+    if len(triangles) == 0 :
+        return numpy.empty( 0, numpy.int64 ), numpy.empty( 0, numpy.int64 )
+    starts, ends = boundary_edges( x, y, triangles )
+    return indices[ starts ], indices[ ends ]
+
+def split_tiles ( x, y, tile_size, overlap, alpha ) :
+    """Function to get arguments of tile_boundary_edges per tile; points within overlap of core of tile are included"""
+    x_min, y_min = float( x.min() ), float( y.min() )
+    nr_cols = int( ( float( x.max() ) - x_min ) / tile_size ) + 1
+    nr_rows = int( ( float( y.max() ) - y_min ) / tile_size ) + 1
+    cols    = numpy.minimum( ( ( x - x_min ) / tile_size ).astype( numpy.int64 ), nr_cols - 1 )
+    rows    = numpy.minimum( ( ( y - y_min ) / tile_size ).astype( numpy.int64 ), nr_rows - 1 )
+    order   = numpy.argsort( rows * nr_cols + cols, kind = 'mergesort' )
+    offsets = numpy.searchsorted( ( rows * nr_cols + cols )[ order ], numpy.arange( nr_rows * nr_cols + 1 ) )
+
+    # Overlap is smaller than tile, so points of a tile are in the tile and its eight neighbours
+    for row in range( nr_rows ) :
+        for col in range( nr_cols ) :
+            if offsets[ row * nr_cols + col ] == offsets[ row * nr_cols + col + 1 ] :
+                continue
+            core = ( x_min + col * tile_size, x_min + ( col + 1 ) * tile_size, y_min + row * tile_size, y_min + ( row + 1 ) * tile_size )
+            if col == nr_cols - 1 :
+                core = ( core[0], numpy.inf, core[2], core[3] )
+            if row == nr_rows - 1 :
+                core = ( core[0], core[1], core[2], numpy.inf )
+            if col == 0 :
+                core = ( -numpy.inf, core[1], core[2], core[3] )
+            if row == 0 :
+                core = ( core[0], core[1], -numpy.inf, core[3] )
+            indices = numpy.concatenate( [ order[ offsets[ r * nr_cols + max( col - 1, 0 ) ]:offsets[ r * nr_cols + min( col + 1, nr_cols - 1 ) + 1 ] ]
+                                           for r in range( max( row - 1, 0 ), min( row + 1, nr_rows - 1 ) + 1 ) ] )
+            inside  = ( x[ indices ] >= x_min + col * tile_size - overlap ) & ( x[ indices ] < x_min + ( col + 1 ) * tile_size + overlap ) \
+                    & ( y[ indices ] >= y_min + row * tile_size - overlap ) & ( y[ indices ] < y_min + ( row + 1 ) * tile_size + overlap )
+            indices = numpy.sort( indices[ inside ] )
+            yield ( x[ indices ], y[ indices ], indices, core, alpha )
+
+#########################################
+#  Hull functions
+#########################################
+
+def hull_from_edges ( x, y, starts, ends ) :
+    """Function to polygonize boundary edges into OGR multipolygon with holes"""
+    logger.info( str(len(starts)) + " edges on boundary" )
+    rings    = polygonize_edges( x, y, starts, ends )
+    polygons = rings_to_polygons( x, y, rings )
+    logger.info( str(len(polygons)) + " polygons with " + str(sum( [ len(polygon) - 1 for polygon in polygons ] )) + " holes" )
+
+    # Exteriors are counter clockwise and holes clockwise, as Oracle requires
+    wkb = [ struct.pack( '<BII', WKB_NDR, WKB_MULTIPOLYGON, len(polygons) ) ]
+    for polygon in polygons :
+        wkb.append( struct.pack( '<BII', WKB_NDR, WKB_POLYGON, len(polygon) ) )
+        for ring in polygon :
+            wkb.append( wkb_points( numpy.column_stack( ( x[ ring ], y[ ring ] ) ) ) )
+    return ogr.CreateGeometryFromWkb( ''.join( wkb ) )
+
+def generate_alpha_hull ( x, y, link_distance, tile_size = None, nr_processes = None ) :
+    """Function to generate hull of points as OGR multipolygon with holes; alpha shape with spoon of diameter link distance
+
+    Points are triangulated in tiles of tile_size by a pool of processes when tile_size is given or there are many points.
+    Duplicate points are removed per tile, so no sorted copy of all points is made."""
+    x      = numpy.asarray( x, numpy.float64 )
+    y      = numpy.asarray( y, numpy.float64 )
+    alpha  = ( link_distance / 2.0 ) ** 2.0
+    if tile_size is None and len(x) >= HULL_TILE_MIN_POINTS :
+        tile_size = HULL_TILE_LINKS * link_distance
+    if tile_size is not None and ( float( x.max() - x.min() ) > tile_size or float( y.max() - y.min() ) > tile_size ) :
+        # Triangles of alpha shape only depend on points within spoon radius of their circumcentre, so one link distance overlap is enough
+        if nr_processes is None :
+            nr_processes = multiprocessing.cpu_count()
+        logger.info( "Triangulate " + str(len(x)) + " points in tiles of " + str(tile_size) + " with " + str(nr_processes) + " processes" )
+        tiles = split_tiles( x, y, float(tile_size), max( float(link_distance), 0.0 ), alpha )
+        if int(nr_processes) > 1 :
+            # Tiles are queued a few per process; the pool would otherwise take all tiles from the generator at once
+            tile_edges = []
+            pending    = collections.deque()
+            pool       = multiprocessing.Pool( int(nr_processes) )
+            try :
+                for tile in tiles :
+                    if len(pending) >= HULL_TILES_PER_PROCESS * int(nr_processes) :
+                        tile_edges.append( pending.popleft().get() )
+                    pending.append( pool.apply_async( tile_boundary_edges, ( tile, ) ) )
+                while pending :
+                    tile_edges.append( pending.popleft().get() )
+            finally :
+                pool.close()
+                pool.join()
+        else :
+            tile_edges = map( tile_boundary_edges, tiles )
+
+        # Edges between triangles of different tiles occur in both tiles and cancel out
+        starts = numpy.concatenate( [ tile_starts for tile_starts, tile_ends in tile_edges ] )
+        ends   = numpy.concatenate( [ tile_ends for tile_starts, tile_ends in tile_edges ] )
+        if len(starts) == 0 :
+            raise ValueError( "No triangles in alpha shape with link distance " + str(link_distance) )
+        starts, ends = single_edges( starts, ends )
+        return hull_from_edges( x, y, starts, ends )
+
+    unique = unique_points( x, y )
+    x, y   = x[ unique ], y[ unique ]
+    logger.info( "Triangulate " + str(len(x)) + " points" )
+    triangles = alpha_triangles( x, y, delaunay_triangles( x, y ), alpha )
+    logger.info( str(len(triangles)) + " triangles in alpha shape" )
+    if len(triangles) == 0 :
+        raise ValueError( "No triangles in alpha shape with link distance " + str(link_distance) )
+    starts, ends = boundary_edges( x, y, triangles )
+    return hull_from_edges( x, y, starts, ends )
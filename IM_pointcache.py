@@ -0,0 +1,358 @@
+#! /usr/bin/python
+
+""" On disk cache of points of individual models as memory mapped column arrays with a grid index
+"""
+
+# Standard library imports
+import os
+import sys
+import json
+import shutil
+import hashlib
+import logging
+import tempfile
+
+# Related third party imports
+import numpy
+
+# Module name
+MODULE_NAME = "IM point cache"
+
+# Default cache directory and maximum size of all cached points together
+POINT_CACHE_DIR       = os.path.join( os.path.expanduser("~"), ".im_point_cache" )
+POINT_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+
+# Name of file with key, modification stamp, extent and index of cached points
+ENTRY_META = "meta.json"
+
+# Columns of points; one array file per column
+POINT_COLUMNS = [ "x", "y", "z" ]
+
+# Name of array file with first point of each cell of grid index
+INDEX_OFFSETS = "offsets"
+
+# Number of cells of grid index in x and y direction
+INDEX_CELLS = 256
+
+# Number of points per batch when cached points are sorted on cell of grid index
+SORT_BATCH_SIZE = 1000000
+
+# Extension of temporary files with unsorted column of points
+RAW_EXTENSION = ".raw"
+
+# Logger
+logger = logging.getLogger( MODULE_NAME )
+
+#########################################
+#  Cache entry class
+#########################################
+
+class PointCacheEntry:
+    """Points of one individual model sorted on cell of grid index; columns and offsets are memory mapped"""
+
+    def __init__ ( self, entry_dir, meta ) :
+        self.entry_dir = entry_dir
+        self.meta      = meta
+        self.columns   = {}
+        for column in POINT_COLUMNS :
+            self.columns[ column ] = numpy.load( os.path.join( entry_dir, column + ".npy" ), mmap_mode = 'r' )
+        self.offsets = numpy.load( os.path.join( entry_dir, INDEX_OFFSETS + ".npy" ), mmap_mode = 'r' )
+
+    def close ( self ) :
+        """Function to release memory maps of columns and offsets, so entry can be removed; also on Windows"""
+        self.columns = {}
+        self.offsets = None
+
+    def extent ( self ) :
+        """Function to get extent of points as x_min, x_max, y_min, y_max, z_min, z_max"""
+        return self.meta[ 'extent' ]
+
+    def nr_points ( self ) :
+        """Function to get number of cached points"""
+        return self.meta[ 'nrofpoints' ]
+
+    def batches ( self, batch_size ) :
+        """Generator of arrays of x, y and z of all cached points in batches of batch_size points"""
+        for start in range( 0, self.nr_points(), int(batch_size) ) :
+            end = start + int(batch_size)
+            yield numpy.array( self.columns[ 'x' ][ start:end ] ), numpy.array( self.columns[ 'y' ][ start:end ] ), numpy.array( self.columns[ 'z' ][ start:end ] )
+
+    def read ( self, x_min = None, x_max = None, y_min = None, y_max = None, step = 1 ) :
+        """Function to get arrays of x, y and z of points within extent; every step-th point when step is larger than 1"""
+        x = self.columns[ 'x' ]
+        y = self.columns[ 'y' ]
+        z = self.columns[ 'z' ]
+        if x_min is None or x_max is None or y_min is None or y_max is None :
+            return numpy.array( x[ ::int(step) ] ), numpy.array( y[ ::int(step) ] ), numpy.array( z[ ::int(step) ] )
+
+        # Cells of one row of grid index are contiguous, so each row of cells within extent is one slice of points
+        index     = self.meta[ 'index' ]
+        cell_size = index[ 'cell_size' ]
+        nr_cols   = index[ 'nr_cols' ]
+        col_start = max( int( ( x_min - index[ 'x_origin' ] ) / cell_size ), 0 )
+        col_end   = min( int( ( x_max - index[ 'x_origin' ] ) / cell_size ), nr_cols - 1 )
+        row_start = max( int( ( y_min - index[ 'y_origin' ] ) / cell_size ), 0 )
+        row_end   = min( int( ( y_max - index[ 'y_origin' ] ) / cell_size ), index[ 'nr_rows' ] - 1 )
+        parts = []
+        for row in range( row_start, row_end + 1 ) :
+            if col_start <= col_end :
+                parts.append( ( int( self.offsets[ row * nr_cols + col_start ] ), int( self.offsets[ row * nr_cols + col_end + 1 ] ) ) )
+        if parts :
+            x_part = numpy.concatenate( [ x[ start:end ] for start, end in parts ] )
+            y_part = numpy.concatenate( [ y[ start:end ] for start, end in parts ] )
+            z_part = numpy.concatenate( [ z[ start:end ] for start, end in parts ] )
+        else :
+            x_part = y_part = z_part = numpy.empty( 0, numpy.float64 )
+        inside = ( x_part >= x_min ) & ( x_part <= x_max ) & ( y_part >= y_min ) & ( y_part <= y_max )
+        return x_part[ inside ][ ::int(step) ], y_part[ inside ][ ::int(step) ], z_part[ inside ][ ::int(step) ]
+
+#########################################
+#  Cache class
+#########################################
+
+class PointCache:
+    """Directory with one entry of points per individual model and edition; least recently used entries are evicted"""
+
+    def __init__ ( self, cache_dir = POINT_CACHE_DIR, max_bytes = POINT_CACHE_MAX_BYTES ) :
+        self.cache_dir    = cache_dir
+        self.max_bytes    = int(max_bytes)
+        self.open_entries = {} # entries handed out by this cache per entry directory; closed before their directory is removed
+
+    def open_entry ( self, entry_dir, meta ) :
+        """Function to open entry and register it as open"""
+        entry = PointCacheEntry( entry_dir, meta )
+        self.open_entries[ entry_dir ] = entry
+        return entry
+
+    def remove_entry ( self, entry_dir ) :
+        """Function to close open entry and remove its directory; returns False when directory could not be removed"""
+        if entry_dir in self.open_entries :
+            self.open_entries.pop( entry_dir ).close()
+        try :
+            shutil.rmtree( entry_dir )
+        except Exception, err:
+            logger.warning( "Removing cache entry " + str(entry_dir) + " failed: ERROR: " + str(err) )
+            return False
+        return True
+
+    def entry_dir ( self, instance_id, edition ) :
+        """Function to get directory of entry of individual model and edition"""
+        key = hashlib.md5( json.dumps( [ str(instance_id), str(edition) ] ) ).hexdigest()
+        return os.path.join( self.cache_dir, key )
+
+    def get ( self, instance_id, edition, modified ) :
+        """Function to get cached points; returns None when points are not in cache or were modified after caching"""
+        entry_dir = self.entry_dir( instance_id, edition )
+        meta_file = os.path.join( entry_dir, ENTRY_META )
+        if not os.path.exists( meta_file ) :
+            return None
+        try :
+            fIn = open( meta_file, 'r' )
+            try :
+                meta = json.load( fIn )
+            finally :
+                fIn.close()
+            if meta[ 'modified' ] <> modified :
+                logger.info( "Cached points of " + str(instance_id) + " are outdated" )
+                self.remove_entry( entry_dir )
+                return None
+            entry = self.open_entry( entry_dir, meta )
+            # Last access time for eviction is kept in modification time of meta file
+            os.utime( meta_file, None )
+        except Exception, err:
+            logger.warning( "Reading cached points of " + str(instance_id) + " failed: ERROR: " + str(err) )
+            return None
+        logger.info( str(meta[ 'nrofpoints' ]) + " points of " + str(instance_id) + " found in cache" )
+        return entry
+
+    def put ( self, instance_id, edition, modified, x, y, z ) :
+        """Function to store points in cache sorted on cell of grid index; returns cache entry"""
+        return self.put_batches( instance_id, edition, modified, [ ( x, y, z ) ] )
+
+    def put_batches ( self, instance_id, edition, modified, batches, sort_batch_size = SORT_BATCH_SIZE ) :
+        """Function to store batches of arrays of x, y and z in cache sorted on cell of grid index; points are streamed through files, so they are never all in memory"""
+        if not os.path.isdir( self.cache_dir ) :
+            os.makedirs( self.cache_dir )
+
+        # Entry is written in temporary directory and renamed; the directory is removed when the write fails or is interrupted,
+        # e.g. by an error of the database while batches are fetched, so it does not stay in the cache unseen by eviction
+        temp_dir = tempfile.mkdtemp( dir = self.cache_dir )
+        try :
+            meta = self.write_entry( temp_dir, batches, sort_batch_size )
+            meta[ 'instance_id' ] = str(instance_id)
+            meta[ 'edition' ]     = str(edition)
+            meta[ 'modified' ]    = modified
+            fOut = open( os.path.join( temp_dir, ENTRY_META ), 'w' )
+            try :
+                json.dump( meta, fOut )
+            finally :
+                fOut.close()
+            entry_dir = self.entry_dir( instance_id, edition )
+            if os.path.isdir( entry_dir ) :
+                self.remove_entry( entry_dir )
+            os.rename( temp_dir, entry_dir )
+        except :
+            shutil.rmtree( temp_dir, True )
+            raise
+        logger.info( str(meta[ 'nrofpoints' ]) + " points of " + str(instance_id) + " stored in cache" )
+        self.evict( entry_dir )
+        return self.open_entry( entry_dir, meta )
+
+    def write_entry ( self, temp_dir, batches, sort_batch_size = SORT_BATCH_SIZE ) :
+        """Function to write column and index files of batches of points in directory of entry; returns meta data without key"""
+        raw_files = [ os.path.join( temp_dir, column + RAW_EXTENSION ) for column in POINT_COLUMNS ]
+
+        # Write batches to raw column files and keep extent
+        nr_points = 0
+        extent    = [ numpy.inf, -numpy.inf, numpy.inf, -numpy.inf, numpy.inf, -numpy.inf ]
+        raw_outs  = [ open( raw_file, 'wb' ) for raw_file in raw_files ]
+        try :
+            for batch in batches :
+                for k, values in enumerate( batch ) :
+                    values = numpy.asarray( values, numpy.float64 )
+                    values.tofile( raw_outs[k] )
+                    if len(values) > 0 :
+                        extent[ 2 * k ]     = min( extent[ 2 * k ], float( values.min() ) )
+                        extent[ 2 * k + 1 ] = max( extent[ 2 * k + 1 ], float( values.max() ) )
+                nr_points = nr_points + len( batch[0] )
+        finally :
+            for raw_out in raw_outs :
+                raw_out.close()
+        if nr_points == 0 :
+            extent = [ 0.0, 0.0, 0.0, 0.0, 0.0, 0.0 ]
+
+        # Grid index of square cells over extent of points
+        cell_size = max( extent[1] - extent[0], extent[3] - extent[2] ) / INDEX_CELLS
+        if cell_size <= 0.0 :
+            cell_size = 1.0
+        nr_cols  = int( ( extent[1] - extent[0] ) / cell_size ) + 1
+        nr_rows  = int( ( extent[3] - extent[2] ) / cell_size ) + 1
+        nr_cells = nr_rows * nr_cols
+        if nr_points > 0 :
+            raw = [ numpy.memmap( raw_file, dtype = numpy.float64, mode = 'r', shape = ( nr_points, ) ) for raw_file in raw_files ]
+        else :
+            raw = [ numpy.empty( 0, numpy.float64 ) for raw_file in raw_files ]
+
+        def batch_cells ( start, end ) :
+            return ( ( raw[1][ start:end ] - extent[2] ) / cell_size ).astype( numpy.int64 ) * nr_cols + ( ( raw[0][ start:end ] - extent[0] ) / cell_size ).astype( numpy.int64 )
+
+        # Offsets of cells from number of points per cell
+        counts = numpy.zeros( nr_cells, numpy.int64 )
+        for start in range( 0, nr_points, int(sort_batch_size) ) :
+            counts += numpy.bincount( batch_cells( start, start + int(sort_batch_size) ), minlength = nr_cells )
+        offsets = numpy.concatenate( ( [ 0 ], numpy.cumsum( counts ) ) ).astype( numpy.int64 )
+
+        # Points are placed after the points of their cell of earlier batches, so order within a cell is kept (stable sort)
+        if nr_points > 0 :
+            columns = [ numpy.lib.format.open_memmap( os.path.join( temp_dir, column + ".npy" ), mode = 'w+', dtype = numpy.float64, shape = ( nr_points, ) ) for column in POINT_COLUMNS ]
+            next_free = offsets[:-1].copy()
+            for start in range( 0, nr_points, int(sort_batch_size) ) :
+                cells        = batch_cells( start, start + int(sort_batch_size) )
+                order        = numpy.argsort( cells, kind = 'mergesort' )
+                sorted_cells = cells[ order ]
+                starts       = numpy.flatnonzero( numpy.concatenate( ( [ True ], sorted_cells[1:] <> sorted_cells[:-1] ) ) )
+                run_lengths  = numpy.diff( numpy.concatenate( ( starts, [ len(cells) ] ) ) )
+                positions    = next_free[ sorted_cells ] + numpy.arange( len(cells) ) - numpy.repeat( starts, run_lengths )
+                for k in range(len(columns)) :
+                    columns[k][ positions ] = raw[k][ start:start + int(sort_batch_size) ][ order ]
+                next_free[ sorted_cells[ starts ] ] += run_lengths
+            for column in columns :
+                column.flush()
+            columns = None
+        else :
+            for column in POINT_COLUMNS :
+                numpy.save( os.path.join( temp_dir, column + ".npy" ), numpy.empty( 0, numpy.float64 ) )
+        raw = None
+        for raw_file in raw_files :
+            os.remove( raw_file )
+        numpy.save( os.path.join( temp_dir, INDEX_OFFSETS + ".npy" ), offsets )
+
+        return { 'nrofpoints'  : nr_points
+               , 'extent'      : extent
+               , 'index'       : { 'x_origin' : extent[0], 'y_origin' : extent[2], 'cell_size' : cell_size, 'nr_cols' : nr_cols, 'nr_rows' : nr_rows } }
+
+    def evict ( self, keep_dir = None ) :
+        """Function to remove least recently used entries until cache fits in maximum size; entry in keep_dir is not removed"""
+        entries = []
+        for name in os.listdir( self.cache_dir ) :
+            entry_dir = os.path.join( self.cache_dir, name )
+            meta_file = os.path.join( entry_dir, ENTRY_META )
+            if os.path.isdir( entry_dir ) and os.path.exists( meta_file ) :
+                size = sum( [ os.path.getsize( os.path.join( entry_dir, file_name ) ) for file_name in os.listdir( entry_dir ) ] )
+                entries.append( ( os.path.getmtime( meta_file ), size, entry_dir ) )
+        entries.sort()
+        total_bytes = sum( [ size for mtime, size, entry_dir in entries ] )
+        for mtime, size, entry_dir in entries :
+            if total_bytes <= self.max_bytes :
+                break
+            if entry_dir == keep_dir :
+                continue
+            if self.remove_entry( entry_dir ) :
+                total_bytes = total_bytes - size
+                logger.debug( "Cache entry " + entry_dir + " evicted" )
+
+    def clear ( self ) :
+        """Function to remove all cache entries"""
+        if os.path.isdir( self.cache_dir ) :
+            for name in os.listdir( self.cache_dir ) :
+                if os.path.isdir( os.path.join( self.cache_dir, name ) ) :
+                    self.remove_entry( os.path.join( self.cache_dir, name ) )
+
+#########################################
+#  Check functions
+#########################################
+
+def check_point_cache ( nr_points, batch_size ) :
+    """Function to check order of cached points against stable sort on cell and that an interrupted write leaves no files"""
+    x = numpy.random.uniform( 2.0, 4.0, nr_points )
+    y = numpy.random.uniform( 50.0, 54.0, nr_points )
+    z = numpy.random.uniform( -50.0, 0.0, nr_points )
+    cache = PointCache( tempfile.mkdtemp(), POINT_CACHE_MAX_BYTES )
+    try :
+        entry = cache.put_batches( 1, 1, None, ( ( x[ k:k + batch_size ], y[ k:k + batch_size ], z[ k:k + batch_size ] ) for k in range( 0, nr_points, batch_size ) ), batch_size )
+        index = entry.meta[ 'index' ]
+        cells = ( ( y - index[ 'y_origin' ] ) / index[ 'cell_size' ] ).astype( numpy.int64 ) * index[ 'nr_cols' ] + ( ( x - index[ 'x_origin' ] ) / index[ 'cell_size' ] ).astype( numpy.int64 )
+        order = numpy.argsort( cells, kind = 'mergesort' )
+        if not ( numpy.array_equal( entry.columns[ 'x' ][:], x[ order ] ) and numpy.array_equal( entry.columns[ 'z' ][:], z[ order ] ) ) :
+            raise ValueError( "Cached points differ from reference" )
+        entry.close()
+
+        # Fetch fails after first batch, e.g. by an error of the database
+        def failing_batches () :
+            yield x[ 0:batch_size ], y[ 0:batch_size ], z[ 0:batch_size ]
+            raise IOError( "Fetch of points interrupted" )
+        entries = sorted( os.listdir( cache.cache_dir ) )
+        try :
+            cache.put_batches( 2, 1, None, failing_batches(), batch_size )
+        except IOError :
+            pass
+        else :
+            raise ValueError( "Interrupted write of points did not fail" )
+        if sorted( os.listdir( cache.cache_dir ) ) <> entries or cache.get( 2, 1, None ) is not None :
+            raise ValueError( "Interrupted write of points left files in cache" )
+        logger.info( "Cached points equal to reference and interrupted write left no files" )
+    finally :
+        cache.clear()
+        shutil.rmtree( cache.cache_dir, True )
+
+####################################
+# Start main program
+####################################
+
+if __name__ == "__main__":
+
+    # Initialize logger
+    logger.setLevel( logging.INFO )
+    stream_hdlr = logging.StreamHandler()
+    formatter   = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    stream_hdlr.setFormatter(formatter)
+    logger.addHandler(stream_hdlr)
+
+    # Check: IM_pointcache.py [number of points] [batch size]
+    nr_points  = 1000000
+    batch_size = 100000
+    if len(sys.argv) > 1 :
+        nr_points = int(sys.argv[1])
+    if len(sys.argv) > 2 :
+        batch_size = int(sys.argv[2])
+    check_point_cache( nr_points, batch_size )
@@ -0,0 +1,185 @@
+#! /usr/bin/python
+
+""" Functions to read points of individual models from the database as NumPy arrays; subsampling and extent are done by the database
+"""
+
+# Standard library imports
+import os
+import sys
+import time
+import logging
+import tempfile
+
+# Related third party imports
+import numpy
+
+# Module name
+MODULE_NAME = "IM points"
+
+# Number of rows fetched from the database at once
+FETCH_ARRAYSIZE = 100000
+
+# Expression of row number in subquery of points; Oracle has rownum and other databases the ANSI window function
+ROW_NUMBER_ORACLE = "rownum"
+ROW_NUMBER_ANSI   = "row_number() over ()"
+
+# Bind variable of sample step
+STEP_BIND = "STEP"
+
+# Keys of extent of points
+EXTENT_MINX   = "minx"
+EXTENT_MAXX   = "maxx"
+EXTENT_MINY   = "miny"
+EXTENT_MAXY   = "maxy"
+EXTENT_MINZ   = "minz"
+EXTENT_MAXZ   = "maxz"
+EXTENT_POINTS = "nrofpoints"
+
+# Logger
+logger = logging.getLogger( MODULE_NAME )
+
+#########################################
+#  Statement functions
+#########################################
+
+def sample_step ( nr_of_points, max_nr_of_points ) :
+    """Function to get step of subsampling to read about the maximum number of points"""
+    if int(nr_of_points) > int(max_nr_of_points) :
+        return max( int( round( float(nr_of_points) / float(max_nr_of_points) ) ), 1 )
+    return 1
+
+def sample_statement ( stmt, step, row_number = ROW_NUMBER_ORACLE ) :
+    """Function to wrap statement with columns x, y and z so the database returns the first point of every step points"""
+    if int(step) <= 1 :
+        return stmt
+    return "select x, y, z from ( select p.x, p.y, p.z, " + row_number + " as point_nr from ( " + stmt + " ) p ) where mod( point_nr - 1, :" + STEP_BIND + " ) = 0"
+
+def sample_parameters ( parameters, step ) :
+    """Function to add sample step to bind variables of statement"""
+    parameters = dict( parameters )
+    if int(step) > 1 :
+        parameters[ STEP_BIND ] = int(step)
+    return parameters
+
+#########################################
+#  Read functions
+#########################################
+
+def points_extent ( x, y, z ) :
+    """Function to get extent and number of points of arrays of x, y and z"""
+    extent = {}
+    extent[ EXTENT_POINTS ] = len(z)
+    if extent[ EXTENT_POINTS ] == 0 :
+        return extent
+    for key, values, function in [ ( EXTENT_MINX, x, numpy.min ), ( EXTENT_MAXX, x, numpy.max ), ( EXTENT_MINY, y, numpy.min ), ( EXTENT_MAXY, y, numpy.max ), ( EXTENT_MINZ, z, numpy.min ), ( EXTENT_MAXZ, z, numpy.max ) ] :
+        extent[ key ] = float( function( values ) )
+    return extent
+
+def read_point_extent ( cursor, stmt, parameters, step = 1, row_number = ROW_NUMBER_ORACLE ) :
+    """Function to get extent and number of (sampled) points of statement with columns x, y and z from the database"""
+    # Sampling without order by may select other rows in another execution; extent of points read with read_points is taken with points_extent
+    extent_stmt = "select min(x), max(x), min(y), max(y), min(z), max(z), count(*) from ( " + sample_statement( stmt, step, row_number ) + " )"
+    cursor.execute( extent_stmt, sample_parameters( parameters, step ) )
+    row = cursor.fetchone()
+    extent = {}
+    extent[ EXTENT_POINTS ] = int(row[6])
+    if extent[ EXTENT_POINTS ] == 0 :
+        return extent
+    for k, key in enumerate( [ EXTENT_MINX, EXTENT_MAXX, EXTENT_MINY, EXTENT_MAXY, EXTENT_MINZ, EXTENT_MAXZ ] ) :
+        extent[ key ] = float(row[k])
+    return extent
+
+def read_point_batches ( cursor, stmt, parameters, step = 1, arraysize = FETCH_ARRAYSIZE, row_number = ROW_NUMBER_ORACLE ) :
+    """Generator of arrays of x, y and z of each batch of (sampled) points fetched from statement with columns x, y and z"""
+    cursor.arraysize = int(arraysize)
+    cursor.execute( sample_statement( stmt, step, row_number ), sample_parameters( parameters, step ) )
+    while 1 :
+        resultset = cursor.fetchmany()
+        if not resultset :
+            break
+        points = numpy.array( resultset, numpy.float64 ).reshape( -1, 3 )
+        yield points[ :, 0 ].copy(), points[ :, 1 ].copy(), points[ :, 2 ].copy()
+
+def read_points ( cursor, stmt, parameters, step = 1, arraysize = FETCH_ARRAYSIZE, row_number = ROW_NUMBER_ORACLE ) :
+    """Function to read (sampled) points of statement with columns x, y and z; returns arrays of x, y and z"""
+    cursor.arraysize = int(arraysize)
+    cursor.execute( sample_statement( stmt, step, row_number ), sample_parameters( parameters, step ) )
+    batches = []
+    while 1 :
+        resultset = cursor.fetchmany()
+        if not resultset :
+            break
+        batches.append( numpy.array( resultset, numpy.float64 ).reshape( -1, 3 ) )
+    if batches :
+        points = numpy.concatenate( batches )
+    else :
+        points = numpy.empty( ( 0, 3 ), numpy.float64 )
+    logger.info( str(len(points)) + " points read from database" )
+    return points[ :, 0 ].copy(), points[ :, 1 ].copy(), points[ :, 2 ].copy()
+
+#########################################
+#  Stand-in database functions
+#########################################
+
+def create_sqlite_pointstore ( database_file, instance_id, nr_points ) :
+    """Function to create stand-in of points of individual model in SQLite database"""
+    import sqlite3
+    connection = sqlite3.connect( database_file )
+    connection.execute( "drop table if exists sdb_points" )
+    connection.execute( "create table sdb_points ( instance_id integer, x real, y real, z real )" )
+    points = numpy.random.uniform( 0.0, 1.0, ( nr_points, 3 ) ) * [ 2.0, 4.0, -50.0 ] + [ 2.0, 50.0, 0.0 ]
+    connection.executemany( "insert into sdb_points values ( ?, ?, ?, ? )", [ ( instance_id, float(p[0]), float(p[1]), float(p[2]) ) for p in points ] )
+    connection.commit()
+    connection.close()
+
+def benchmark ( nr_points, max_nr_of_points ) :
+    """Function to compare sampled points and extent read from SQLite stand-in database with sampling in Python"""
+    import sqlite3
+    work_dir      = tempfile.mkdtemp()
+    database_file = os.path.join( work_dir, "points.db" )
+    instance_id   = 1
+    logger.info( "Generate stand-in database with " + str(nr_points) + " points in " + work_dir )
+    create_sqlite_pointstore( database_file, instance_id, nr_points )
+    connection = sqlite3.connect( database_file )
+    cursor     = connection.cursor()
+    stmt       = "select x, y, z from sdb_points where instance_id = :ID order by rowid"
+    parameters = { 'ID' : instance_id }
+    step       = sample_step( nr_points, max_nr_of_points )
+
+    start_time = time.time()
+    x, y, z = read_points( cursor, stmt, parameters, step, FETCH_ARRAYSIZE, ROW_NUMBER_ANSI )
+    extent  = points_extent( x, y, z )
+    logger.info( "Step: " + str(step) + ", points: " + str(len(x)) + ", time: " + str(round(time.time() - start_time, 2)) + " s" )
+
+    # Reference: all points over the wire and every step-th point kept
+    cursor.execute( stmt, parameters )
+    reference = numpy.array( cursor.fetchall(), numpy.float64 )[ ::step ]
+    connection.close()
+    if not ( numpy.array_equal( reference[:,0], x ) and numpy.array_equal( reference[:,1], y ) and numpy.array_equal( reference[:,2], z ) ) :
+        raise ValueError( "Sampled points differ from reference" )
+    if extent[ EXTENT_POINTS ] <> len(x) or extent[ EXTENT_MINZ ] <> reference[:,2].min() or extent[ EXTENT_MAXX ] <> reference[:,0].max() :
+        raise ValueError( "Extent differs from reference" )
+    logger.info( "Sampled points and extent equal to reference" )
+    return extent
+
+####################################
+# Start main program
+####################################
+
+if __name__ == "__main__":
+
+    # Initialize logger
+    logger.setLevel( logging.INFO )
+    stream_hdlr = logging.StreamHandler()
+    formatter   = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    stream_hdlr.setFormatter(formatter)
+    logger.addHandler(stream_hdlr)
+
+    # Benchmark: IM_points.py [number of points] [maximum number of points]
+    nr_points        = 1000000
+    max_nr_of_points = 50000
+    if len(sys.argv) > 1 :
+        nr_points = int(sys.argv[1])
+    if len(sys.argv) > 2 :
+        max_nr_of_points = int(sys.argv[2])
+    benchmark( nr_points, max_nr_of_points )
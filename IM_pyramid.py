@@ -0,0 +1,171 @@
+#! /usr/bin/python
+
+""" Level of detail pyramid of points of individual models; each level keeps number, mean, minimum and maximum depth per cell
+"""
+
+# Standard library imports
+import os
+import json
+import math
+import shutil
+import logging
+
+# Related third party imports
+import numpy
+
+# Module name
+MODULE_NAME = "IM pyramid"
+
+# Default directory of pyramids
+PYRAMID_DIR = os.path.join( os.path.expanduser("~"), ".im_pyramid" )
+
+# Name of index file and extension of level files in directory of pyramid
+PYRAMID_INDEX   = "index.json"
+LEVEL_EXTENSION = ".npy"
+
+# Levels are added until a level has no more than this number of points
+PYRAMID_MIN_POINTS = 10000
+
+# Maximum number of levels
+PYRAMID_MAX_LEVELS = 24
+
+# Columns of points of a level
+LEVEL_X     = 0
+LEVEL_Y     = 1
+LEVEL_COUNT = 2
+LEVEL_MEAN  = 3
+LEVEL_MIN   = 4
+LEVEL_MAX   = 5
+LEVEL_NR_COLUMNS = 6
+
+# Logger
+logger = logging.getLogger( MODULE_NAME )
+
+#########################################
+#  Aggregation functions
+#########################################
+
+def aggregate_cells ( x, y, count, total, z_min, z_max, x_origin, y_origin, gridsize, nr_cols ) :
+    """Function to aggregate (points of) cells into cells of gridsize; returns array of points sorted on row and column of cell"""
+    cols = numpy.floor( ( x - x_origin ) / gridsize ).astype( numpy.int64 )
+    rows = numpy.floor( ( y - y_origin ) / gridsize ).astype( numpy.int64 )
+    keys = rows * int(nr_cols) + cols
+
+    # Reduce runs of points sorted on cell
+    order       = numpy.argsort( keys, kind = 'mergesort' )
+    sorted_keys = keys[ order ]
+    starts      = numpy.flatnonzero( numpy.concatenate( ( [ True ], sorted_keys[1:] <> sorted_keys[:-1] ) ) )
+    cells       = sorted_keys[ starts ]
+
+    level = numpy.empty( ( len(cells), LEVEL_NR_COLUMNS ), numpy.float64 )
+    level[ :, LEVEL_X ]     = x_origin + ( cells % int(nr_cols) + 0.5 ) * gridsize
+    level[ :, LEVEL_Y ]     = y_origin + ( cells // int(nr_cols) + 0.5 ) * gridsize
+    level[ :, LEVEL_COUNT ] = numpy.add.reduceat( count[ order ], starts )
+    level[ :, LEVEL_MEAN ]  = numpy.add.reduceat( total[ order ], starts ) / level[ :, LEVEL_COUNT ]
+    level[ :, LEVEL_MIN ]   = numpy.minimum.reduceat( z_min[ order ], starts )
+    level[ :, LEVEL_MAX ]   = numpy.maximum.reduceat( z_max[ order ], starts )
+    return level
+
+#########################################
+#  Pyramid class
+#########################################
+
+class PointPyramid:
+    """Directory with one file of points per level of detail; level 0 has the base gridsize and each next level doubles the gridsize"""
+
+    def __init__ ( self, pyramid_dir ) :
+        self.pyramid_dir = pyramid_dir
+        self.index       = None
+
+    def level_file ( self, level ) :
+        """Function to get name of file of level"""
+        return os.path.join( self.pyramid_dir, "level_" + str(level) + LEVEL_EXTENSION )
+
+    def read_index ( self ) :
+        """Function to read index of pyramid; returns None when there is no pyramid"""
+        index_file = os.path.join( self.pyramid_dir, PYRAMID_INDEX )
+        if not os.path.exists( index_file ) :
+            return None
+        fIn = open( index_file, 'r' )
+        try :
+            self.index = json.load( fIn )
+        finally :
+            fIn.close()
+        return self.index
+
+    def is_valid ( self, source ) :
+        """Function to check if pyramid exists and was built from source with same properties"""
+        try :
+            index = self.read_index()
+        except Exception, err:
+            logger.warning( "Reading index of pyramid " + str(self.pyramid_dir) + " failed: ERROR: " + str(err) )
+            return False
+        return index is not None and index[ 'source' ] == source
+
+    def build ( self, x, y, z, gridsize, source, min_points = PYRAMID_MIN_POINTS, max_levels = PYRAMID_MAX_LEVELS ) :
+        """Function to build levels of pyramid from points; source identifies the points to detect when pyramid is outdated"""
+        x = numpy.asarray( x, numpy.float64 )
+        y = numpy.asarray( y, numpy.float64 )
+        z = numpy.asarray( z, numpy.float64 )
+        if len(z) == 0 :
+            raise ValueError( "No points to build pyramid" )
+        if os.path.isdir( self.pyramid_dir ) :
+            shutil.rmtree( self.pyramid_dir )
+        os.makedirs( self.pyramid_dir )
+
+        # Points of each level are aggregated from cells of previous level with same origin
+        x_origin = float( x.min() )
+        y_origin = float( y.min() )
+        gridsize = float( gridsize )
+        levels   = []
+        level    = None
+        while len(levels) < int(max_levels) :
+            nr_cols = int( math.floor( ( float( x.max() ) - x_origin ) / gridsize ) ) + 1
+            if level is None :
+                level = aggregate_cells( x, y, numpy.ones( len(z) ), z, z, z, x_origin, y_origin, gridsize, nr_cols )
+            else :
+                level = aggregate_cells( level[ :, LEVEL_X ], level[ :, LEVEL_Y ], level[ :, LEVEL_COUNT ], level[ :, LEVEL_MEAN ] * level[ :, LEVEL_COUNT ]
+                                       , level[ :, LEVEL_MIN ], level[ :, LEVEL_MAX ], x_origin, y_origin, gridsize, nr_cols )
+            numpy.save( self.level_file( len(levels) ), level )
+            levels.append( { 'gridsize' : gridsize, 'nrofpoints' : len(level) } )
+            logger.info( "Level " + str(len(levels) - 1) + ": gridsize " + str(gridsize) + ", " + str(len(level)) + " points" )
+            if len(level) <= int(min_points) :
+                break
+            gridsize = gridsize * 2.0
+
+        # Index is written last, so an interrupted build is not valid
+        self.index = { 'source' : source
+                     , 'extent' : [ x_origin, float( x.max() ), y_origin, float( y.max() ), float( z.min() ), float( z.max() ) ]
+                     , 'levels' : levels }
+        fOut = open( os.path.join( self.pyramid_dir, PYRAMID_INDEX ), 'w' )
+        try :
+            json.dump( self.index, fOut )
+        finally :
+            fOut.close()
+        return self.index
+
+    def select_level ( self, x_min, x_max, y_min, y_max, width_pixels, height_pixels, max_points = None ) :
+        """Function to get coarsest level with cells not larger than a pixel of extent shown in width x height pixels; coarser levels are taken until level has no more than max_points"""
+        pixel_size = max( ( x_max - x_min ) / float(width_pixels), ( y_max - y_min ) / float(height_pixels) )
+        levels     = self.index[ 'levels' ]
+        selected   = 0
+        for k, level in enumerate( levels ) :
+            if level[ 'gridsize' ] <= pixel_size :
+                selected = k
+        if max_points is not None :
+            while selected < len(levels) - 1 and levels[ selected ][ 'nrofpoints' ] > int(max_points) :
+                selected = selected + 1
+        return selected
+
+    def read_level ( self, level, x_min = None, x_max = None, y_min = None, y_max = None ) :
+        """Function to get points of level within extent; level file is memory mapped and points are sorted on y"""
+        points = numpy.load( self.level_file( level ), mmap_mode = 'r' )
+        if y_min is not None and y_max is not None :
+            half  = self.index[ 'levels' ][ level ][ 'gridsize' ] / 2.0
+            start = numpy.searchsorted( points[ :, LEVEL_Y ], y_min - half, 'left' )
+            end   = numpy.searchsorted( points[ :, LEVEL_Y ], y_max + half, 'right' )
+            points = points[ start:end ]
+        if x_min is not None and x_max is not None :
+            half   = self.index[ 'levels' ][ level ][ 'gridsize' ] / 2.0
+            points = points[ ( points[ :, LEVEL_X ] >= x_min - half ) & ( points[ :, LEVEL_X ] <= x_max + half ) ]
+        return numpy.array( points )
@@ -0,0 +1,127 @@
+#! /usr/bin/python
+
+""" Functions to export a gridded raster in blocks of rows to Esri ascii grid, binary geotif and RGBA geotif
+"""
+
+# Standard library imports
+import logging
+
+# GDAL/OGR imports
+from osgeo import gdal
+from osgeo import gdalconst
+
+# Local imports
+from IM_colormap import apply_lut
+
+# Module name
+MODULE_NAME = "IM raster"
+
+# Raster formats
+RASTER_AAIGRID = "AAIGrid"
+RASTER_GTIFF   = "GTiff"
+RASTER_RGBA    = "RGBA"
+RASTER_FORMATS = [ RASTER_AAIGRID, RASTER_GTIFF, RASTER_RGBA ]
+
+# File extensions of raster formats
+RASTER_EXTENSIONS = { RASTER_AAIGRID : ".asc"
+                    , RASTER_GTIFF   : ".tif"
+                    , RASTER_RGBA    : "_RGBA.tif" }
+
+# Number of raster rows read from the grid and written at once
+RASTER_BLOCK_ROWS = 256
+
+# Create options of geotifs: tiled and compressed, switching to BigTIFF for files over 4GB
+GTIFF_CREATE_OPTIONS = [ 'TILED=YES'
+                       , 'BLOCKXSIZE=256'
+                       , 'BLOCKYSIZE=256'
+                       , 'COMPRESS=DEFLATE'
+                       , 'BIGTIFF=IF_SAFER' ]
+
+# Logger
+logger = logging.getLogger( MODULE_NAME )
+
+#########################################
+#  Raster functions
+#########################################
+
+def create_gtiff ( file_out, nr_rows, nr_cols, nr_bands, data_type, geo_transform, projection_wkt, create_options ) :
+    """Function to create tiled and compressed geotif"""
+    driver  = gdal.GetDriverByName( RASTER_GTIFF )
+    dataset = driver.Create( file_out, int(nr_cols), int(nr_rows), int(nr_bands), data_type, GTIFF_CREATE_OPTIONS + create_options )
+    if dataset is None :
+        raise IOError( "Creating geotif " + str(file_out) + " failed" )
+    dataset.SetGeoTransform( geo_transform )
+    dataset.SetProjection( projection_wkt )
+    return dataset
+
+def write_rasters ( base_name, read_rows, nr_rows, nr_cols, geo_transform, projection_wkt, nodata_value, formats = RASTER_FORMATS
+                  , z_min = None, z_max = None, lut = None, block_rows = RASTER_BLOCK_ROWS, progress = None ) :
+    """Function to write raster formats from read_rows( row_start, row_end ) in blocks of rows; returns dictionary of written files per format"""
+    for raster_format in formats :
+        if raster_format not in RASTER_FORMATS :
+            raise ValueError( "Unknown raster format: " + str(raster_format) )
+    if RASTER_RGBA in formats and lut is None :
+        raise ValueError( "Lookup table needed for RGBA geotif" )
+    files_out = {}
+
+    # Esri ascii grid can only be copied, so it is copied from the binary geotif; a temporary one if no geotif is requested
+    write_gtiff   = RASTER_GTIFF in formats or RASTER_AAIGRID in formats
+    file_gtiff    = str(base_name) + RASTER_EXTENSIONS[ RASTER_GTIFF ]
+    gtiff_options = [ 'TFW=YES' ]
+    if RASTER_GTIFF not in formats :
+        file_gtiff    = str(base_name) + "_tmp" + RASTER_EXTENSIONS[ RASTER_GTIFF ]
+        gtiff_options = []
+
+    gtiff_ds   = None
+    gtiff_band = None
+    rgba_ds    = None
+    if write_gtiff :
+        logger.info( "Generate binary geotif " + str(file_gtiff) )
+        gtiff_ds   = create_gtiff( file_gtiff, nr_rows, nr_cols, 1, gdalconst.GDT_Float32, geo_transform, projection_wkt, gtiff_options )
+        gtiff_band = gtiff_ds.GetRasterBand(1)
+        gtiff_band.SetNoDataValue( nodata_value )
+    if RASTER_RGBA in formats :
+        file_rgba = str(base_name) + RASTER_EXTENSIONS[ RASTER_RGBA ]
+        logger.info( "Generate RGBA geotif " + str(file_rgba) )
+        # Fourth band is alpha, so nodata cells are transparent
+        rgba_ds = create_gtiff( file_rgba, nr_rows, nr_cols, 4, gdalconst.GDT_Byte, geo_transform, projection_wkt, [ 'ALPHA=YES' ] )
+        rgba_ds.GetRasterBand(4).SetColorInterpretation( gdal.GCI_AlphaBand )
+
+    # Read each block of rows once from the grid and write it to all rasters
+    for row_start in range( 0, int(nr_rows), int(block_rows) ) :
+        row_end = min( row_start + int(block_rows), int(nr_rows) )
+        block   = read_rows( row_start, row_end )
+        if gtiff_band is not None :
+            gtiff_band.WriteArray( block, 0, row_start )
+        if rgba_ds is not None :
+            bands = apply_lut( block, lut, z_min, z_max, nodata_value, block_rows )
+            for band in range(4) :
+                rgba_ds.GetRasterBand( band + 1 ).WriteArray( bands[ band ], 0, row_start )
+        if progress is not None :
+            progress( float(row_end) / nr_rows )
+
+    if rgba_ds is not None :
+        rgba_ds.FlushCache()
+        rgba_ds = None
+        files_out[ RASTER_RGBA ] = file_rgba
+        logger.info( "Generate RGBA geotif completed" )
+
+    if gtiff_ds is not None :
+        gtiff_band.FlushCache()
+        gtiff_band = None
+        if RASTER_AAIGRID in formats :
+            file_aaigrid = str(base_name) + RASTER_EXTENSIONS[ RASTER_AAIGRID ]
+            logger.info( "Generate Esri Ascii grid " + str(file_aaigrid) )
+            driver     = gdal.GetDriverByName( RASTER_AAIGRID )
+            aaigrid_ds = driver.CreateCopy( file_aaigrid, gtiff_ds )
+            aaigrid_ds = None
+            files_out[ RASTER_AAIGRID ] = file_aaigrid
+            logger.info( "Generate Esri Ascii grid completed" )
+        gtiff_ds = None
+        if RASTER_GTIFF in formats :
+            files_out[ RASTER_GTIFF ] = file_gtiff
+            logger.info( "Generate binary geotif completed" )
+        else :
+            gdal.GetDriverByName( RASTER_GTIFF ).Delete( file_gtiff )
+
+    return files_out
@@ -0,0 +1,320 @@
+#! /usr/bin/python
+
+""" Functions to simplify lines and rings of OGR geometries with NumPy
+"""
+
+# Standard library imports
+import math
+import heapq
+import struct
+import logging
+
+# Related third party imports
+import numpy
+
+# GDAL/OGR imports
+from osgeo import ogr
+
+# Module name
+MODULE_NAME = "IM simplify"
+
+# Minimum number of points of simplified ring; three vertices and the closing point
+MIN_RING_POINTS = 4
+
+# Well known binary: little endian byte order and geometry types
+WKB_NDR             = 1
+WKB_LINESTRING      = 2
+WKB_POLYGON         = 3
+WKB_MULTILINESTRING = 5
+WKB_MULTIPOLYGON    = 6
+
+# Logger
+logger = logging.getLogger( MODULE_NAME )
+
+#########################################
+#  Douglas-Peucker functions
+#########################################
+
+def segment_distances ( points, anchor, floater ) :
+    """Function to get distances of points to segment from anchor to floater"""
+    segment = floater - anchor
+    seg_len = numpy.hypot( segment[0], segment[1] )
+    to_anchor = points - anchor
+    if seg_len == 0.0 :
+        return numpy.hypot( to_anchor[:,0], to_anchor[:,1] )
+
+    # Points before anchor or beyond floater are at distance of end point; others at perpendicular distance
+    proj = ( to_anchor[:,0] * segment[0] + to_anchor[:,1] * segment[1] ) / seg_len
+    distances = numpy.abs( to_anchor[:,0] * segment[1] - to_anchor[:,1] * segment[0] ) / seg_len
+    before = proj < 0.0
+    beyond = proj > seg_len
+    distances[ before ] = numpy.hypot( to_anchor[ before, 0 ], to_anchor[ before, 1 ] )
+    to_floater = points[ beyond ] - floater
+    distances[ beyond ] = numpy.hypot( to_floater[:,0], to_floater[:,1] )
+    return distances
+
+def douglas_peucker_mask ( points, tolerance ) :
+    """Function to get mask of points kept by Douglas-Peucker; distances of all points of a span are computed at once"""
+    nr_points = len(points)
+    keep = numpy.zeros( nr_points, bool )
+    if nr_points == 0 :
+        return keep
+    keep[0]  = True
+    keep[-1] = True
+    stack = [ ( 0, nr_points - 1 ) ]
+    while stack :
+        anchor, floater = stack.pop()
+        if floater - anchor < 2 :
+            continue
+        distances = segment_distances( points[ anchor + 1:floater ], points[ anchor ], points[ floater ] )
+        farthest  = int( numpy.argmax( distances ) )
+        if distances[ farthest ] > tolerance :
+            farthest = anchor + 1 + farthest
+            keep[ farthest ] = True
+            stack.append( ( anchor, farthest ) )
+            stack.append( ( farthest, floater ) )
+    return keep
+
+def simplify_points ( points, tolerance, is_ring = False ) :
+    """Function to simplify array of points; rings stay closed and keep at least three vertices or are not simplified"""
+    simplified = points[ douglas_peucker_mask( points, tolerance ) ]
+    if is_ring and len(simplified) < MIN_RING_POINTS :
+        return points
+    return simplified
+
+#########################################
+#  Visvalingam-Whyatt functions
+#########################################
+
+def triangle_areas ( previous, points, following ) :
+    """Function to get areas of triangles of points with their previous and following points"""
+    return 0.5 * numpy.abs( ( points[:,0] - previous[:,0] ) * ( following[:,1] - previous[:,1] )
+                          - ( following[:,0] - previous[:,0] ) * ( points[:,1] - previous[:,1] ) )
+
+def triangle_area ( xs, ys, a, b, c ) :
+    """Function to get area of triangle of vertices a, b and c with plain floats"""
+    return 0.5 * abs( ( xs[b] - xs[a] ) * ( ys[c] - ys[a] ) - ( xs[c] - xs[a] ) * ( ys[b] - ys[a] ) )
+
+def mean_segment_length ( points, following, vertices ) :
+    """Function to get mean length of segments from vertices to following vertices"""
+    if len(vertices) == 0 :
+        return 0.0
+    segments = points[ numpy.asarray( following )[ vertices ] ] - points[ vertices ]
+    return numpy.hypot( segments[:,0], segments[:,1] ).mean()
+
+class VertexGrid:
+    """Uniform grid of vertices to find vertices within triangles; cells about the size of a segment keep few vertices per cell also for vertices on curves"""
+
+    def __init__ ( self, xs, ys, active, cell_size ) :
+        self.xs        = xs
+        self.ys        = ys
+        self.x_min     = min( xs )
+        self.y_min     = min( ys )
+        self.cell_size = float(cell_size)
+        if not self.cell_size > 0.0 :
+            self.cell_size = max( max( xs ) - self.x_min, max( ys ) - self.y_min, 1.0 )
+        self.cells = {}
+        for vertex in numpy.flatnonzero( active ).tolist() :
+            self.cells.setdefault( self.cell( xs[ vertex ], ys[ vertex ] ), set() ).add( vertex )
+
+    def cell ( self, x, y ) :
+        """Function to get column and row of cell of point"""
+        return ( int( ( x - self.x_min ) / self.cell_size ), int( ( y - self.y_min ) / self.cell_size ) )
+
+    def remove ( self, vertex ) :
+        """Function to remove vertex from grid"""
+        self.cells[ self.cell( self.xs[ vertex ], self.ys[ vertex ] ) ].discard( vertex )
+
+    def any_in_triangle ( self, a, b, c, exclude ) :
+        """Function to check if any vertex other than exclude lies in or on triangle of vertices a, b and c"""
+        xs, ys = self.xs, self.ys
+        ax, ay, bx, by, cx, cy = xs[a], ys[a], xs[b], ys[b], xs[c], ys[c]
+        col_min, row_min = self.cell( min( ax, bx, cx ), min( ay, by, cy ) )
+        col_max, row_max = self.cell( max( ax, bx, cx ), max( ay, by, cy ) )
+        orientation = ( bx - ax ) * ( cy - ay ) - ( cx - ax ) * ( by - ay )
+        for col in range( col_min, col_max + 1 ) :
+            for row in range( row_min, row_max + 1 ) :
+                for vertex in self.cells.get( ( col, row ), () ) :
+                    if vertex in exclude :
+                        continue
+                    px, py = xs[ vertex ], ys[ vertex ]
+                    # Copies of triangle vertices in other parts (shared boundaries) do not block
+                    if ( px == ax and py == ay ) or ( px == bx and py == by ) or ( px == cx and py == cy ) :
+                        continue
+                    # Point is inside or on triangle when it is not on the outer side of any edge
+                    d1 = ( bx - ax ) * ( py - ay ) - ( px - ax ) * ( by - ay )
+                    d2 = ( cx - bx ) * ( py - by ) - ( px - bx ) * ( cy - by )
+                    d3 = ( ax - cx ) * ( py - cy ) - ( px - cx ) * ( ay - cy )
+                    if orientation >= 0.0 and d1 >= 0.0 and d2 >= 0.0 and d3 >= 0.0 :
+                        return True
+                    if orientation <= 0.0 and d1 <= 0.0 and d2 <= 0.0 and d3 <= 0.0 :
+                        return True
+        return False
+
+def visvalingam_whyatt_parts ( parts, min_area ) :
+    """Function to simplify lines and rings together with Visvalingam-Whyatt; parts are ( points, is_ring ) and simplified points are returned per part
+
+    A vertex is only removed when no other vertex of any part lies in its triangle, so the new segment crosses no other
+    segment and valid rings stay valid. Vertices shared by parts and end points of lines are never removed."""
+    # Vertices of all parts in one array; closing points of rings are left out and linked to the first vertex
+    sizes     = [ len(points) - int( is_ring and len(points) > 1 and tuple(points[0]) == tuple(points[-1]) ) for points, is_ring in parts ]
+    starts    = numpy.concatenate( ( [ 0 ], numpy.cumsum( sizes ) ) ).astype( int )
+    if starts[-1] == 0 :
+        return [ points for points, is_ring in parts ]
+    points    = numpy.concatenate( [ part_points[ 0:size ] for ( part_points, is_ring ), size in zip( parts, sizes ) if size > 0 ] )
+    previous  = numpy.arange( len(points) ) - 1
+    following = numpy.arange( len(points) ) + 1
+    fixed     = numpy.zeros( len(points), bool )
+    part_of   = numpy.zeros( len(points), int )
+    remaining = list( sizes )
+    for k, ( part_points, is_ring ) in enumerate( parts ) :
+        start, end = starts[k], starts[k+1]
+        part_of[ start:end ] = k
+        if end == start :
+            continue
+        if is_ring :
+            previous[ start ]    = end - 1
+            following[ end - 1 ] = start
+        else :
+            fixed[ start ]   = True
+            fixed[ end - 1 ] = True
+
+    # Vertices on boundaries shared by parts are fixed, so shared boundaries stay identical
+    order     = numpy.lexsort( ( points[:,1], points[:,0] ) )
+    duplicate = numpy.all( points[ order[1:] ] == points[ order[:-1] ], axis = 1 )
+    fixed[ order[1:][ duplicate ] ]  = True
+    fixed[ order[:-1][ duplicate ] ] = True
+
+    # Priority heap of triangle areas; entries of vertices whose area changed are skipped by version
+    active  = numpy.ones( len(points), bool )
+    version = numpy.zeros( len(points), int )
+    areas   = numpy.zeros( len(points) )
+    free    = ~fixed
+    areas[ free ] = triangle_areas( points[ previous[ free ] ], points[ free ], points[ following[ free ] ] )
+    heap = zip( areas[ free ].tolist(), numpy.flatnonzero( free ).tolist(), [ 0 ] * int( free.sum() ) )
+    heapq.heapify( heap )
+
+    # Vertices are looked up one by one, so coordinates and links are plain lists; grid cells are sized by mean segment length
+    linked    = numpy.ones( len(points), bool )
+    for k, ( part_points, is_ring ) in enumerate( parts ) :
+        if not is_ring and starts[k+1] > starts[k] :
+            linked[ starts[k+1] - 1 ] = False
+    xs        = points[:,0].tolist()
+    ys        = points[:,1].tolist()
+    grid      = VertexGrid( xs, ys, active, mean_segment_length( points, following, numpy.flatnonzero( linked ) ) )
+    previous  = previous.tolist()
+    following = following.tolist()
+    version   = version.tolist()
+
+    # Segments grow while vertices are removed; grid is rebuilt each time half of the vertices is gone
+    nr_active  = len(points)
+    nr_rebuild = nr_active // 2
+    while heap :
+        area, vertex, vertex_version = heapq.heappop( heap )
+        if area > min_area :
+            break
+        if not active[ vertex ] or vertex_version <> version[ vertex ] :
+            continue
+        part = part_of[ vertex ]
+        if parts[ part ][1] and remaining[ part ] <= MIN_RING_POINTS - 1 :
+            continue
+        a, c = previous[ vertex ], following[ vertex ]
+        if grid.any_in_triangle( a, vertex, c, ( a, vertex, c ) ) :
+            continue
+
+        # Remove vertex and update areas of neighbours; area is at least the removed area so order of removal is kept
+        active[ vertex ] = False
+        grid.remove( vertex )
+        remaining[ part ] = remaining[ part ] - 1
+        nr_active = nr_active - 1
+        following[ a ] = c
+        previous[ c ] = a
+        for neighbour in ( a, c ) :
+            if not fixed[ neighbour ] :
+                neighbour_area = triangle_area( xs, ys, previous[ neighbour ], neighbour, following[ neighbour ] )
+                version[ neighbour ] = version[ neighbour ] + 1
+                heapq.heappush( heap, ( max( neighbour_area, area ), int(neighbour), version[ neighbour ] ) )
+        if nr_active <= nr_rebuild :
+            grid       = VertexGrid( xs, ys, active, mean_segment_length( points, following, numpy.flatnonzero( linked & active ) ) )
+            nr_rebuild = nr_active // 2
+
+    # Remaining vertices per part in original order; rings are closed again
+    simplified = []
+    for k, ( part_points, is_ring ) in enumerate( parts ) :
+        start, end = starts[k], starts[k+1]
+        if end == start :
+            simplified.append( part_points )
+            continue
+        part = points[ start:end ][ active[ start:end ] ]
+        if is_ring :
+            part = numpy.vstack( ( part, part[ 0:1 ] ) )
+        simplified.append( part )
+    return simplified
+
+#########################################
+#  OGR geometry functions
+#########################################
+
+def geometry_points ( ogr_geom ) :
+    """Function to get points of line or ring as array of x and y"""
+    points = ogr_geom.GetPoints()
+    if not points :
+        return numpy.empty( ( 0, 2 ), numpy.float64 )
+    return numpy.array( points, numpy.float64 )[ :, 0:2 ]
+
+def wkb_points ( points ) :
+    """Function to get well known binary of number of points and coordinates"""
+    return struct.pack( '<I', len(points) ) + numpy.ascontiguousarray( points, '<f8' ).tostring()
+
+def geometry_parts ( ogr_geom ) :
+    """Function to get points of lines and rings of geometry as list of ( points, is_ring ) in order of simplify_wkb"""
+    geometry_type = ogr.GT_Flatten( ogr_geom.GetGeometryType() )
+    if geometry_type == ogr.wkbLineString :
+        return [ ( geometry_points( ogr_geom ), False ) ]
+    if geometry_type == ogr.wkbPolygon :
+        return [ ( geometry_points( ogr_geom.GetGeometryRef(k) ), True ) for k in range( ogr_geom.GetGeometryCount() ) ]
+    if geometry_type in ( ogr.wkbMultiLineString, ogr.wkbMultiPolygon ) :
+        parts = []
+        for k in range( ogr_geom.GetGeometryCount() ) :
+            parts.extend( geometry_parts( ogr_geom.GetGeometryRef(k) ) )
+        return parts
+    raise ValueError( "Simplifying geometry type " + str(ogr_geom.GetGeometryName()) + " not supported" )
+
+def simplify_wkb ( ogr_geom, simplify ) :
+    """Function to get well known binary of geometry with each line and ring replaced by simplify( points, is_ring )"""
+    geometry_type = ogr.GT_Flatten( ogr_geom.GetGeometryType() )
+    if geometry_type == ogr.wkbLineString :
+        return struct.pack( '<BI', WKB_NDR, WKB_LINESTRING ) + wkb_points( simplify( geometry_points( ogr_geom ), False ) )
+    if geometry_type == ogr.wkbPolygon :
+        rings = [ wkb_points( simplify( geometry_points( ogr_geom.GetGeometryRef(k) ), True ) ) for k in range( ogr_geom.GetGeometryCount() ) ]
+        return struct.pack( '<BII', WKB_NDR, WKB_POLYGON, len(rings) ) + ''.join( rings )
+    if geometry_type in ( ogr.wkbMultiLineString, ogr.wkbMultiPolygon ) :
+        if geometry_type == ogr.wkbMultiLineString :
+            wkb_type = WKB_MULTILINESTRING
+        else :
+            wkb_type = WKB_MULTIPOLYGON
+        parts = [ simplify_wkb( ogr_geom.GetGeometryRef(k), simplify ) for k in range( ogr_geom.GetGeometryCount() ) ]
+        return struct.pack( '<BII', WKB_NDR, wkb_type, len(parts) ) + ''.join( parts )
+    raise ValueError( "Simplifying geometry type " + str(ogr_geom.GetGeometryName()) + " not supported" )
+
+def count_points ( ogr_geom ) :
+    """Function to count points of all lines and rings of geometry"""
+    if ogr_geom.GetGeometryCount() == 0 :
+        return ogr_geom.GetPointCount()
+    return sum( [ count_points( ogr_geom.GetGeometryRef(k) ) for k in range( ogr_geom.GetGeometryCount() ) ] )
+
+def simplify_geometry ( ogr_geom, simplify ) :
+    """Function to simplify lines and rings of (multi)linestring or (multi)polygon; new geometry is created at once from well known binary"""
+    nr_points_before = count_points( ogr_geom )
+    ogr_geom_out = ogr.CreateGeometryFromWkb( simplify_wkb( ogr_geom, simplify ) )
+    logger.info( "Number of points before " + str(nr_points_before) + ", after " + str(count_points( ogr_geom_out )) )
+    return ogr_geom_out
+
+def douglas_peucker ( ogr_geom, tolerance ) :
+    """Function to simplify (multi)linestring or (multi)polygon with Douglas-Peucker"""
+    return simplify_geometry( ogr_geom, lambda points, is_ring : simplify_points( points, tolerance, is_ring ) )
+
+def visvalingam_whyatt ( ogr_geom, min_area ) :
+    """Function to simplify (multi)linestring or (multi)polygon with Visvalingam-Whyatt without creating intersections"""
+    simplified = iter( visvalingam_whyatt_parts( geometry_parts( ogr_geom ), min_area ) )
+    return simplify_geometry( ogr_geom, lambda points, is_ring : simplified.next() )
@@ -0,0 +1,95 @@
+#! /usr/bin/python
+
+""" Functions to transform coordinates of arrays of points in chunks with cached coordinate transformations
+"""
+
+# Standard library imports
+import logging
+
+# Related third party imports
+import numpy
+
+# GDAL/OGR imports
+from osgeo import osr
+
+# Module name
+MODULE_NAME = "IM transform"
+
+# EPSG code of UTM zones on WGS84 start with 32, followed by 6 (north) or 7 (south) and the zone number
+EPSG_UTM_WGS84 = 32
+
+# Number of points transformed and written at once
+TRANSFORM_CHUNK_SIZE = 100000
+
+# Format of transformed coordinates in XYZ files; same as str() of float
+XYZ_FORMAT = "%.12g"
+
+# Coordinate transformations per (source EPSG code, target EPSG code)
+COORDINATE_TRANSFORMATIONS = {}
+
+# Logger
+logger = logging.getLogger( MODULE_NAME )
+
+#########################################
+#  Coordinate transformation functions
+#########################################
+
+def get_utm_epsg_code ( x_min, x_max, y_min, y_max ) :
+    """Function to get EPSG code of WGS84 UTM zone of centre of extent"""
+    utm_zone = int ((((x_max + x_min)/2.0) + 180.0 ) / 6.0 )
+    if int( (y_max + y_min)/2.0 ) >= int(0) :
+        hemisphere         = "N"
+        epsg_hemisphere_id = 6
+    else :
+        hemisphere         = "S"
+        epsg_hemisphere_id = 7
+    epsg_code_out = int( str(EPSG_UTM_WGS84) + str(epsg_hemisphere_id) + str(utm_zone) )
+    logger.info("UTM zone  = " + str(utm_zone) + str(hemisphere))
+    logger.info("EPSG code = " + str(epsg_code_out))
+    return epsg_code_out
+
+def get_spatial_reference ( epsg_code ) :
+    """Function to get spatial reference of EPSG code with x as longitude or easting"""
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG( int(epsg_code) )
+    # GDAL 3 uses axis order of the authority (latitude first for EPSG 4326) unless told otherwise
+    if hasattr( osr, 'OAMS_TRADITIONAL_GIS_ORDER' ) :
+        srs.SetAxisMappingStrategy( osr.OAMS_TRADITIONAL_GIS_ORDER )
+    return srs
+
+def get_coordinate_transformation ( epsg_code_in, epsg_code_out ) :
+    """Function to get coordinate transformation between EPSG codes; transformations are created once and cached"""
+    key = ( int(epsg_code_in), int(epsg_code_out) )
+    if not COORDINATE_TRANSFORMATIONS.has_key( key ) :
+        logger.debug( "Create coordinate transformation from EPSG " + str(key[0]) + " to EPSG " + str(key[1]) )
+        COORDINATE_TRANSFORMATIONS[ key ] = osr.CoordinateTransformation( get_spatial_reference( key[0] ), get_spatial_reference( key[1] ) )
+    return COORDINATE_TRANSFORMATIONS[ key ]
+
+def transform_points ( coordinate_trans, x, y, chunk_size = TRANSFORM_CHUNK_SIZE ) :
+    """Function to transform arrays of x and y; one TransformPoints call per chunk of points"""
+    x = numpy.asarray( x, numpy.float64 )
+    y = numpy.asarray( y, numpy.float64 )
+    x_out = numpy.empty( len(x), numpy.float64 )
+    y_out = numpy.empty( len(y), numpy.float64 )
+    for start in range( 0, len(x), int(chunk_size) ) :
+        end    = min( start + int(chunk_size), len(x) )
+        points = coordinate_trans.TransformPoints( numpy.column_stack( ( x[start:end], y[start:end] ) ).tolist() )
+        points = numpy.asarray( points, numpy.float64 )
+        x_out[ start:end ] = points[ :, 0 ]
+        y_out[ start:end ] = points[ :, 1 ]
+    return x_out, y_out
+
+def write_transformed_xyz ( file_out, coordinate_trans, x, y, z, chunk_size = TRANSFORM_CHUNK_SIZE ) :
+    """Function to transform points and write them to XYZ file chunk by chunk; returns number of points written"""
+    x = numpy.asarray( x, numpy.float64 )
+    y = numpy.asarray( y, numpy.float64 )
+    z = numpy.asarray( z, numpy.float64 )
+    fOut = open( file_out, 'w' )
+    try :
+        for start in range( 0, len(x), int(chunk_size) ) :
+            end = min( start + int(chunk_size), len(x) )
+            x_out, y_out = transform_points( coordinate_trans, x[start:end], y[start:end], chunk_size )
+            numpy.savetxt( fOut, numpy.column_stack( ( x_out, y_out, z[start:end] ) ), fmt = XYZ_FORMAT, delimiter = " " )
+    finally :
+        fOut.close()
+    return len(x)
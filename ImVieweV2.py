@@ -9,6 +9,7 @@ import sys
 import math
 import struct
 import logging
+import itertools
 import xml.dom.minidom
 
 # Related third party imports
@@ -16,6 +17,10 @@ import numpy
 import cx_Oracle
 from easygui import *
 from Scientific.IO.NetCDF import *
+try :
+    import netCDF4
+except ImportError :
+    netCDF4 = None
 from CGAL.Alpha_shapes_2 import *
 from CGAL.Kernel import *
 
@@ -34,12 +39,35 @@ from osgeo import gdalconst
 from osgeo import ogr
 from osgeo import osr
 
+# Local imports
+import EMODNET_grid
+import EMODNET_cache
+from EMODNET_grid import read_grid_chunks, get_grid_extent, EMODNET_NR_COLUMNS, EMODNET_XYZ_COLUMNS
+from EMODNET_cache import StatisticsCache
+from IM_grid import GridAccumulator, GRID_MEAN
+from IM_colormap import build_lut, COLORMAP_ENTRIES
+from IM_raster import write_rasters, RASTER_FORMATS, RASTER_BLOCK_ROWS
+from IM_transform import get_utm_epsg_code, get_coordinate_transformation, transform_points, write_transformed_xyz
+from IM_points import sample_step, points_extent, read_point_extent, read_points, read_point_batches, FETCH_ARRAYSIZE
+from IM_pointcache import PointCache, POINT_CACHE_DIR, POINT_CACHE_MAX_BYTES
+from IM_simplify import douglas_peucker, visvalingam_whyatt
+from IM_hull import generate_alpha_hull
+from IM_pyramid import PointPyramid, PYRAMID_DIR, LEVEL_X, LEVEL_Y, LEVEL_MEAN
+from IM_points import EXTENT_MINX, EXTENT_MAXX, EXTENT_MINY, EXTENT_MAXY, EXTENT_MINZ, EXTENT_MAXZ, EXTENT_POINTS
+
 # Module name
 MODULE_NAME = "ImViewer"
 
 # Settings
 REGENERATE_HULL = False
 
+# Regenerated hulls are simplified without self-intersections; triangles smaller than (factor * link distance)^2 are removed
+HULL_SIMPLIFY_FACTOR = 0.25
+
+# Tile size (in degrees) and number of processes of hull generation; None tiles big models automatically and uses all processors
+HULL_TILE_SIZE    = None
+HULL_NR_PROCESSES = None
+
 # DB connect Parameters
 DB_USER_SOURCE       = "DB_USER_SOURCE"
 DB_PASSWORD_SOURCE   = "DB_PASSWORD_SOURCE"
@@ -92,8 +120,19 @@ PLOT_GEOMETRY    = True
 SHOW_IMAGE       = False
 MAX_NR_OF_POINTS = 50000 
 
-# EPSG code bases
-EPSG_UTM_WGS84 = 32
+# Points of individual models are cached locally for repeated plotting and export
+USE_POINT_CACHE = True
+
+# Level of detail pyramid used to plot individual models with more than MAX_NR_OF_POINTS points
+USE_PYRAMID        = True
+PLOT_WIDTH_PIXELS  = 1024
+PLOT_HEIGHT_PIXELS = 768
+
+# Maximum number of rows or columns of individual model rasters; None exports at full resolution of the gridsize
+RASTER_LIMIT_ROWS_COLS = None
+
+# Grids with more cells are accumulated in memory mapped files in the current directory
+RASTER_MEMORY_MAP_CELLS = 50000000
 
 # Logging levels
 LOG_LEVEL = 'info'
@@ -116,6 +155,27 @@ NETCDF_LONG                   = 'l'
 NETCDF_CHARACTER              = 'c'
 NETCDF_BYTE                   = 'b'
 
+# NumPy data types of NetCDF data types
+NETCDF_NUMPY_TYPES = { NETCDF_FLOAT                  : numpy.float32
+                       , NETCDF_DOUBLE_PRECISION_FLOAT : numpy.float64
+                       , NETCDF_INT                    : numpy.int32
+                       , NETCDF_LONG                   : numpy.int32
+                       , NETCDF_CHARACTER              : 'S1'
+                       , NETCDF_BYTE                   : numpy.int8
+                       }
+
+# NetCDF output formats; NetCDF4 (HDF5) files are chunked and compressed
+NETCDF_FORMAT_CLASSIC = "NetCDF classic"
+NETCDF_FORMAT_NETCDF4 = "NetCDF4 (chunked and compressed)"
+
+# Defines for NetCDF4 output; a chunk of 240 x 240 cells is a 1 x 1 degree window of an EMODNET grid
+NETCDF4_CHUNK_SHAPE       = ( 240, 240 )
+NETCDF4_COMPRESSION_LEVEL = 4
+NETCDF4_SHUFFLE           = True
+
+# Maximum size of all layers of a NetCDF grid in memory; larger grids are built in memory mapped files
+NETCDF_MAX_MEMORY_BYTES = 1024 * 1024 * 1024
+
 # Defines for NetCDF CF convention
 NETCDF_DIMENSION = 'area'
 
@@ -464,86 +524,14 @@ def calculate_distance_on_sphere (lon1, lat1 ,lon2, lat2):
 
 ####################################################
 # Douglas-Peuker algorithm
-# pts = coordinate list ([(0,0),(0.5,0.5),(1,0),(1.25,-0.25),(1.5,.5)])
 ####################################################
 
 def douglas_peuker ( ogr_line_string, tolerance ) :
+    """Function to simplify (multi)linestring or (multi)polygon with Douglas-Peucker; rings stay closed"""
 
     logger.info ( "Start Douglas-Peuker")
 
-    # Write coordinate to list
-    pts =[]
-    for i in range(ogr_line_string.GetPointCount()) :
-        point = [float(ogr_line_string.GetX(i)), float(ogr_line_string.GetY(i))]
-        pts.append(point)    
-    logger.info( "Number of point before " + str(i) )
-
-    # Start algorithm
-    anchor  = 0
-    floater = len(pts) - 1
-    stack   = []
-    keep    = set()
-    stack.append((anchor, floater))
-    while stack:
-        anchor, floater = stack.pop()
-      
-        # initialize line segment
-        if pts[floater] != pts[anchor]:
-            anchorX = float(pts[floater][0] - pts[anchor][0])
-            anchorY = float(pts[floater][1] - pts[anchor][1])
-            seg_len = math.sqrt(anchorX ** 2 + anchorY ** 2)
-            # get the unit vector
-            anchorX /= seg_len
-            anchorY /= seg_len
-        else:
-            anchorX = anchorY = seg_len = 0.0
-    
-        # inner loop:
-        max_dist = 0.0
-        farthest = anchor + 1
-        for i in range(anchor + 1, floater):
-            dist_to_seg = 0.0
-            # compare to anchor
-            vecX = float(pts[i][0] - pts[anchor][0])
-            vecY = float(pts[i][1] - pts[anchor][1])
-            seg_len = math.sqrt( vecX ** 2 + vecY ** 2 )
-            # dot product:
-            proj = vecX * anchorX + vecY * anchorY
-            if proj < 0.0:
-                dist_to_seg = seg_len
-            else: 
-                # compare to floater
-                vecX = float(pts[i][0] - pts[floater][0])
-                vecY = float(pts[i][1] - pts[floater][1])
-                seg_len = math.sqrt( vecX ** 2 + vecY ** 2 )
-                # dot product:
-                proj = vecX * (-anchorX) + vecY * (-anchorY)
-                if proj < 0.0:
-                    dist_to_seg = seg_len
-                else:  # calculate perpendicular distance to line (pythagorean theorem):
-                    dist_to_seg = math.sqrt(abs(seg_len ** 2 - proj ** 2))
-                if max_dist < dist_to_seg:
-                    max_dist = dist_to_seg
-                    farthest = i
-
-        if max_dist <= tolerance: # use line segment
-            keep.add(anchor)
-            keep.add(floater)
-        else:
-            stack.append((anchor, farthest))
-            stack.append((farthest, floater))
-
-    keep = list(keep)
-    keep.sort()
-
-    # Convert back to linestring
-    ogr_line_out  = ogr.Geometry(ogr.wkbLineString)
-    for i in keep :
-        point = pts[i]
-        ogr_line_out.AddPoint(float(point[0]),float(point[1]))
-    logger.info( "Number of points after " + str(ogr_line_out.GetPointCount()) )
-
-    return ogr_line_out
+    return douglas_peucker ( ogr_line_string, tolerance )
 
 ####################################################
 # CGAL function to regenerate hull
@@ -620,10 +608,8 @@ def regenerate_hull ( DbCursor, ogr_geom, link_distance, im_id ) :
 
         #ogr_geom_out = plot_geometry ( ogr_geom_buffer, None, None )
 
-        # Spatial query to get all points within boundary buffer and write to list
+        # Spatial query to get all points within boundary buffer as arrays
         logger.info("Get points in buffer from database")
-        list_of_coordinates = []
-        i                   = 0
         query_geom_wkt      = ogr_geom_buffer.ExportToWkt()
         db_wkt_geom         = DbCursor.var(cx_Oracle.CLOB)
         db_wkt_geom.setvalue(0, query_geom_wkt)
@@ -631,23 +617,19 @@ def regenerate_hull ( DbCursor, ogr_geom, link_distance, im_id ) :
         select_stmt         = select_clause + " where hod.wdg_id = :wdgId and sdo_anyinteract ( hod.positie, sdo_geometry( :polygon, 8307) ) = \'TRUE\' "
         DbCursor.arraysize  = 10000
         DbCursor.execute(select_stmt, wdgId = im_id, polygon = db_wkt_geom  )
-        while True :
-            coordinates = DbCursor.fetchmany()
-            if not coordinates :
-                break
-            else :
-                for coordinate in coordinates :
-                    i = i + 1
-                    x = float(coordinate[0])
-                    y = float(coordinate[1])
-                    list_of_coordinates.append(Point_2(x,y))
-        logger.info ( str(i) + " points selected")
-
-        # Generate hull edges
+
+        # Coordinates of each fetched batch are appended to one growing array, so no list of batches is concatenated
+        rows        = itertools.chain.from_iterable( iter( DbCursor.fetchmany, [] ) )
+        coordinates = numpy.fromiter( itertools.chain.from_iterable( rows ), numpy.float64 ).reshape( -1, 2 )
+        logger.info ( str(len(coordinates)) + " points selected")
+
+        # Generate hull from alpha shape of Delaunay triangulation and polygonize locally
         logger.info ( "Generate new hull using TIN algorithm")
-        DbCursor.prepare( DbCursor.callfunc("sdb_interface_pck.getclientdml", str, [INSERT_EDGES_STMT_ID]) )
-        DbCursor.executemany(None, cgal_generate_hull_edges ( list_of_coordinates, link_distance ) )
-        ogr_boundary_poly = ogr.CreateGeometryFromWkt( str(DbCursor.callfunc("sdb_envelope_pck.construct_geom_from_edges", cx_Oracle.CLOB ) ) )
+        ogr_boundary_poly = generate_alpha_hull ( coordinates[:,0], coordinates[:,1], link_distance, HULL_TILE_SIZE, HULL_NR_PROCESSES )
+
+        # Simplify all rings of hull in one pass; shared boundaries and rings stay valid
+        logger.info ( "Simplify hull with Visvalingam-Whyatt")
+        ogr_boundary_poly = visvalingam_whyatt ( ogr_boundary_poly, ( HULL_SIMPLIFY_FACTOR * link_distance ) ** 2 )
         ogr_boundary_line = ogr_boundary_poly.GetBoundary()
         logger.info ( "Geometry type new boundary: " + str(ogr_boundary_line.GetGeometryName()) )
         logger.info ( "Number of linestrings     : " + str(ogr_boundary_line.GetGeometryCount()))
@@ -826,15 +808,40 @@ def convert_emodnet () :
     (filepath, filename)   = os.path.split(emodnet_file)
     (shortname, extension) = os.path.splitext(filename)
     netcdf_file  = filepath + "\\" + shortname + ".nc"
-    netcdf_generate_emodnet_grid ( emodnet_file, netcdf_file )
+    netcdf_format = NETCDF_FORMAT_CLASSIC
+    if netCDF4 is not None :
+        msg           = 'Select NetCDF format'
+        title         = 'NetCDF format'
+        netcdf_format = buttonbox(msg, title, [ NETCDF_FORMAT_CLASSIC, NETCDF_FORMAT_NETCDF4 ])
+    netcdf_generate_emodnet_grid ( emodnet_file, netcdf_file, netcdf_format )
+
+def netcdf_open_file ( file_name, mode, netcdf_format ) :
+    """Function to open NetCDF file in classic or NetCDF4 format"""
+    if netcdf_format == NETCDF_FORMAT_NETCDF4 :
+        if netCDF4 is None :
+            raise ImportError, "The netCDF4 module is required to write NetCDF4 files."
+        return netCDF4.Dataset( file_name, mode, format = 'NETCDF4' )
+    return NetCDFFile( file_name, mode )
+
+def netcdf_write_variable ( variable, values ) :
+    """Function to write array to variable in one slab"""
+    if hasattr( variable, 'assignValue' ) :
+        variable.assignValue( values )
+    else :
+        variable[:] = values
 
-def netcdf_create_variable_array ( netcdf_file, CF_standard_name, dimension, data_type, canonical_unit, cell_method ) :
+def netcdf_create_variable_array ( netcdf_file, CF_standard_name, dimension, data_type, canonical_unit, cell_method, chunk_shape = None, complevel = NETCDF4_COMPRESSION_LEVEL, shuffle = NETCDF4_SHUFFLE ) :
 
-    """Function to create array for layer in NetCDF file"""
+    """Function to create array for layer in NetCDF file; with chunk shape the variable is chunked and compressed (NetCDF4 only)"""
     logger.info ("Create NetCDF layer " + str(CF_standard_name))
 
     # Create variables for scalars
-    variable  = netcdf_file.createVariable( CF_standard_name, data_type, dimension )
+    if chunk_shape is None :
+        variable  = netcdf_file.createVariable( CF_standard_name, data_type, dimension )
+    else :
+        # Chunks can not be larger than the dimensions
+        chunk_shape = [ min( int(chunk_shape[k]), len(netcdf_file.dimensions[ dimension[k] ]) ) for k in range(len(dimension)) ]
+        variable    = netcdf_file.createVariable( CF_standard_name, NETCDF_NUMPY_TYPES[ data_type ], dimension, zlib = complevel > 0, complevel = complevel, shuffle = shuffle, chunksizes = chunk_shape, fill_value = numpy.array( EMODNET_MISSING_VALUE ).astype( NETCDF_NUMPY_TYPES[ data_type ] ) )
 
     # Add attributes to variable
     setattr(variable, NETCDF_VARIABLE_ATTRIBUTES['standard_name'] , CF_standard_name            )
@@ -842,51 +849,31 @@ def netcdf_create_variable_array ( netcdf_file, CF_standard_name, dimension, dat
     setattr(variable, NETCDF_VARIABLE_ATTRIBUTES['units']         , canonical_unit              )
     setattr(variable, NETCDF_VARIABLE_ATTRIBUTES['cell_methods']  , 'area: ' + str(cell_method) )
 
-    ## Initialize the new variable to missing value
-    logger.info ("Populate array")
-    variable_array = netcdf_file.variables[ CF_standard_name ]
-    for i in range(variable.shape[0]):
-        for j in range(variable.shape[1]):
-            variable_array[int(i), int(j)] = EMODNET_MISSING_VALUE
-    logger.info ("Array populated")
+    return variable
 
-    return variable_array
+def netcdf_create_layer_array ( nr_rows, nr_cols, data_type, memory_map_file = None ) :
+    """Function to create NumPy array for layer, initialized to missing value; optionally memory mapped"""
+    if memory_map_file :
+        layer_array = numpy.memmap( memory_map_file, dtype = NETCDF_NUMPY_TYPES[ data_type ], mode = 'w+', shape = ( nr_rows, nr_cols ) )
+    else :
+        layer_array = numpy.empty( ( nr_rows, nr_cols ), NETCDF_NUMPY_TYPES[ data_type ] )
+    layer_array.fill( EMODNET_MISSING_VALUE )
+    return layer_array
 
-def netcdf_generate_emodnet_grid ( input_file, output_file ) :
+def netcdf_generate_emodnet_grid ( input_file, output_file, netcdf_format = NETCDF_FORMAT_CLASSIC, chunk_shape = NETCDF4_CHUNK_SHAPE, complevel = NETCDF4_COMPRESSION_LEVEL, shuffle = NETCDF4_SHUFFLE ) :
     """Function to generate EMODNET NetCDF file"""
 
     logger.info ( "Convert EMODNET Ascii file to EMODNET NetCDF file " )
 
-    i = 0
     gridsize = EMODNET_GRIDSIZE 
-    fIn = open( input_file, "r")
 
-    # Read file to find dimensions of generated EODNET grid
-    for line in fIn :
-        a = line.rstrip().split(EMODNET_SEPARATOR)
-        position_long         = float(a[0])
-        position_lat          = float(a[1])
-
-        # Get dimensions in long and lat
-        if i == 0 :
-            long_min = position_long
-            long_max = position_long
-            lat_min  = position_lat
-            lat_max  = position_lat
-            i = i + 1
-        else :
-            if position_long < long_min :
-                long_min = position_long
-            if position_long > long_max :
-                long_max = position_long
-            if position_lat < lat_min :
-                lat_min = position_lat
-            if position_lat > lat_max :
-                lat_max = position_lat
-            i = i + 1
-
-    # Close file
-    fIn.close()
+    # Read file to find dimensions of generated EODNET grid; dimensions of unchanged files come from cache
+    extent   = get_grid_extent ( input_file, EMODNET_NR_COLUMNS, EMODNET_SEPARATOR, EMODNET_XYZ_COLUMNS, cache = StatisticsCache() )
+    i        = extent[ EMODNET_grid.EXTENT_POINTS ]
+    long_min = extent[ EMODNET_grid.EXTENT_MINX ]
+    long_max = extent[ EMODNET_grid.EXTENT_MAXX ]
+    lat_min  = extent[ EMODNET_grid.EXTENT_MINY ]
+    lat_max  = extent[ EMODNET_grid.EXTENT_MAXY ]
 
     logger.info (  "Nr of lines = " + str(i)     )
     logger.info (  "Long_min    = " + str(long_min) )
@@ -904,7 +891,7 @@ def netcdf_generate_emodnet_grid ( input_file, output_file ) :
     # Open the NetCDF file for first time
     if os.path.exists ( output_file ) :
         os.remove( output_file )
-    fOut = NetCDFFile( output_file , 'w')
+    fOut = netcdf_open_file( output_file , 'w', netcdf_format )
 
     # Create some global attribute using a constant
     setattr(fOut, NETCDF_GLOBAL_ATTRIBUTES[ 'title' ]      , 'title'       )
@@ -942,94 +929,94 @@ def netcdf_generate_emodnet_grid ( input_file, output_file ) :
     # Close the netCDF file
     fOut.close()
 
-    # Reopen the NetCDF file to append scalars
-    fOut = NetCDFFile( output_file , 'a')
-
-    # Init scalar arrays (arrays ara initialized on disk in NetcCDF file)
-    depth_min_array             = netcdf_create_variable_array ( fOut, 'depth_min'            , variable_dimension, NETCDF_FLOAT     , 'm', NETCDF_CELL_METHODS['minimum'] )
-    depth_max_array             = netcdf_create_variable_array ( fOut, 'depth_max'            , variable_dimension, NETCDF_FLOAT     , 'm', NETCDF_CELL_METHODS['maximum'] )
-    depth_average_array         = netcdf_create_variable_array ( fOut, 'depth_average'        , variable_dimension, NETCDF_FLOAT     , 'm', NETCDF_CELL_METHODS['mean'] )
-    depth_stDev_array           = netcdf_create_variable_array ( fOut, 'depth_stDev'          , variable_dimension, NETCDF_FLOAT     , 'm', NETCDF_CELL_METHODS['standard_deviation'] )
-    interpolations_array        = netcdf_create_variable_array ( fOut, 'interpolations'       , variable_dimension, NETCDF_INT       , '' , NETCDF_CELL_METHODS['interpolations'] )
-    elementary_surfaces_array   = netcdf_create_variable_array ( fOut, 'elementary_surfaces'  , variable_dimension, NETCDF_INT       , '' , NETCDF_CELL_METHODS['elementary_surfaces'] )
-    depth_smoothed_array        = netcdf_create_variable_array ( fOut, 'depth_smoothed'       , variable_dimension, NETCDF_FLOAT     , 'm', NETCDF_CELL_METHODS['smoothed'] )
-    depth_smoothed_offset_array = netcdf_create_variable_array ( fOut, 'depth_smoothed_offset', variable_dimension, NETCDF_FLOAT     , 'm', NETCDF_CELL_METHODS['smoothed_offset'] )
-    CDI_ID_array                = netcdf_create_variable_array ( fOut, 'CDI_ID'               , variable_dimension, NETCDF_CHARACTER , '' , '')
-    DTM_source_array            = netcdf_create_variable_array ( fOut, 'DTM_source'           , variable_dimension, NETCDF_CHARACTER , '' , '')
-
-    # Read files and write values to array
+    # Reopen the NetCDF file to append scalars; NetCDF4 layers are chunked and compressed
+    fOut = netcdf_open_file( output_file , 'a', netcdf_format )
+    if netcdf_format <> NETCDF_FORMAT_NETCDF4 :
+        chunk_shape = None
+
+    # Create variables for layers
+    depth_min_var             = netcdf_create_variable_array ( fOut, 'depth_min'            , variable_dimension, NETCDF_FLOAT     , 'm', NETCDF_CELL_METHODS['minimum'], chunk_shape, complevel, shuffle )
+    depth_max_var             = netcdf_create_variable_array ( fOut, 'depth_max'            , variable_dimension, NETCDF_FLOAT     , 'm', NETCDF_CELL_METHODS['maximum'], chunk_shape, complevel, shuffle )
+    depth_average_var         = netcdf_create_variable_array ( fOut, 'depth_average'        , variable_dimension, NETCDF_FLOAT     , 'm', NETCDF_CELL_METHODS['mean'], chunk_shape, complevel, shuffle )
+    depth_stDev_var           = netcdf_create_variable_array ( fOut, 'depth_stDev'          , variable_dimension, NETCDF_FLOAT     , 'm', NETCDF_CELL_METHODS['standard_deviation'], chunk_shape, complevel, shuffle )
+    interpolations_var        = netcdf_create_variable_array ( fOut, 'interpolations'       , variable_dimension, NETCDF_INT       , '' , NETCDF_CELL_METHODS['interpolations'], chunk_shape, complevel, shuffle )
+    elementary_surfaces_var   = netcdf_create_variable_array ( fOut, 'elementary_surfaces'  , variable_dimension, NETCDF_INT       , '' , NETCDF_CELL_METHODS['elementary_surfaces'], chunk_shape, complevel, shuffle )
+    depth_smoothed_var        = netcdf_create_variable_array ( fOut, 'depth_smoothed'       , variable_dimension, NETCDF_FLOAT     , 'm', NETCDF_CELL_METHODS['smoothed'], chunk_shape, complevel, shuffle )
+    depth_smoothed_offset_var = netcdf_create_variable_array ( fOut, 'depth_smoothed_offset', variable_dimension, NETCDF_FLOAT     , 'm', NETCDF_CELL_METHODS['smoothed_offset'], chunk_shape, complevel, shuffle )
+    CDI_ID_var                = netcdf_create_variable_array ( fOut, 'CDI_ID'               , variable_dimension, NETCDF_CHARACTER , '' , '', chunk_shape, complevel, shuffle )
+    DTM_source_var            = netcdf_create_variable_array ( fOut, 'DTM_source'           , variable_dimension, NETCDF_CHARACTER , '' , '', chunk_shape, complevel, shuffle )
+
+    # Column in file, variable and data type of each layer
+    layers = [ (  2, depth_min_var            , NETCDF_FLOAT     )
+             , (  3, depth_max_var            , NETCDF_FLOAT     )
+             , (  4, depth_average_var        , NETCDF_FLOAT     )
+             , (  5, depth_stDev_var          , NETCDF_FLOAT     )
+             , (  6, interpolations_var       , NETCDF_INT       )
+             , (  7, elementary_surfaces_var  , NETCDF_INT       )
+             , (  8, depth_smoothed_var       , NETCDF_FLOAT     )
+             , (  9, depth_smoothed_offset_var, NETCDF_FLOAT     )
+             , ( 10, CDI_ID_var               , NETCDF_CHARACTER )
+             , ( 11, DTM_source_var           , NETCDF_CHARACTER ) ]
+
+    # Init layers as arrays in memory; layers which do not fit in memory are memory mapped next to the output file
+    layer_bytes = nr_lats * nr_lons * sum( [ numpy.dtype( NETCDF_NUMPY_TYPES[ data_type ] ).itemsize for column, variable, data_type in layers ] )
+    memory_map_files = {}
+    if layer_bytes > NETCDF_MAX_MEMORY_BYTES :
+        logger.info( "Layers of " + str(layer_bytes) + " bytes are memory mapped" )
+        for column, variable, data_type in layers :
+            memory_map_files[ column ] = output_file + '.layer' + str(column) + '.tmp'
+    layer_arrays = {}
+    for column, variable, data_type in layers :
+        layer_arrays[ column ] = netcdf_create_layer_array ( nr_lats, nr_lons, data_type, memory_map_files.get( column ) )
+    written = numpy.zeros( nr_lats * nr_lons, bool )
+
+    # Read files and scatter values of each chunk into arrays; if cells occur more than once the last line wins
     logger.info ("Read files and write values to array")
     i                  = 0
-    long_max           = 0
-    lat_max            = 0
     overwritten_values = 0
-    fIn = open( input_file, "r")
-    for line in fIn :
+    for chunk in read_grid_chunks ( input_file, EMODNET_NR_COLUMNS, EMODNET_SEPARATOR, EMODNET_XYZ_COLUMNS ) :
+        if len(chunk) == 0 :
+            continue
         try :
-            # Process line
-            i = i + 1
-            # Get attributes from line
-            a = line.rstrip().split(EMODNET_SEPARATOR)
-            # Get row and column in array
-            latitude_row  = int ( round ( ( float(a[1]) - lat_min  ) / float(gridsize) , 0 ) )
-            longitude_col = int ( round ( ( float(a[0]) - long_min ) / float(gridsize) , 0 ) )
-            # For debugging
-            # if latitude_row == 1394 and longitude_col == 2412 :
-            #    logger.warning ( "File row " + str(i) + " : Overwriting depth value " + str(a[4]) +  " in NetCDF grid on row " + str(latitude_row) + " ( y = " + str(a[1])  + ") and column " + str(longitude_col) + " ( x = " + str(a[0]) + " )" )
-            # Check for duplicate depths in source
-            if float(depth_average_array[latitude_row, longitude_col]) <> float(EMODNET_MISSING_VALUE) :
-                overwritten_values = overwritten_values + 1
-                logger.debug ( "File row " + str(i) + " : Overwriting depth value " + str(a[4]) +  " in NetCDF grid on row " + str(latitude_row) + " ( y = " + str(a[1])  + ") and column " + str(longitude_col) + " ( x = " + str(a[0]) + " )" )
-            if int(latitude_row) == 0 :
-                logger.debug("Row: " + str(a[1]) + " at line " + str(i) )
-                logger.debug("Col: " + str(longitude_col) + ", Row " + str(latitude_row) )
-            if int(longitude_col) == 0 :
-                logger.debug("Col:"  + str(a[0]) + " at line " + str(i) )
-                logger.debug("Row: " + str(latitude_row) + ", Col " + str(longitude_col) )
-            # Write values to array
-            if a[2] :
-                depth_min_array[latitude_row, longitude_col] = float( a[2] )
-            if a[3] :
-                depth_max_array[latitude_row, longitude_col] = float( a[3] )
-            if a[4] :
-                depth_average_array[latitude_row, longitude_col] = float( a[4] )
-            if a[5] :
-                depth_stDev_array[latitude_row, longitude_col] = float( a[5] )
-            if a[6] :
-                interpolations_array[latitude_row, longitude_col] = int( a[6] )
-            if a[7] :
-                elementary_surfaces_array[latitude_row, longitude_col] = int( a[7] )
-            if a[8] :
-                depth_smoothed_array[latitude_row, longitude_col] = float( a[8] )
-            if a[9] :
-                depth_smoothed_offset_array[latitude_row, longitude_col] = float( a[9] )
-            if a[10] :
-                CDI_ID_array[latitude_row, longitude_col] = str( a[10] )[:1]
-            if a[11] :
-                DTM_source_array[latitude_row, longitude_col] = str( a[11] )[:1]
-            if i % 50000 == 0 :
-                logger.info( str(i) + " rows written to file" )
+            # Get row and column in array for all lines in chunk
+            latitude_rows  = numpy.floor( ( chunk.y - lat_min  ) / float(gridsize) + 0.5 ).astype(numpy.intp)
+            longitude_cols = numpy.floor( ( chunk.x - long_min ) / float(gridsize) + 0.5 ).astype(numpy.intp)
+            cells = latitude_rows * nr_lons + longitude_cols
+
+            # Check for duplicate depths in source; each line that overwrites a cell counts once
+            unique_cells       = numpy.unique( cells )
+            overwritten_values = overwritten_values + int( written[ unique_cells ].sum() ) + len(cells) - len( unique_cells )
+            written[ cells ] = True
+
+            # Write values to arrays; empty values do not overwrite the value of the cell
+            for column, variable, data_type in layers :
+                field     = chunk.field( column )
+                non_empty = field <> ""
+                if data_type == NETCDF_CHARACTER :
+                    values = field[ non_empty ].astype( 'S1' )
+                else :
+                    values = field[ non_empty ].astype( numpy.float64 )
+                layer_arrays[ column ].reshape(-1)[ cells[ non_empty ] ] = values
+            i = i + len(chunk)
+            logger.info( str(i) + " rows written to array" )
         except Exception, err:
-            logger.critical( "Writing line " + str(i) + " to NetCDF array failed: ERROR: %s\n" % str(err))
-            logger.critical( "Row:    " + str(latitude_row)  )
-            logger.critical( "Column: " + str(longitude_col) )
-            logger.critical( "Min depth: " + str(a[2]) )
-            logger.critical( "Max depth: " + str(a[3]) )
-            logger.critical( "Avg depth: " + str(a[4]) )
-            logger.critical( "Std depth: " + str(a[5]) )
-            logger.critical( "Interpola: " + str(a[6]) )
-            logger.critical( "Elementar: " + str(a[7]) )
-            logger.critical( "Smootharr: " + str(a[8]) )
-            logger.critical( "Smoothoff: " + str(a[9]) )
-            logger.critical( "CDI_ID_ar: " + str(a[10]) )
-            logger.critical( "DTM_sourc: " + str(a[11]) )
+            logger.critical( "Writing lines " + str(chunk.line_numbers[0]) + " - " + str(chunk.line_numbers[-1]) + " to NetCDF array failed: ERROR: %s\n" % str(err))
             os.sys.exit("Execution stopped")
 
-    # Close inputfile and NetCDF file
+    # Write coordinates and each layer to NetCDF file in one slab
+    logger.info( "Write layers to NetCDF file" )
+    netcdf_write_variable( fOut.variables[ 'lon' ], ( long_min + numpy.arange( nr_lons ) * gridsize ).astype( numpy.float32 ) )
+    netcdf_write_variable( fOut.variables[ 'lat' ], ( lat_min  + numpy.arange( nr_lats ) * gridsize ).astype( numpy.float32 ) )
+    for column, variable, data_type in layers :
+        netcdf_write_variable( variable, layer_arrays[ column ] )
+        del layer_arrays[ column ]
+
+    # Close NetCDF file and remove memory mapped files
     logger.info( str(i) + " rows written to file")
     logger.info( str(overwritten_values) + " points overwritten")
-    fIn.close()
     fOut.close()
+    for memory_map_file in memory_map_files.values() :
+        os.remove( memory_map_file )
 
 #########################################
 #  GIS Functions
@@ -1134,28 +1121,9 @@ def plot_geometry ( ogr_geom_in, color_table, attribute_id ) :
 ########################################
 
 def getCoordTrans ( x_min, x_max, y_min, y_max, epsg_code_in ) :
-    """"Function te get coordinate transformation to UTM"""
-
-    # Determine UTM zone
-    utm_zone = int ((((x_max + x_min)/2.0) + 180.0 ) / 6.0 )
-    if int( (y_max + y_min)/2.0 ) >= int(0) :
-        hemisphere         = "N"
-        epsg_hemisphere_id = 6
-    else :
-        hemisphere         = "S"
-        epsg_hemisphere_id = 7
-    epsg_code_out = str(EPSG_UTM_WGS84) + str(epsg_hemisphere_id) + str(utm_zone)
-    logger.info("UTM zone  = " + str(utm_zone) + str(hemisphere))
-    logger.info("EPSG code = " + str(epsg_code_out))
-
-    # Execute coordinate transformation
-    source_srs       = osr.SpatialReference()
-    source_srs.ImportFromEPSG(int(epsg_code_in))
-    target_srs       = osr.SpatialReference()
-    target_srs.ImportFromEPSG(int(epsg_code_out))
-    coordinate_trans = osr.CoordinateTransformation(source_srs,target_srs)
-
-    return coordinate_trans
+    """"Function te get coordinate transformation to UTM; transformations are cached per source EPSG code and UTM zone"""
+    epsg_code_out = get_utm_epsg_code ( x_min, x_max, y_min, y_max )
+    return get_coordinate_transformation ( epsg_code_in, epsg_code_out )
 
 def read_geometry_from_file() :
     """"Function to read hull from George"""
@@ -1174,11 +1142,18 @@ def read_geometry_from_file() :
     first_polygon = True
     multipolygon = ogr.Geometry(ogr.wkbMultiPolygon)
     fIn = open( filename, 'r')
+    lines = fIn.readlines()
+    fIn.close()
+    # Transform all vertices to UTM in one batch for distances between vertices
+    vertices = numpy.array( [ line.split()[0:2] for line in lines if len(line.rstrip().split()) == 3 ], numpy.float64 ).reshape( -1, 2 )
+    x_utm, y_utm = transform_points ( coord_trans, vertices[:,0], vertices[:,1] )
+    vertex_index = -1
     # Process vertices ( x y ring_indicator)
-    for line in fIn :
+    for line in lines :
         if len(line.rstrip().split()) == 3 :
             # Process vertex
             nr_of_vertices = nr_of_vertices + 1
+            vertex_index   = vertex_index + 1
             x = float(line.rstrip().split()[0])
             y = float(line.rstrip().split()[1])
             i = int(line.rstrip().split()[2])
@@ -1197,6 +1172,7 @@ def read_geometry_from_file() :
                 exterior.AddPoint(x,y)
                 x_previous = x
                 y_previous = y
+                utm_previous = vertex_index
             elif is_exterior and nr_of_vertices == 1 and first_polygon == False :
                 multipolygon.AddGeometry(polygon)
                 nr_rings = 0
@@ -1207,6 +1183,7 @@ def read_geometry_from_file() :
                 exterior.AddPoint(x,y)
                 x_previous = x
                 y_previous = y
+                utm_previous = vertex_index
             if is_exterior and nr_of_vertices > 1 :
                 exterior.AddPoint(x,y)
             if not is_exterior and nr_of_vertices == 1 :
@@ -1215,21 +1192,17 @@ def read_geometry_from_file() :
                 interior.AddPoint(x,y)
                 x_previous = x
                 y_previous = y
+                utm_previous = vertex_index
             if not is_exterior and nr_of_vertices > 1 :
                 interior.AddPoint(x,y)
             # Calculate length between vertices
             if x <> x_previous and y <> y_previous :
-                p1  = ogr.Geometry(ogr.wkbPoint)
-                p2  = ogr.Geometry(ogr.wkbPoint)
-                p1.AddPoint_2D (x,y)
-                p2.AddPoint_2D (x_previous,y_previous)
-                p1.Transform(coord_trans)
-                p2.Transform(coord_trans)
-                distance = float(p1.Distance(p2))
+                distance = math.hypot( x_utm[vertex_index] - x_utm[utm_previous], y_utm[vertex_index] - y_utm[utm_previous] )
                 if distance < float(0.1) :
-                    print "Distance " + str(p1.Distance(p2)) + " polygon " + str(nr_polygons) + " ring " + str(nr_rings) + " vertex " + str(nr_of_vertices)
+                    print "Distance " + str(distance) + " polygon " + str(nr_polygons) + " ring " + str(nr_rings) + " vertex " + str(nr_of_vertices)
                 x_previous = x
                 y_previous = y
+                utm_previous = vertex_index
         else :
             # Close rings
             if is_exterior :
@@ -1252,7 +1225,6 @@ def read_geometry_from_file() :
 #        interior.CloseRings()
 #        polygon.AddGeometry(interior)
     multipolygon.AddGeometry(polygon)
-    fIn.close()
     multipolygon.FlattenTo2D()
     multipolygon_wkt = multipolygon.ExportToWkt()
     OracleConnection = cx_Oracle.connect ( PARAMETER_LIST_VALUE[ DB_USER_SOURCE ], PARAMETER_LIST_VALUE[ DB_PASSWORD_SOURCE ], PARAMETER_LIST_VALUE[ DB_TNS_SOURCE ] )
@@ -1674,18 +1646,10 @@ def plot_im () :
 
     logger.info( "Read points from database" )
 
-    # Skip datapoints when file is too big to handle
-    if int(nr_of_points) > int( MAX_NR_OF_POINTS ) :
-        step = round(float(nr_of_points)/float(MAX_NR_OF_POINTS))
-    else :
-        step = 1
+    # Skip datapoints when file is too big to handle; database returns every step-th point
+    step = sample_step ( nr_of_points, MAX_NR_OF_POINTS )
 
     # Get points from database
-    x = []
-    y = []
-    z = []
-    i = int(0)
-    j = int(0)
     if scalar == DEPTH :
         stmt = 'select x, y, z from table ( sdb_pointstore_pck.readDepthsAsRecord ( :ID ) ) '
     if scalar == AVG_DEPTH or scalar == NR_DEPTHS :
@@ -1718,56 +1682,54 @@ def plot_im () :
             scalar_column = "Z_AVG"
         if scalar == NR_DEPTHS :
             scalar_column = "NR_POINTS"
-        stmt = 'select ' + str(minx) + ' + ' + str(gridsize_x) + '*col_nr, ' +  str(miny) + ' + ' + str(gridsize_y) + '*row_nr, ' + str(scalar_column) + ' from sdb_pointstore where instance_id = :ID '
+        stmt = 'select ' + str(minx) + ' + ' + str(gridsize_x) + '*col_nr x, ' +  str(miny) + ' + ' + str(gridsize_y) + '*row_nr y, ' + str(scalar_column) + ' z from sdb_pointstore where instance_id = :ID '
         logger.info(stmt)
-    DbCursor.arraysize = 100000
-    DbCursor.arraysize = 100000
-    DbCursor.execute(stmt, ID = PARAMETER_LIST_VALUE[OBJECT_INSTANCE_ID] )
-    while 1 :
-        resultset = DbCursor.fetchmany()
-        if not resultset :
-            break
-        else :
-            for row in resultset :
-                if i % step == 0 :
-                    x_v = float(row[0])
-                    y_v = float(row[1])
-                    z_v = float(row[2])
-                    if i == 0 :
-                        x_min = x_v
-                        x_max = x_v
-                        y_min = y_v
-                        y_max = y_v
-                        z_min = z_v
-                        z_max = z_v
-                        x.append(x_v)
-                        y.append(y_v)
-                        z.append(z_v)
-                        j = j + 1
-                    else :
-                        if x_v < x_min :
-                            x_min = x_v
-                        if x_v > x_max :
-                            x_max = x_v
-                        if y_v < y_min :
-                            y_min = y_v
-                        if y_v > y_max :
-                            y_max = y_v
-                        if z_v < z_min :
-                            z_min = z_v
-                        if z_v > z_max :
-                            z_max = z_v
-                        x.append(x_v)
-                        y.append(y_v)
-                        z.append(z_v)
-                        j = j + 1
-                i = i + 1
-
-    logger.info( str(j) + " points read from database" )
-
-    # Plot points
+    parameters = { 'ID' : PARAMETER_LIST_VALUE[OBJECT_INSTANCE_ID] }
+    source     = { 'instance_id' : PARAMETER_LIST_VALUE[OBJECT_INSTANCE_ID], 'scalar' : scalar, 'nrofpoints' : nr_of_points, 'shallowest' : shallowest, 'deepest' : deepest }
+    if USE_POINT_CACHE :
+        # All points are cached locally per IM and scalar; cache is outdated when number of points or depth range changed
+        point_cache = PointCache ( POINT_CACHE_DIR, POINT_CACHE_MAX_BYTES )
+        modified    = [ nr_of_points, shallowest, deepest ]
+        cache_entry = point_cache.get ( PARAMETER_LIST_VALUE[OBJECT_INSTANCE_ID], scalar, modified )
+        if cache_entry is None :
+            # Fetched batches are streamed into the cache; the subsampled points are read from the cache
+            batches     = read_point_batches ( DbCursor, stmt, parameters, 1, FETCH_ARRAYSIZE )
+            cache_entry = point_cache.put_batches ( PARAMETER_LIST_VALUE[OBJECT_INSTANCE_ID], scalar, modified, batches )
+        x, y, z = cache_entry.read ( step = step )
+        x_min, x_max, y_min, y_max, z_min, z_max = cache_entry.extent()
+        logger.info( str(len(x)) + " points read from cache with step " + str(step) )
+    else :
+        cache_entry = None
+        # Extent is taken from the fetched points; another sampled execution may not return the same rows
+        x, y, z     = read_points ( DbCursor, stmt, parameters, step, FETCH_ARRAYSIZE )
+        extent      = points_extent ( x, y, z )
+        x_min = extent[ EXTENT_MINX ]
+        x_max = extent[ EXTENT_MAXX ]
+        y_min = extent[ EXTENT_MINY ]
+        y_max = extent[ EXTENT_MAXY ]
+        z_min = extent[ EXTENT_MINZ ]
+        z_max = extent[ EXTENT_MAXZ ]
+        logger.info( str(extent[ EXTENT_POINTS ]) + " points read from database with step " + str(step) )
+
+    # Plot points; big models are plotted with mean depth of level of pyramid that fits the screen
     if PLOT_GEOMETRY :
-        pylab.scatter(x,y,c=z,edgecolors='none',vmin=z_min,vmax=z_max)
+        if USE_PYRAMID and step > 1 :
+            pyramid_dir = os.path.join( PYRAMID_DIR, str(PARAMETER_LIST_VALUE[OBJECT_INSTANCE_ID]) + "_" + scalar.replace(" ", "_") )
+            pyramid     = PointPyramid ( pyramid_dir )
+            if not pyramid.is_valid ( source ) :
+                logger.info( "Build level of detail pyramid in " + str(pyramid_dir) )
+                if cache_entry is not None :
+                    x_all, y_all, z_all = cache_entry.read ()
+                else :
+                    x_all, y_all, z_all = read_points ( DbCursor, stmt, parameters, 1, FETCH_ARRAYSIZE )
+                pyramid.build ( x_all, y_all, z_all, PARAMETER_LIST_VALUE[ GRIDSIZE ], source )
+                x_all = y_all = z_all = None
+            level_nr = pyramid.select_level ( x_min, x_max, y_min, y_max, PLOT_WIDTH_PIXELS, PLOT_HEIGHT_PIXELS, MAX_NR_OF_POINTS )
+            level    = pyramid.read_level ( level_nr )
+            logger.info( "Plot level " + str(level_nr) + " of pyramid with " + str(len(level)) + " points" )
+            pylab.scatter(level[:,LEVEL_X],level[:,LEVEL_Y],c=level[:,LEVEL_MEAN],edgecolors='none',vmin=pyramid.index['extent'][4],vmax=pyramid.index['extent'][5])
+        else :
+            pylab.scatter(x,y,c=z,edgecolors='none',vmin=z_min,vmax=z_max)
         pylab.colorbar()
 
     message = "Do you want to export the IM?"
@@ -1819,32 +1781,10 @@ def plot_im () :
 
         file_utm = str(im_name) + str("_utm.xyz")
 
-        # Determine UTM zone
-        utm_zone = int ((((x_max + x_min)/2.0) + 180.0 ) / 6.0 )
-        if int( (y_max + y_min)/2.0 ) >= int(0) :
-            hemisphere         = "N"
-            epsg_hemisphere_id = 6
-        else :
-            hemisphere         = "S"
-            epsg_hemisphere_id = 7
-        epsg_code_out = str(EPSG_UTM_WGS84) + str(epsg_hemisphere_id) + str(utm_zone)
-        logger.info("UTM zone  = " + str(utm_zone) + str(hemisphere))
-        logger.info("EPSG code = " + str(epsg_code_out))
-
-        # Execute coordinate transformation
-        target_srs       = osr.SpatialReference()
-        target_srs.ImportFromEPSG(int(epsg_code_out))
-        coordinate_trans = osr.CoordinateTransformation(source_srs,target_srs)
-
-        # Get points from array and tranform coordinates
-        fileUtm = open( file_utm, 'w')
-        for index in range(len(x)):
-            point = ogr.Geometry(ogr.wkbPoint)
-            point.AddPoint_2D( float(x[index]), float(y[index]) )
-            point.Transform(coordinate_trans)
-            line_out = str(point.GetX()) + " " + str(point.GetY()) + " " + str(z[index]) + "\n"
-            fileUtm.write(line_out)
-        fileUtm.close()
+        # Transformation is cached per UTM zone; points are transformed and written in chunks
+        coordinate_trans = getCoordTrans ( x_min, x_max, y_min, y_max, epsg_code_in )
+        nr_points_utm    = write_transformed_xyz ( file_utm, coordinate_trans, x, y, z )
+        logger.info( "Number of points transformed: " + str(nr_points_utm) )
 
         logger.info( "Coordinate transformation to UTM completed" )
 
@@ -1869,17 +1809,28 @@ def plot_im () :
 
         logger.info( "Build memory array" )
 
-        # Correct for too many rows or columns
+        # Raster gets all points; without cache the extent of all points is aggregated by the database, which does not depend on row order
+        if step > 1 and cache_entry is None :
+            extent = read_point_extent ( DbCursor, stmt, parameters, 1 )
+            x_min  = extent[ EXTENT_MINX ]
+            x_max  = extent[ EXTENT_MAXX ]
+            y_min  = extent[ EXTENT_MINY ]
+            y_max  = extent[ EXTENT_MAXY ]
+            z_min  = extent[ EXTENT_MINZ ]
+            z_max  = extent[ EXTENT_MAXZ ]
+
+        # Correct for too many rows or columns when limit is set
         gridsize        = PARAMETER_LIST_VALUE[ GRIDSIZE ]
-        limit_rows_cols = 500
-        if ( y_max - y_min ) > ( x_max - x_min ) :
-            max_rows_cols = int( ( y_max - y_min ) / gridsize )
-            if max_rows_cols > limit_rows_cols  :
-                gridsize = ( y_max - y_min ) / float( limit_rows_cols )
-        else :
-            max_rows_cols = int( ( x_max - x_min ) / gridsize )
-            if max_rows_cols > limit_rows_cols :
-                gridsize = ( x_max - x_min ) / float( limit_rows_cols )
+        limit_rows_cols = RASTER_LIMIT_ROWS_COLS
+        if limit_rows_cols is not None :
+            if ( y_max - y_min ) > ( x_max - x_min ) :
+                max_rows_cols = int( ( y_max - y_min ) / gridsize )
+                if max_rows_cols > limit_rows_cols  :
+                    gridsize = ( y_max - y_min ) / float( limit_rows_cols )
+            else :
+                max_rows_cols = int( ( x_max - x_min ) / gridsize )
+                if max_rows_cols > limit_rows_cols :
+                    gridsize = ( x_max - x_min ) / float( limit_rows_cols )
 
         logger.info( "Using gridsize "  + str(gridsize) )
 
@@ -1888,135 +1839,51 @@ def plot_im () :
         NrCols        = int ( round ( ( x_max - x_min ) / gridsize , 0 ) ) + 1
         gridsize      = float(gridsize)
         nodata_value  = int(-32767)
-        sum_depths    = numpy.zeros((NrRows, NrCols), numpy.float32)
-        sum_depths    = sum_depths + nodata_value
-        count_depths  = numpy.zeros((NrRows, NrCols), numpy.int8)
-        count_depths  = count_depths + 1
 
         logger.info( "Nr of rows in grid: " + str(NrRows) )
         logger.info( "Nr of cols in grid: " + str(NrCols) )
 
         logger.info("Start writing points to array")
 
-        # Loop through coordinates
-        for index in range(len(x)):
-
-            # Get row and column in array
-            latitude_row  = int ( round ( ( float(y[index]) - y_min  ) / gridsize , 0 ) )
-            longitude_col = int ( round ( ( float(x[index]) - x_min  ) / gridsize , 0 ) )
-
-            # Start counting rows from top
-            latitude_row = NrRows - latitude_row - 1
-
-            # Write values to array
-            if int ( sum_depths [latitude_row , longitude_col ] ) == int ( nodata_value ) :
-                sum_depths [latitude_row , longitude_col ]   = float(z[index])
-                count_depths [latitude_row , longitude_col ] = int(1)
+        # Aggregate points in cells of grid; average depth of points in cell
+        memory_map_dir = None
+        if NrRows * NrCols > RASTER_MEMORY_MAP_CELLS :
+            memory_map_dir = os.getcwd()
+            logger.info( "Grid is memory mapped in " + str(memory_map_dir) )
+        grid = GridAccumulator ( x_min, y_min, gridsize, NrRows, NrCols, ( GRID_MEAN, ), memory_map_dir )
+        if step > 1 :
+            # Plotted points are subsampled, so the raster gets all points in batches from the cache or the database
+            if cache_entry is not None :
+                batches = cache_entry.batches ( FETCH_ARRAYSIZE )
             else :
-                sum_depths [latitude_row , longitude_col ]    = float( sum_depths [latitude_row , longitude_col ] ) + float(z[index])
-                count_depths [latitude_row , longitude_col ]  = int ( count_depths [latitude_row , longitude_col ] ) + int(1)
+                batches = read_point_batches ( DbCursor, stmt, parameters, 1, FETCH_ARRAYSIZE )
+            for x_batch, y_batch, z_batch in batches :
+                grid.add ( x_batch, y_batch, z_batch )
+        else :
+            grid.add ( x, y, z )
+        logger.info( str(grid.nr_points) + " points written to array" )
 
         logger.info("Finish writing points to array")
 
-        # Build raster array
-        raster =  sum_depths / count_depths
-
         logger.info( "Building memory array completed" )
 
         ###################################
-        # Esri ascii grid
+        # Esri ascii grid and geotifs
         ###################################
 
-        logger.info( "Generate Esri Ascii grid" )
-
-        file_format = "AAIGrid"
-        mem_format  = "MEM"
-
-        # Write data array to memory
-        file_out    = str(im_name) + str(".asc")
-        driver      = gdal.GetDriverByName( mem_format )
-        logger.info ( get_gdal_create_option ( driver ) )
-        dst_ds      = driver.Create( file_out, NrCols, NrRows, 1, gdalconst.GDT_Float32)
-        dst_ds.SetGeoTransform( [ x_min, gridsize, 0.0, y_max, 0.0, -gridsize ] )
-        dst_ds.SetProjection( source_srs.ExportToWkt() )
-        dst_ds.GetRasterBand(1).SetNoDataValue( nodata_value )
-        dst_ds.GetRasterBand(1).WriteArray( raster )
-
-        # Write memory array to grid
-        driver     = gdal.GetDriverByName(file_format)
-        dst_ds_new = driver.CreateCopy(file_out, dst_ds)
-        dst_ds     = None
-        dst_ds_new = None
-
-        logger.info( "Generate Esri Ascii grid completed" )
-
-        ###################################
-        # Binary Geotif
-        ###################################
+        logger.info( "Generate Esri Ascii grid, binary geotif and RGBA geotif" )
 
-        logger.info( "Generate binary geotif" )
-
-        file_format    = "GTiff"
-        file_out       = str(im_name) + ".tif"
-        create_options = [ 'TFW=YES' ]
-
-        # Write memory array to grid
-        driver     = gdal.GetDriverByName( file_format )
-        logger.info ( get_gdal_create_option ( driver ) )
-        outDataset = driver.Create(file_out, NrCols, NrRows, 1, gdalconst.GDT_Float32, create_options )
-        outDataset.SetGeoTransform( [ x_min, gridsize ,0.0, y_max, 0.0, -gridsize ] )
-        outDataset.SetProjection( source_srs.ExportToWkt() )
-        outBand = outDataset.GetRasterBand(1) # 1-based index
-        outBand.WriteArray(raster, 0, 0)
-        outBand.FlushCache()
-        outDataset = None
-
-        logger.info( "Generate binary geotif completed" )
-
-        ###################################
-        # RGBA Geotif
-        ###################################
+        # All rasters are written in blocks of rows from the grid; RGBA geotif is colored with lookup table of color ramp
+        try :
+            lut       = build_lut( floatRgb, COLORMAP_ENTRIES )
+            read_rows = lambda row_start, row_end : grid.result_rows( GRID_MEAN, nodata_value, row_start, row_end )
+            files_out = write_rasters( im_name, read_rows, NrRows, NrCols
+                                     , [ x_min, gridsize, 0.0, y_max, 0.0, -gridsize ], source_srs.ExportToWkt(), nodata_value
+                                     , RASTER_FORMATS, z_min, z_max, lut, RASTER_BLOCK_ROWS, gdal.TermProgress_nocb )
+        finally :
+            grid.close()
 
-        logger.info( "Generate RGBA geotif" )
-
-        file_format = "GTiff"
-        file_out    = str(im_name) + "_RGBA.tif"
-
-        # Define memory array to grid
-        driver     = gdal.GetDriverByName( file_format )
-        outDataset = driver.Create(file_out, NrCols, NrRows, 3, gdalconst.GDT_Byte)
-        outDataset.SetGeoTransform( [ x_min, gridsize ,0.0, y_max, 0.0, -gridsize ] )
-        outDataset.SetProjection( source_srs.ExportToWkt() )
-
-        # Set RGBA value for raster bands
-        band1 = numpy.zeros((NrRows, NrCols), numpy.int8)
-        band2 = numpy.zeros((NrRows, NrCols), numpy.int8)
-        band3 = numpy.zeros((NrRows, NrCols), numpy.int8)
-        i = 0
-        for row in range(NrRows):
-            for col in range(NrCols):
-                z_value = raster[ row, col ]
-                #kwargs = {"mag": z_value, "cmin": z_min , "cmax": z_max}
-                #red, green, blue = range_to_rgb( **kwargs )
-                red, green, blue = range_to_rgb( mag=z_value, cmin=z_min, cmax=z_max )
-                band1[ row, col ] = red
-                band2[ row, col ] = green
-                band3[ row, col ] = blue
-                gdal.TermProgress_nocb( (float(i+1) / NrRows) )
-
-        # Get and write each band out
-        outBand1 = outDataset.GetRasterBand(1)
-        outBand2 = outDataset.GetRasterBand(2)
-        outBand3 = outDataset.GetRasterBand(3)
-        outBand1.WriteArray(band1, 0, 0)
-        outBand2.WriteArray(band2, 0, 0)
-        outBand3.WriteArray(band3, 0, 0)
-        outBand1.FlushCache()
-        outBand2.FlushCache()
-        outBand3.FlushCache()
-        outDataset = None
-
-        logger.info( "Generate RGBA geotif completed" )
+        logger.info( "Generated files: " + str(files_out.values()) )
 
     ###################################
     # Plot image
@@ -2042,6 +1909,10 @@ def plot_im () :
         pylab.show()
         
 
+    # Release memory maps of cached points
+    if cache_entry is not None :
+        cache_entry.close()
+
     # Finally close database connection
     DbConnection.close()
 
@@ -2061,6 +1932,10 @@ if __name__ == "__main__":
     formatter   = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
     stream_hdlr.setFormatter(formatter)
     logger.addHandler(stream_hdlr)
+    logging.getLogger( EMODNET_grid.MODULE_NAME ).setLevel( level )
+    logging.getLogger( EMODNET_grid.MODULE_NAME ).addHandler( stream_hdlr )
+    logging.getLogger( EMODNET_cache.MODULE_NAME ).setLevel( level )
+    logging.getLogger( EMODNET_cache.MODULE_NAME ).addHandler( stream_hdlr )
 
     # Start gui
     gui_start ()
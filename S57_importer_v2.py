@@ -10,10 +10,17 @@
 ###################################################
 
 # standard library imports
+import os
+import re
 import sys
+import array
+import struct
 import logging
+import collections
+import multiprocessing
 
 # related third party imports
+import numpy
 import cx_Oracle
 from easygui import *
 #import pylab
@@ -29,6 +36,16 @@ DB_USER_SOURCE       = "DB_USER_SOURCE"
 DB_PASSWORD_SOURCE   = "DB_PASSWORD_SOURCE"
 DB_TNS_SOURCE        = "DB_TNS_SOURCE"
 S57_FILE             = "S57 file"
+S57_NR_PROCESSES     = None # number of processes to read cells in batch mode; None is number of CPUs
+S57_CELLS_PER_PROCESS = 2   # number of cells per process read ahead in batch mode; limits cells held in memory
+
+# Extension of base cells and name of exchange set catalog
+S57_BASE_CELL_EXTENSION = ".000"
+S57_CATALOG             = "CATALOG.031"
+
+# Status of cells in batch mode
+CELL_IMPORTED = "IMPORTED"
+CELL_FAILED   = "FAILED"
 
 # Database connection parameter values
 PARAMETER_LIST_VALUE = {}
@@ -49,11 +66,13 @@ OBJECT_CLASS[ "C_ASSO" ] = 401
 
 # Database parameters
 SRID = 8307
+SPATIAL_BATCH_SIZE = 10000 # number of geometries per executemany
 GTYPE = {}
 GTYPE [ "POINT" ]           = 2001
 GTYPE [ "LINESTRING" ]      = 2002
 GTYPE [ "POLYGON" ]         = 2003
 GTYPE [ "MULTIPOINT" ]      = 2005
+GTYPE [ "MULTIPOINT Z" ]    = 3005
 GTYPE [ "MULTILINESTRING" ] = 2006
 GTYPE [ "MULTIPOLYGON" ]    = 2007
 
@@ -63,6 +82,12 @@ VC   = 'ConnectedNode'
 VE   = 'Edge'
 DSID = 'DSID'
 
+# Type of spatial by record name (RCNM) in feature-spatial relations
+SPATIAL_TYPE = {}
+SPATIAL_TYPE [ 110 ] = VI
+SPATIAL_TYPE [ 120 ] = VC
+SPATIAL_TYPE [ 130 ] = VE
+
 # Attributes of features
 RECORD_ID  = 'RCID'
 LONG_NAME  = 'LNAM'
@@ -79,6 +104,7 @@ END_TOPI   = "TOPI_1"
 END_MASK   = "MASK_1"
 OBJCL_ID   = "OBJL"
 SPAT_FS    = "NAME_RCID"
+RCNM_FS    = "NAME_RCNM"
 ORNT_FS    = "ORNT"
 USAG_FS    = "USAG"
 MASK_FS    = "MASK"
@@ -90,6 +116,16 @@ NOED       = "DSSI_NOED"
 CELL_NAME  = "DSID_DSNM"
 CELL_ID    = "DSID_RCID"
 
+# ISO WKB types of 3D points and multipoints (soundings)
+WKB_POINT_Z      = 1001
+WKB_MULTIPOINT_Z = 1004
+
+# Options of S57 driver to read spatials and features in one pass
+S57_OPTIONS = 'RETURN_PRIMITIVES:ON,RETURN_LINKAGES:ON'
+
+# Logger; also used by worker processes in batch mode
+logger = logging.getLogger(MODULE)
+
 #########################################
 #  Generic functions
 #########################################
@@ -110,6 +146,160 @@ def start_logging () :
         print "Start logging failed"
         raise
 
+#########################################
+#  Record Class
+#########################################
+
+# Record of S57 file
+class S57Record ( object ) :
+    """Record of S57 file with typed fields; coordinates are kept as array of x, y (and z of 3D multipoints) per part of geometry"""
+
+    __slots__ = ( 'record_id', 'fields', 'gtype', 'parts' )
+
+    def __init__ ( self, record_id, fields, gtype = None, parts = None ) :
+        self.record_id = record_id
+        self.fields    = fields
+        self.gtype     = gtype
+        self.parts     = parts
+
+    def has_geometry ( self ) :
+        """Function to check if record has a geometry"""
+        return self.gtype is not None
+
+    def point ( self ) :
+        """Function to get x and y of first coordinate of record"""
+        return self.parts[0][0], self.parts[0][1]
+
+    def __getstate__ ( self ) :
+        return ( self.record_id, self.fields, self.gtype, self.parts )
+
+    def __setstate__ ( self, state ) :
+        self.record_id, self.fields, self.gtype, self.parts = state
+
+# Get typed value of field of OGR feature
+def field_value ( feature, j ) :
+    field_type = feature.GetFieldDefnRef(j).GetType()
+    if field_type == ogr.OFTInteger :
+        return feature.GetFieldAsInteger(j)
+    if field_type == ogr.OFTIntegerList :
+        return feature.GetFieldAsIntegerList(j)
+    if field_type == ogr.OFTStringList :
+        return [ str(value) for value in feature.GetFieldAsStringList(j) ]
+    return str(feature.GetFieldAsString(j))
+
+# Get spatial code of spatial record; RCIDs are only unique within a cell, so the code starts with the cell name
+def spatial_code ( cell_name, spatial_type, record_id ) :
+    return str(cell_name) + "_" + str(spatial_type) + str(record_id)
+
+# Get string of (list) field value as in attribute string
+def field_string ( value ) :
+    if isinstance( value, list ) :
+        return ",".join( [ str(v) for v in value ] )
+    return str(value)
+
+# Get coordinate arrays of parts of OGR geometry; z is kept for dimension 3
+def geometry_parts ( ogr_geom, dimension = 2 ) :
+    if ogr_geom.GetGeometryCount() == 0 :
+        coordinates = array.array( 'd' )
+        for i in range(ogr_geom.GetPointCount()) :
+            coordinates.append( ogr_geom.GetX(i) )
+            coordinates.append( ogr_geom.GetY(i) )
+            if dimension == 3 :
+                coordinates.append( ogr_geom.GetZ(i) )
+        return [ coordinates ]
+    parts = []
+    for i in range(ogr_geom.GetGeometryCount()) :
+        parts.extend( geometry_parts( ogr_geom.GetGeometryRef(i), dimension ) )
+    return parts
+
+# Get geometry type of OGR geometry; multipoints with depths (soundings) are 3D
+def geometry_type ( ogr_geom ) :
+    gtype = str(ogr_geom.GetGeometryName())
+    if gtype == 'MULTIPOINT' and ogr_geom.GetCoordinateDimension() == 3 :
+        return 'MULTIPOINT Z'
+    return gtype
+
+# Get WKB of linestring or (3D) multipoint record from its coordinate arrays
+def record_wkb ( record ) :
+    if record.gtype == 'LINESTRING' :
+        coordinates = record.parts[0]
+        return struct.pack( '<BII', 1, ogr.wkbLineString, len(coordinates) // 2 ) + struct.pack( '<' + str(len(coordinates)) + 'd', *coordinates )
+    if record.gtype == 'MULTIPOINT' :
+        wkb = [ struct.pack( '<BII', 1, ogr.wkbMultiPoint, len(record.parts) ) ]
+        for coordinates in record.parts :
+            wkb.append( struct.pack( '<BIdd', 1, ogr.wkbPoint, coordinates[0], coordinates[1] ) )
+        return "".join( wkb )
+    if record.gtype == 'MULTIPOINT Z' :
+        wkb = [ struct.pack( '<BII', 1, WKB_MULTIPOINT_Z, len(record.parts) ) ]
+        for coordinates in record.parts :
+            wkb.append( struct.pack( '<BIddd', 1, WKB_POINT_Z, coordinates[0], coordinates[1], coordinates[2] ) )
+        return "".join( wkb )
+    raise ValueError( "No WKB for geometry type " + str(record.gtype) )
+
+#########################################
+#  Edge Coordinates Class
+#########################################
+
+# Coordinates of all edges of a cell in one vertex buffer
+class EdgeCoordinates :
+    """Vertices of all edges in one contiguous array of x, y; vertices of edge k are vertices[ offsets[k]:offsets[k+1] ]"""
+
+    def __init__ ( self, record_ids, vertices, offsets ) :
+        self.record_ids = record_ids
+        self.vertices   = vertices
+        self.offsets    = offsets
+
+    def __len__ ( self ) :
+        return len(self.record_ids)
+
+    def edge ( self, k ) :
+        """Function to get array of x, y of vertices of edge k"""
+        return self.vertices[ self.offsets[k]:self.offsets[k+1] ]
+
+    def wkb ( self, k ) :
+        """Function to get 2D WKB of edge k from vertex buffer"""
+        return struct.pack( '<BII', 1, ogr.wkbLineString, self.offsets[k+1] - self.offsets[k] ) + self.edge( k ).tostring()
+
+# Assemble edges from inner vertices of ve and start and end vc
+def assemble_edges ( ve_dict, vc_dict ) :
+
+    # Coordinates of vc looked up by index of RCID in sorted array of RCIDs
+    vc_ids = numpy.array( sorted( vc_dict.keys() ), numpy.int64 )
+    vc_xy  = numpy.array( [ vc_dict[ key ].point() for key in vc_ids ], numpy.float64 ).reshape( -1, 2 )
+
+    # Inner vertices of all ve in one buffer with offsets per ve
+    record_ids   = sorted( ve_dict.keys() )
+    inner_counts = numpy.zeros( len(record_ids), numpy.int64 )
+    start_vc     = numpy.zeros( len(record_ids), numpy.int64 )
+    end_vc       = numpy.zeros( len(record_ids), numpy.int64 )
+    buffers      = []
+    for k, key in enumerate( record_ids ) :
+        ve = ve_dict[ key ]
+        start_vc[k] = int( ve.fields[ START_VC ] )
+        end_vc[k]   = int( ve.fields[ END_VC ] )
+        if ve.parts is not None :
+            buffers.append( ve.parts[0].tostring() )
+            inner_counts[k] = len( ve.parts[0] ) // 2
+    inner = numpy.frombuffer( "".join( buffers ), numpy.float64 ).reshape( -1, 2 )
+
+    # Index of start and end vc
+    start_index = numpy.searchsorted( vc_ids, start_vc )
+    end_index   = numpy.searchsorted( vc_ids, end_vc )
+    for index, vc_rcid in ( ( start_index, start_vc ), ( end_index, end_vc ) ) :
+        found = index < len(vc_ids)
+        found[ found ] = vc_ids[ index[ found ] ] == vc_rcid[ found ]
+        if not found.all() :
+            raise KeyError( "Connected node " + str( vc_rcid[ ~found ][0] ) + " of edge not found" )
+
+    # Each edge gets start vc, inner vertices and end vc
+    offsets  = numpy.concatenate( ( [ 0 ], numpy.cumsum( inner_counts + 2 ) ) ).astype( numpy.int64 )
+    vertices = numpy.empty( ( offsets[-1], 2 ), '<f8' )
+    vertices[ offsets[:-1] ]    = vc_xy[ start_index ]
+    vertices[ offsets[1:] - 1 ] = vc_xy[ end_index ]
+    inner_offsets = numpy.concatenate( ( [ 0 ], numpy.cumsum( inner_counts ) ) )
+    vertices[ numpy.arange( len(inner) ) + numpy.repeat( offsets[:-1] + 1 - inner_offsets[:-1], inner_counts ) ] = inner
+    return EdgeCoordinates( record_ids, vertices, offsets )
+
 #########################################
 #  Database Class
 #########################################
@@ -135,7 +325,7 @@ class DbConnectionClass:
             self.logger.critical("Setup db connection failed: ERROR: " + str(err))
             raise
 
-    def store_spatials ( self, spat_dict, spatial_type ) :
+    def store_spatials ( self, spat_dict, spatial_type, cell_name ) :
 
         # INSERT INTO ndb_spatial_object
         # ( spatial_code,
@@ -149,70 +339,67 @@ class DbConnectionClass:
         # )
 
 
-        # For points a bulk insert is possible
-        # Edges have to be inserted one-by-one
+        # Points are bulk inserted with their ordinates
+        # Edges and multipoints are bulk inserted as WKB
         try: 
 
             self.logger.info("Store " + spatial_type + "s")
             spat_list = []
+            geom_list = []
             nr_spatials = 0
 
-            if spatial_type == VE :
-
-                # Write nodes to list
-                for key in spat_dict :
+            # Write nodes to point list and edges and multipoints to geometry list
+            for key in spat_dict :
+                spat = spat_dict[key]
+                if spat.gtype == 'POINT' :
+                    x, y = spat.point()
+                    spat_list.append ( ( spatial_code( cell_name, spatial_type, key ), x, y ) )
+                else :
+                    geom_list.append ( ( spatial_code( cell_name, spatial_type, key ), record_wkb( spat ) ) )
+                nr_spatials = nr_spatials + 1
 
-                    # Write geometry to CLOB
-                    spat = spat_dict[key]
-                    geom = ogr.CreateGeometryFromWkt(str(spat[GEOMETRY]))
-                    geom.FlattenTo2D()
-                    geom_clob = self.oracle_cursor.var(cx_Oracle.CLOB)
-                    geom_clob.setvalue(0, str(geom.ExportToWkt()))
+            # Now prepare and execute the insert of points
+            if len(spat_list) > 0 :
+                stmt = "insert into ndb_spatial_object ( spatial_code, hordat, posacc, quapos, geometry, tech_start_date, tech_date_last_mutation, tech_sess_last_mutation ) "
+                stmt = stmt + " values ( :1, null, null, null, sdo_geometry( 2001, " + str(SRID) + ", null, sdo_elem_info_array(1,1,1), sdo_ordinate_array( :2, :3 ) ) , sysdate, sysdate, " + str(self.session_id) + " ) "
+                self.oracle_cursor.prepare( stmt )
+                self.oracle_cursor.executemany(None, spat_list)
 
-                    # Now insert each edge one-by-one
-                    stmt = "insert into ndb_spatial_object ( spatial_code, hordat, posacc, quapos, geometry, tech_start_date, tech_date_last_mutation, tech_sess_last_mutation ) "
-                    stmt = stmt + " values ( :1, null, null, null, sdo_geometry( :2, " + str(SRID) + " ), sysdate, sysdate, " + str(self.session_id) + " ) "
-                    self.oracle_cursor.execute( stmt, { '1' : str(spatial_type) + str(key), '2' : geom_clob } )
-                    nr_spatials = nr_spatials + 1
+            # Now insert the other geometries as WKB
+            self.insert_wkb ( geom_list )
 
-            else :
-            
-                # Write nodes to list (multipoints are scripped)
-                for key in spat_dict :
-
-                    # Get x and y coordinate
-                    spat = spat_dict[key]
-                    geom = ogr.CreateGeometryFromWkt(spat[GEOMETRY])
-                    if geom.GetGeometryType() == ogr.wkbPoint : 
-                        # Add point to array to insert
-                        spat_list.append ( (str(spatial_type) + str(key), geom.GetX(0), geom.GetY(0)  ) )
-                        nr_spatials = nr_spatials + 1
-                    else :
-                        # Insert multipoint one-by-one
-                        geom.FlattenTo2D()
-                        geom_clob = self.oracle_cursor.var(cx_Oracle.CLOB)
-                        geom_clob.setvalue(0, str(geom.ExportToWkt()))
-                        stmt = "insert into ndb_spatial_object ( spatial_code, hordat, posacc, quapos, geometry, tech_start_date, tech_date_last_mutation, tech_sess_last_mutation ) "
-                        stmt = stmt + " values ( :1, null, null, null, sdo_geometry( :2, " + str(SRID) + " ), sysdate, sysdate, " + str(self.session_id) + " ) "
-#                        self.oracle_cursor.execute( stmt, { '1' : str(spatial_type) + str(key), '2' : geom_clob } )
-                        nr_spatials = nr_spatials + 1       
-                        self.logger.info("Multipoint inserted")
-
-                # Now prepare and execute the insert
-                if len(spat_list) > 0 :
-                    stmt = "insert into ndb_spatial_object ( spatial_code, hordat, posacc, quapos, geometry, tech_start_date, tech_date_last_mutation, tech_sess_last_mutation ) "
-                    stmt = stmt + " values ( :1, null, null, null, sdo_geometry( 2001, " + str(SRID) + ", null, sdo_elem_info_array(1,1,1), sdo_ordinate_array( :2, :3 ) ) , sysdate, sysdate, " + str(self.session_id) + " ) "
-                    self.oracle_cursor.prepare( stmt )
-                    self.oracle_cursor.executemany(None, spat_list)
-
-            self.logger.info( str(nr_spatials) + " " + spatial_type + "s inserted" )
+            self.logger.info( str(nr_spatials) + " " + spatial_type + "s inserted (" + str(len(geom_list)) + " as WKB)" )
             
         except Exception, err:
             self.logger.critical("Store " + spatial_type + "s in db failed: ERROR: " + str(err))
             raise
 
 
-    def store_features ( self, features_list ) :
+    def store_edges ( self, edges, cell_name ) :
+
+        # Edges are bulk inserted as WKB taken from the vertex buffer of all edges
+        try: 
+
+            self.logger.info("Store " + VE + "s")
+            geom_list = [ ( spatial_code( cell_name, VE, edges.record_ids[k] ), edges.wkb(k) ) for k in xrange(len(edges)) ]
+            self.insert_wkb ( geom_list )
+            self.logger.info( str(len(geom_list)) + " " + VE + "s inserted" )
+            
+        except Exception, err:
+            self.logger.critical("Store " + VE + "s in db failed: ERROR: " + str(err))
+            raise
+
+    def insert_wkb ( self, geom_list ) :
+        """Function to insert list of spatial code and WKB in batches; WKB is bound as BLOB"""
+        if len(geom_list) > 0 :
+            stmt = "insert into ndb_spatial_object ( spatial_code, hordat, posacc, quapos, geometry, tech_start_date, tech_date_last_mutation, tech_sess_last_mutation ) "
+            stmt = stmt + " values ( :1, null, null, null, sdo_geometry( :2, " + str(SRID) + " ), sysdate, sysdate, " + str(self.session_id) + " ) "
+            self.oracle_cursor.prepare( stmt )
+            self.oracle_cursor.setinputsizes( None, cx_Oracle.BLOB )
+            for start in xrange( 0, len(geom_list), SPATIAL_BATCH_SIZE ) :
+                self.oracle_cursor.executemany(None, geom_list[ start:start + SPATIAL_BATCH_SIZE ])
+
+    def store_features ( self, features_list, cell_name ) :
 
         # INSERT INTO ndb_feature_object
         # ( feature_code
@@ -236,14 +423,15 @@ class DbConnectionClass:
             for feature_type_dict in features_list :
                 for feature_id in feature_type_dict :
                     # Process feature instance and add to insert list
-                    feature = feature_type_dict[feature_id]
+                    record = feature_type_dict[feature_id]
+                    feature = record.fields
                     attribute_string = ""
                     object_class_id = int(feature[OBJCL_ID])
+                    feature_gtype = None
                     # Get feature-spatial relations if object class has geometry
-                    if feature.has_key(GEOMETRY) : #object_class_id not in ( OBJECT_CLASS[ "C_AGGR" ], OBJECT_CLASS[ "C_ASSO" ]) :
-                        geom = ogr.CreateGeometryFromWkt(feature[GEOMETRY])
-                        feature_gtype = GTYPE[ str(geom.GetGeometryName())]
-                        feat_spat_rel_list.append( ( feature_id, feature[SPAT_FS], feature[ORNT_FS], feature[USAG_FS], feature[USAG_FS] ) )
+                    if record.has_geometry() : #object_class_id not in ( OBJECT_CLASS[ "C_AGGR" ], OBJECT_CLASS[ "C_ASSO" ]) :
+                        feature_gtype = GTYPE[ record.gtype ]
+                        feat_spat_rel_list.append( ( feature_id, feature[RCNM_FS], feature[SPAT_FS], feature[ORNT_FS], feature[USAG_FS], feature[MASK_FS] ) )
                     # Get feature-feature relations if feature has relations with other features
                     if feature.has_key(FF_REL_REF) :
                         feat_feat_rel_list.append( ( feature_id, feature[FF_REL_REF], feature[FF_REL_TYP] ) )
@@ -251,7 +439,7 @@ class DbConnectionClass:
                     for attribute in feature :
                         attribute_value = feature[ attribute ]
                         if len(attribute) == 6 :
-                            attribute_string = attribute_string + str(attribute) + str(attribute_value) + "|"
+                            attribute_string = attribute_string + str(attribute) + field_string(attribute_value) + "|"
                     attribute_string_list.append( ( feature_id, object_class_id, attribute_string ) )
                     feature_insert_list.append( ( str(feature_id), object_class_id,  feature_gtype ) ) 
                     nr_features = nr_features + 1
@@ -273,7 +461,7 @@ class DbConnectionClass:
 #                print attribute_insert[2]
 
             # Now insert the feature spatial relations
-            self.store_feature_spatial_relations ( feat_spat_rel_list )
+            self.store_feature_spatial_relations ( feat_spat_rel_list, cell_name )
 
             # Now insert the feature feature relations
             self.store_feature_feature_relations ( feat_feat_rel_list )            
@@ -283,7 +471,7 @@ class DbConnectionClass:
             raise        
 
 
-    def store_spatial_spatial_relations ( self, ve_dict ) :
+    def store_spatial_spatial_relations ( self, ve_dict, cell_name ) :
 
         # INSERT INTO ndb_spat_spat_relation
         # ( id
@@ -308,9 +496,10 @@ class DbConnectionClass:
             
             # Write spat-spat (VE to start VC and to end VC) relations to list
             for key in ve_dict :
-                ve = ve_dict[key]
-                spat_spat_rel_list.append ( ( str(VE) + str(key), str(VC) + str(ve[START_VC]), str(ve[START_TOPI]), str(ve[START_ORNT]), str(ve[START_USAG]), str(ve[START_MASK]), str(ve[START_TOPI]) ) )
-                spat_spat_rel_list.append ( ( str(VE) + str(key), str(VC) + str(ve[END_VC])  , str(ve[END_TOPI])  , str(ve[END_ORNT])  , str(ve[END_USAG])  , str(ve[END_MASK])  , str(ve[END_TOPI])     ) )
+                ve = ve_dict[key].fields
+                ve_code = spatial_code( cell_name, VE, key )
+                spat_spat_rel_list.append ( ( ve_code, spatial_code( cell_name, VC, ve[START_VC] ), str(ve[START_TOPI]), str(ve[START_ORNT]), str(ve[START_USAG]), str(ve[START_MASK]), str(ve[START_TOPI]) ) )
+                spat_spat_rel_list.append ( ( ve_code, spatial_code( cell_name, VC, ve[END_VC] )  , str(ve[END_TOPI])  , str(ve[END_ORNT])  , str(ve[END_USAG])  , str(ve[END_MASK])  , str(ve[END_TOPI])     ) )
                 nr_spat_spat_rel = nr_spat_spat_rel + 2
 
             # Now prepare and execute the insert                
@@ -326,7 +515,7 @@ class DbConnectionClass:
             raise
 
 
-    def store_feature_spatial_relations ( self, feature_spatial_rel_list ) :
+    def store_feature_spatial_relations ( self, feature_spatial_rel_list, cell_name ) :
 
 
         # INSERT INTO ndb_feat_spat_relation
@@ -341,10 +530,11 @@ class DbConnectionClass:
         # , tech_sess_last_mutation        
         # )
 
-        # SPAT_FS: (8:834,878,995,996,761,823,709,713)
-        # ORNT_FS: (8:2,2,1,1,2,2,2,1)
-        # USAG_FS: (8:1,1,1,1,1,1,1,2)
-        # MASK_FS: (8:2,2,2,2,2,2,2,2)
+        # RCNM_FS: [130,130,130,130,130,130,130,130]
+        # SPAT_FS: [834,878,995,996,761,823,709,713]
+        # ORNT_FS: [2,2,1,1,2,2,2,1]
+        # USAG_FS: [1,1,1,1,1,1,1,2]
+        # MASK_FS: [2,2,2,2,2,2,2,2]
 
         # Store the feature spatial relations
         try:
@@ -353,18 +543,19 @@ class DbConnectionClass:
             feat_spat_rel_list = []
             nr_feat_spat_rel = 0
 
-            # Loop over list with fs relations; get relation array and convert array to insert statement
+            # Loop over list with fs relations; relation lists are parsed when read from file
             # In Python list index first element = 0; Pointer index nr starts at 1
-            # Remove ) from last entry of list 
             for fs_relations in feature_spatial_rel_list :
                 feature_id = fs_relations[0]
-                spat_list = fs_relations[1].rstrip().split( ":" )[1][:-1].rstrip().split(",")
-                ornt_list = fs_relations[2].rstrip().split( ":" )[1][:-1].rstrip().split(",")
-                usag_list = fs_relations[3].rstrip().split( ":" )[1][:-1].rstrip().split(",")
-                mask_list = fs_relations[4].rstrip().split( ":" )[1][:-1].rstrip().split(",")
+                rcnm_list = fs_relations[1]
+                spat_list = fs_relations[2]
+                ornt_list = fs_relations[3]
+                usag_list = fs_relations[4]
+                mask_list = fs_relations[5]
                 pointer_index_nr = 0
                 while pointer_index_nr < len(spat_list) :
-                    feat_spat_rel_list.append( ( feature_id, spat_list[pointer_index_nr], pointer_index_nr + 1, ornt_list[pointer_index_nr], usag_list[pointer_index_nr], mask_list[pointer_index_nr] ) )
+                    spat_code = spatial_code( cell_name, SPATIAL_TYPE[ rcnm_list[pointer_index_nr] ], spat_list[pointer_index_nr] )
+                    feat_spat_rel_list.append( ( feature_id, spat_code, pointer_index_nr + 1, ornt_list[pointer_index_nr], usag_list[pointer_index_nr], mask_list[pointer_index_nr] ) )
                     pointer_index_nr = pointer_index_nr + 1
                     nr_feat_spat_rel = nr_feat_spat_rel + 1
 
@@ -391,8 +582,8 @@ class DbConnectionClass:
         # , tech_sess_last_mutation        
         # )
 
-        # FF_REL_REF = (2:022631548D950001,0226243636EF0001)
-        # FF_REL_TYP = (2:2,2)
+        # FF_REL_REF = [022631548D950001,0226243636EF0001]
+        # FF_REL_TYP = [2,2]
 
         try :
             
@@ -400,13 +591,11 @@ class DbConnectionClass:
             feat_feat_rel_list = []
             nr_feat_feat_rel = 0
 
-            # Loop over list with ff relations; get relation array and convert array to insert statement
-            # In Python list index first element = 0; Pointer index nr starts at 1
-            # Remove ) from last entry of list             
+            # Loop over list with ff relations; relation lists are parsed when read from file
             for ff_relations in feature_feature_rel_list :
                 feature_id = ff_relations[0]
-                feat_list = ff_relations[1].rstrip().split( ":" )[1][:-1].rstrip().split(",")
-                ftyp_list = ff_relations[2].rstrip().split( ":" )[1][:-1].rstrip().split(",")
+                feat_list = ff_relations[1]
+                ftyp_list = ff_relations[2]
                 i = 0
                 while i < len(feat_list) :
                     feat_feat_rel_list.append( ( feature_id, feat_list[i], ftyp_list[i] ) )
@@ -426,6 +615,14 @@ class DbConnectionClass:
             raise 
             
 
+    def commit( self ) :
+        """Function to commit"""
+        self.oracle_connection.commit()
+
+    def rollback( self ) :
+        """Function to rollback"""
+        self.oracle_connection.rollback()
+
     def rollback_close( self ) :
         """Function to rollback and close connection"""
         self.oracle_connection.rollback()
@@ -452,6 +649,19 @@ def gui_db_parameters() :
         PARAMETER_LIST_VALUE [DB_USER_SOURCE]     = return_values[1]
         PARAMETER_LIST_VALUE [DB_PASSWORD_SOURCE] = return_values[2]      
 
+# Get database connection parameters without gui from environment variables and connect string user/password@tns
+def batch_db_parameters ( connect_string = None ) :
+    for parameter in [ DB_USER_SOURCE, DB_PASSWORD_SOURCE, DB_TNS_SOURCE ] :
+        if os.environ.has_key( parameter ) :
+            PARAMETER_LIST_VALUE [parameter] = os.environ[ parameter ]
+    if connect_string is not None :
+        match = re.match( r"^([^/@]+)/(.*)@([^@]+)$", connect_string )
+        if match is None :
+            raise ValueError( "Connect string is not user/password@tns" )
+        PARAMETER_LIST_VALUE [DB_USER_SOURCE]     = match.group(1)
+        PARAMETER_LIST_VALUE [DB_PASSWORD_SOURCE] = match.group(2)
+        PARAMETER_LIST_VALUE [DB_TNS_SOURCE]      = match.group(3)
+
 # Function to build gui for file selection
 def gui_file_selection ( box_title, file_parameter ) :
     title = box_title
@@ -603,28 +813,45 @@ def show_s57_file ( file_name ) :
 #  Import S57 Functions
 #########################################
     
-def import_s57_file ( file_name ) :
-    
+def open_s57_file ( file_name ) :
+
     # Read S57 file options:
     # RETURN_PRIMITIVES => VI, VE and VC layers as features
     # RETURN_LINKAGES   => FS relations are included as attribute of feature
     # LNAM_REF          => FF relations are included as sttribute of feature
-
-    # Open S57 file to read spatials with SS relations
-    logger.info("Open S57 file to read spatials with SS relations")
+    # Both options are set together, so the file is parsed only once for spatials and features
     gdal.SetConfigOption( 'OGR_S57_OPTIONS', '' )
-    gdal.SetConfigOption( 'OGR_S57_OPTIONS', 'RETURN_PRIMITIVES:ON' )   
-   
+    gdal.SetConfigOption( 'OGR_S57_OPTIONS', S57_OPTIONS )
+    logger.info("GDAL options: " + str(gdal.GetConfigOption( 'OGR_S57_OPTIONS')))
+
     # Open s57 FILE
-    ds = ogr.Open( PARAMETER_LIST_VALUE [ S57_FILE ] )
+    ds = ogr.Open( str(file_name) )
+    if ds is None :
+        raise IOError( "S57 file " + str(file_name) + " could not be opened" )
+    return ds
+
+
+# Spatials of a S57 cell
+class S57Cell :
+    """Cell header, primitives and assembled edges of a S57 cell; feature types are added when read in batch mode"""
+
+    def __init__ ( self, file_name, dsid_dict, vi_dict, vc_dict, ve_dict, edges ) :
+        self.file_name     = file_name
+        self.dsid_dict     = dsid_dict
+        self.vi_dict       = vi_dict
+        self.vc_dict       = vc_dict
+        self.ve_dict       = ve_dict
+        self.edges         = edges
+        self.feature_types = None
+
+
+def read_s57_spatials ( ds, file_name ) :
 
     # Write cell header to dictionary
     logger.info("Write cell header to dictionary")
     dsid_dict = write_cell_header_dict ( ds.GetLayerByName( DSID ) )
 
     # Show cell charactertics
-    uuid_cell = uuid.uuid1()
-    logger.info("UUID of cell: " + str(uuid_cell))
     logger.info("Name of cell to import: " + str(dsid_dict[CELL_NAME]))
     logger.info("Number of isolated nodes in file: " + str(dsid_dict[NOIN])) 
     logger.info("Number of connected nodes in file: " + str(dsid_dict[NOCN]))   
@@ -642,63 +869,164 @@ def import_s57_file ( file_name ) :
     logger.info("Read edges from file")
     ve_dict = write_features_to_dict ( ds.GetLayerByName( VE ), RECORD_ID )
 
-    # Test if dictionaries are correct 
-    #print "VI: " + str(vi_dict[1170])
-    #print "VC start: " + str(vc_dict[7054])
-    #print "VC end: " + str(vc_dict[7072])
-    #print "VE before: " + str(ve_dict[9700])
-
     # Add connected nodes to edge
     logger.info("Add start and end connected node to edge")
-    ve_dict = add_vc_to_ve ( ve_dict, vc_dict )
+    edges = assemble_edges ( ve_dict, vc_dict )
+
+    return S57Cell ( file_name, dsid_dict, vi_dict, vc_dict, ve_dict, edges )
 
-    #print "VE updated: " + str(ve_dict[9700])    
 
-    # Store spatials in database
+def store_s57_spatials ( db_connection, cell ) :
+
+    # Store spatials in database; spatial codes start with the cell name
     logger.info("Store spatials in db") 
-    OracleConnection.store_spatials ( vi_dict, VI )   
-    OracleConnection.store_spatials ( vc_dict, VC )   
-    OracleConnection.store_spatials ( ve_dict, VE )                                                 
+    cell_name = cell.dsid_dict[CELL_NAME]
+    db_connection.store_spatials ( cell.vi_dict, VI, cell_name )   
+    db_connection.store_spatials ( cell.vc_dict, VC, cell_name )   
+    db_connection.store_edges ( cell.edges, cell_name )                                                 
 
     # Store SS relations in database
     logger.info("Store spatial-spatial relations in db")     
-    OracleConnection.store_spatial_spatial_relations ( ve_dict ) 
-    
-    # Close file
-    ds.Destroy()
-
+    db_connection.store_spatial_spatial_relations ( cell.ve_dict, cell_name ) 
     logger.info("Spatials and spatial-spatial relations stored in db") 
 
-    # Open S57 file to read features with FS relations
-    logger.info("Open S57 file to read features with FS relations")
-    gdal.SetConfigOption( 'OGR_S57_OPTIONS', '' )
-    gdal.SetConfigOption( 'OGR_S57_OPTIONS', 'RETURN_LINKAGES:ON'  )  
 
-    # Open s57 FILE
-    ds = ogr.Open( PARAMETER_LIST_VALUE [ S57_FILE ] )    
+def import_s57_file ( file_name ) :
 
-    # Write features to list
-    logger.info("Read features from file")
-    fe_list = write_features_to_list ( ds )
+    # Open S57 file to read spatials with SS relations and features with FS relations
+    logger.info("Open S57 file to read spatials and features")
+    ds = open_s57_file ( file_name )
+    uuid_cell = uuid.uuid1()
+    logger.info("UUID of cell: " + str(uuid_cell))
 
-    # Write features to db
-    logger.info("Store features in db")
-    OracleConnection.store_features ( fe_list ) 
+    # Read and store spatials
+    cell = read_s57_spatials ( ds, file_name )
+    cell_name = cell.dsid_dict[CELL_NAME]
+    store_s57_spatials ( OracleConnection, cell )
+
+    # Spatials are not needed anymore
+    del cell
+
+    # Read features from same open file and store them in db per feature type
+    logger.info("Read features from file and store in db")
+    nr_feature_types = 0
+    for feature_type_dict in read_feature_types ( ds ) :
+        OracleConnection.store_features ( [ feature_type_dict ], cell_name ) 
+        nr_feature_types = nr_feature_types + 1
+    logger.info(str(nr_feature_types) + " feature types read from file")
                          
     # Close file
     ds.Destroy()
 
 
-def write_features_to_list ( s57_file ) :
-
-    feature_type_list = []
+#########################################
+#  Batch Import Functions
+#########################################
 
-    # Loop over feature types in file
+def find_s57_cells ( path ) :
+    """Function to get base cells in directory tree or listed in exchange set catalog"""
+    cells = []
+    if os.path.isdir( path ) :
+        for dir_name, sub_dirs, file_names in os.walk( path ) :
+            for file_name in file_names :
+                if os.path.splitext( file_name )[1] == S57_BASE_CELL_EXTENSION :
+                    cells.append( os.path.join( dir_name, file_name ) )
+    else :
+        # Catalog is ISO 8211 file; file names in CATD records are relative to catalog with \ as separator
+        fIn = open( path, 'rb' )
+        try :
+            catalog = fIn.read()
+        finally :
+            fIn.close()
+        catalog_dir = os.path.dirname( os.path.abspath( path ) )
+        for catalog_file in re.findall( r"[A-Za-z0-9_\\/]+\.[0-9]{3}", catalog ) :
+            file_name = os.path.join( catalog_dir, *re.split( r"[\\/]", catalog_file ) )
+            if os.path.splitext( file_name )[1] == S57_BASE_CELL_EXTENSION and os.path.isfile( file_name ) and file_name not in cells :
+                cells.append( file_name )
+    cells.sort()
+    logger.info( str(len(cells)) + " S57 cells found in " + str(path) )
+    return cells
+
+
+def read_s57_cell ( file_name ) :
+    """Function to read spatials and features of cell in worker process; returns file name, cell and error message"""
+    try :
+        ds = open_s57_file ( file_name )
+        try :
+            cell = read_s57_spatials ( ds, file_name )
+            cell.feature_types = [ feature_type_dict for feature_type_dict in read_feature_types ( ds ) ]
+        finally :
+            ds.Destroy()
+        return file_name, cell, None
+    except Exception, err:
+        return file_name, None, str(err)
+
+
+def store_s57_cell ( db_connection, file_name, cell, error ) :
+    """Function to store cell read by read_s57_cell in db with a commit per cell; returns file name, status and message"""
+    if cell is None :
+        logger.error( "Read S57 cell " + str(file_name) + " failed: ERROR: " + str(error) )
+        return file_name, CELL_FAILED, error
+    try :
+        store_s57_spatials ( db_connection, cell )
+        for feature_type_dict in cell.feature_types :
+            db_connection.store_features ( [ feature_type_dict ], cell.dsid_dict[CELL_NAME] ) 
+        db_connection.commit()
+        logger.info( "S57 cell " + str(file_name) + " imported" )
+        return file_name, CELL_IMPORTED, None
+    except Exception, err:
+        db_connection.rollback()
+        logger.error( "Store S57 cell " + str(file_name) + " failed: ERROR: " + str(err) )
+        return file_name, CELL_FAILED, str(err)
+
+
+def import_s57_cells ( db_connection, file_names, nr_processes = S57_NR_PROCESSES ) :
+    """Function to read cells in worker processes and store them one by one in db; returns list of file name, status and message"""
+
+    # Cells are read in parallel; only this process writes to db, with a commit per cell
+    report = []
+    if nr_processes == 1 or len(file_names) <= 1 :
+        for file_name in file_names :
+            report.append( store_s57_cell( db_connection, *read_s57_cell( file_name ) ) )
+    else :
+        # Cells are queued a few per process, so read cells do not pile up while cells are stored
+        if nr_processes is None :
+            nr_processes = multiprocessing.cpu_count()
+        pending = collections.deque()
+        pool    = multiprocessing.Pool( nr_processes )
+        try :
+            for file_name in file_names :
+                if len(pending) >= S57_CELLS_PER_PROCESS * nr_processes :
+                    report.append( store_s57_cell( db_connection, *pending.popleft().get() ) )
+                pending.append( pool.apply_async( read_s57_cell, ( file_name, ) ) )
+            while pending :
+                report.append( store_s57_cell( db_connection, *pending.popleft().get() ) )
+        finally :
+            pool.close()
+            pool.join()
+
+    nr_imported = len( [ status for file_name, status, message in report if status == CELL_IMPORTED ] )
+    logger.info( str(nr_imported) + " of " + str(len(file_names)) + " S57 cells imported" )
+    for file_name, status, message in report :
+        if status == CELL_FAILED :
+            logger.info( "Failed: " + str(file_name) + ": " + str(message) )
+    return report
+
+
+def read_feature_types ( s57_file ) :
+
+    # Loop over feature types in file and yield features of each type; cell header and primitives are skipped
     for i in xrange(s57_file.GetLayerCount()) :
-        src_features = s57_file.GetLayerByName( s57_file.GetLayer(i).GetName() )        
-        if str(s57_file.GetLayer(i).GetName())<> DSID : 
-            feature_type_list.append( write_features_to_dict( src_features, LONG_NAME )) 
-    logger.info(str(i-1) + " feature types read from file")
+        src_features = s57_file.GetLayer(i)
+        if str(src_features.GetName()) not in ( DSID, VI, VC, VE ) : 
+            yield write_features_to_dict( src_features, LONG_NAME, False )
+
+
+def write_features_to_list ( s57_file ) :
+
+    # Write features of all feature types to list
+    feature_type_list = [ feature_type_dict for feature_type_dict in read_feature_types ( s57_file ) ]
+    logger.info(str(len(feature_type_list)) + " feature types read from file")
     return feature_type_list     
 
 
@@ -715,60 +1043,34 @@ def write_cell_header_dict ( features ) :
                 fields_dict[str(field_name)] = str(feature.GetFieldAsString(field_name))
     return fields_dict    
 
-def write_features_to_dict ( features, unique_identifier ) :
+def write_features_to_dict ( features, unique_identifier, read_coordinates = True ) :
 
-    # Loop over features and write to dictionary
+    # Loop over features and write records with typed fields to dictionary
+    # Without read_coordinates only the geometry type is kept, as for features
     features_dict = {}
     feature       = features.GetNextFeature()
     while feature is not None:
         fields_dict = {}
         for j in range( feature.GetFieldCount() ) :
             if feature.IsFieldSet(j) :
-                field_def = feature.GetFieldDefnRef(j)
-                field_name = field_def.GetName()
-                if str(field_name) == str(unique_identifier) :
-                    if str.isdigit(str(feature.GetFieldAsString(field_name))):
-                        record_id = int(feature.GetFieldAsString(field_name))
-                    else :
-                        record_id = str(feature.GetFieldAsString(field_name))
+                field_name = str(feature.GetFieldDefnRef(j).GetName())
+                if field_name == str(unique_identifier) :
+                    record_id = field_value( feature, j )
+                    if not isinstance( record_id, int ) and str.isdigit(record_id):
+                        record_id = int(record_id)
                 else :
-                    fields_dict[str(field_name)] = str(feature.GetFieldAsString(field_name))
-        if feature.GetGeometryRef() is not None :
-            fields_dict[GEOMETRY] = feature.GetGeometryRef().ExportToWkt()
-        features_dict[record_id] = fields_dict            
+                    fields_dict[field_name] = field_value( feature, j )
+        record = S57Record( record_id, fields_dict )
+        geom   = feature.GetGeometryRef()
+        if geom is not None :
+            record.gtype = geometry_type( geom )
+            if read_coordinates :
+                record.parts = geometry_parts( geom, 3 if record.gtype == 'MULTIPOINT Z' else 2 )
+        features_dict[record_id] = record
         feature = features.GetNextFeature()
     return features_dict
 
     
-def add_vc_to_ve ( ve_dict, vc_dict ) :
-
-    # Loop over ve, get start and end vc, update ve geometry and add to dictionary
-    for key in ve_dict :
-
-        # Get start and end vc and ve geometries
-        ve = ve_dict[key]
-        start_vc = vc_dict [ int(ve[START_VC]) ] 
-        end_vc = vc_dict [ int(ve[END_VC]) ] 
-        start_vc_geom = ogr.CreateGeometryFromWkt(start_vc[GEOMETRY])
-        end_vc_geom = ogr.CreateGeometryFromWkt(end_vc[GEOMETRY])
-        ve_geom = ogr.CreateGeometryFromWkt(ve[GEOMETRY])
-
-        # Init new ve and add vertices
-        new_ve_geom = ogr.Geometry(ogr.wkbLineString)
-        new_ve_geom.AddPoint(start_vc_geom.GetX(0),start_vc_geom.GetY(0))
-        for i in range(ve_geom.GetPointCount()) :
-            new_ve_geom.AddPoint(ve_geom.GetX(i),ve_geom.GetY(i))
-        new_ve_geom.AddPoint(end_vc_geom.GetX(0),end_vc_geom.GetY(0))
-
-        # Add updated ve to ve dictionanry
-        ve[GEOMETRY] = new_ve_geom.ExportToWkt() 
-        ve_dict[key] = ve
-
-    # Return ve dictionaty with updated ve geoemtries
-    return ve_dict
-
-    
-
 #########################################
 # Start main program
 #########################################
@@ -779,6 +1081,26 @@ if __name__ == "__main__":
         logger = start_logging()
 
         # TO DO: Set SYSDATE as GLOBAL
+
+        # Batch mode without GUI: S57_importer_v2.py <directory or CATALOG.031> [number of processes] [user/password@tns]
+        # Connection parameters are also taken from environment variables DB_USER_SOURCE, DB_PASSWORD_SOURCE and DB_TNS_SOURCE
+        if len(sys.argv) > 1 :
+            nr_processes = S57_NR_PROCESSES
+            if len(sys.argv) > 2 :
+                nr_processes = int(sys.argv[2])
+            if len(sys.argv) > 3 :
+                batch_db_parameters ( sys.argv[3] )
+            else :
+                batch_db_parameters ()
+            cells = find_s57_cells ( sys.argv[1] )
+            logger.info("Open database connection")
+            OracleConnection = DbConnectionClass ( PARAMETER_LIST_VALUE[ DB_USER_SOURCE ], PARAMETER_LIST_VALUE[ DB_PASSWORD_SOURCE ], PARAMETER_LIST_VALUE[ DB_TNS_SOURCE ], MODULE )       
+            report = import_s57_cells ( OracleConnection, cells, nr_processes )
+            logger.info ("Close database connection")
+            OracleConnection.rollback_close()
+            if CELL_FAILED in [ status for file_name, status, message in report ] :
+                sys.exit(1)
+            sys.exit(0)
         
         # Get database connection parameters
         logger.info("Get database connection parameters")